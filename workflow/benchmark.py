@@ -0,0 +1,172 @@
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+import numpy as np
+import pandas as pd
+
+import synthetic_data
+from instrumentation import StageTracer, children_peak_rss_kb, peak_rss_kb
+
+# Benchmarks workflow1 and workflow3 on synthetic NYPL-shaped data
+# (synthetic_data.py). Every benchmark runs in a fresh process so peak memory
+# isn't shared between runs; an instrumentation.StageTracer hook records the
+# time, peak RSS, rows and I/O of each stage. Results are written as JSON, and
+# --baseline compares them with an earlier results file to flag stages that
+# got slower.
+
+# name -> (workflow module, data_cleaning_project keyword arguments)
+BENCHMARKS = {
+    # cleans Dish_dirty.csv; its Usecase1Query only runs once data.db holds all four tables
+    'workflow1': ('workflow1', {}),
+    'workflow3': ('workflow3', {}),
+    'workflow3_compact': ('workflow3', {'compact_dtypes': True}),
+    'workflow3_streaming': ('workflow3', {'chunksize': 100000}),
+    'workflow3_parallel': ('workflow3', {'workers': os.cpu_count()}),
+    'workflow3_clustered': ('workflow3', {'cluster_threshold': 0.6}),
+}
+
+
+def run_benchmark(name, data_pth):
+    # Runs one benchmark in this process; used by the child processes.
+    module, kwargs = BENCHMARKS[name]
+    tracer = StageTracer()
+    error = None
+    start = time.perf_counter()
+    try:
+        importlib.import_module(module).data_cleaning_project(file_pth=data_pth, hooks=[tracer], **kwargs)
+    except Exception:
+        # keep the timings of the stages that did run
+        error = traceback.format_exc(limit=3)
+    return {
+        'benchmark': name,
+        'seconds': time.perf_counter() - start,
+        'peak_rss_kb': max([s['peak_rss_kb'] for s in tracer.stages], default=peak_rss_kb()),
+        # the largest worker process, e.g. of workflow3_parallel; 0 if there were none
+        'children_peak_rss_kb': children_peak_rss_kb(),
+        'stages': tracer.stages,
+        'error': error,
+    }
+
+
+def _run_child(name, data_pth):
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+        out = f.name
+    try:
+        # the workflows write their databases into the working directory
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name, '--data-pth', data_pth,
+                        '--output', out], cwd=data_pth, check=True, stdout=subprocess.DEVNULL)
+        with open(out) as f:
+            return json.load(f)
+    finally:
+        os.remove(out)
+
+
+# @BEGIN Run_Benchmarks @desc Generate synthetic data, run each workflow in a fresh process and collect stage timings.
+# @PARAM scale
+# @PARAM repeat
+# @PARAM benchmarks
+# @OUT benchmark_results @URI file:{output}
+def run_benchmarks(benchmarks, scale=1.0, repeat=1, data_pth=None, seed=0):
+    environment = {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+    generated = data_pth is None
+    if generated:
+        data_pth = tempfile.mkdtemp(prefix='nypl_benchmark_')
+    try:
+        data_pth = os.path.abspath(data_pth)
+        start = time.perf_counter()
+        rows = synthetic_data.generate(data_pth, scale, seed) if generated else None
+        results = {
+            'environment': environment,
+            'scale': scale if generated else None,
+            'seed': seed if generated else None,
+            'rows': rows,
+            'generate_seconds': time.perf_counter() - start if generated else None,
+            'runs': [],
+        }
+        for name in benchmarks:
+            for i in range(repeat):
+                run = _run_child(name, data_pth)
+                run['repeat'] = i
+                results['runs'].append(run)
+                status = 'failed' if run['error'] else 'ok'
+                workers = f", largest worker {run['children_peak_rss_kb'] / 1024:,.0f} MiB" if run['children_peak_rss_kb'] else ''
+                print(f"{name} #{i}: {run['seconds']:.2f}s, peak {run['peak_rss_kb'] / 1024:,.0f} MiB{workers}, {status}")
+    finally:
+        if generated:
+            shutil.rmtree(data_pth, ignore_errors=True)
+    return results
+# @END Run_Benchmarks
+
+
+def _best_stage_seconds(results):
+    best = {}
+    for run in results['runs']:
+        for stage in run['stages']:
+            key = (run['benchmark'], stage['stage'])
+            best[key] = min(best.get(key, float('inf')), stage['seconds'])
+    return best
+
+
+def compare(results, baseline, threshold=1.2, min_seconds=0.05):
+    # (benchmark, stage, baseline seconds, seconds) for every stage that got more
+    # than `threshold` times slower, comparing the best of the repeats.
+    # Stages under min_seconds in both runs are too noisy to judge.
+    old = _best_stage_seconds(baseline)
+    regressions = []
+    for key, seconds in _best_stage_seconds(results).items():
+        if key not in old or max(seconds, old[key]) < min_seconds:
+            continue
+        if seconds > old[key] * threshold:
+            regressions.append((key[0], key[1], old[key], seconds))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the workflows on synthetic NYPL menu data.')
+    parser.add_argument('--scale', type=float, default=1.0, help='data size; 1 is about the full NYPL export')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--benchmarks', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--data-pth', default=None,
+                        help='run on existing <Table>_dirty.csv and clean_data/ files instead of generating them')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=None, help='earlier results file to compare stage timings with')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='report stages that got slower than this factor of the baseline')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        with open(args.output, 'w') as f:
+            json.dump(run_benchmark(args.child, args.data_pth), f)
+        sys.exit(0)
+
+    results = run_benchmarks(args.benchmarks, args.scale, args.repeat, args.data_pth, args.seed)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'results written to {args.output}')
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for benchmark, stage, before, after in regressions:
+            print(f'REGRESSION {benchmark} {stage}: {before:.3f}s -> {after:.3f}s ({after / before:.2f}x)')
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,45 @@
+# The per-table bodies of the workflow3 cleaning stages, Handle_Missing_Values
+# .. Clip_Values. workflow3.py applies them to the four tables in memory,
+# scheduler.py to one table per worker process and streaming.py to one chunk at
+# a time, so every mode cleans with the same code. Tables are named as in
+# ingest.TABLE_SCHEMAS.
+
+# table -> the numerical column whose negative values become 0
+NEGATIVE_COLUMNS = {
+    'dish': 'times_appeared',
+    'menu_item': 'price',
+}
+
+# table -> the year columns clipped to [clip_lower, clip_upper]
+CLIP_COLUMNS = {
+    'dish': ['first_appeared', 'last_appeared'],
+}
+
+
+def handle_missing_values(frame):
+    return frame.ffill()
+
+
+def remove_duplicates(frame):
+    return frame.drop_duplicates()
+
+
+def standardize_name(name):
+    return name.strip().lower().replace(' ', '_')
+
+
+def standardize_columns(frame):
+    return frame.rename(columns=standardize_name)
+
+
+def clean_negative_values(frame, table):
+    if table in NEGATIVE_COLUMNS:
+        column = NEGATIVE_COLUMNS[table]
+        frame[column] = frame[column].where(frame[column] >= 0, 0)
+    return frame
+
+
+def clip_values(frame, table, clip_lower=1840, clip_upper=2008):
+    for column in CLIP_COLUMNS.get(table, []):
+        frame[column] = frame[column].clip(lower=clip_lower, upper=clip_upper)
+    return frame
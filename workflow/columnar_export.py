@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import shutil
+
+import pandas as pd
+
+import dates
+import schema
+
+# Columnar export of the cleaned tables for analysis outside SQLite. Every
+# table is written as a Hive-partitioned Parquet dataset (<table>/year=1900/...)
+# next to a denormalized fact table, menu_item joined with menu_page, menu and
+# dish, so a trend analysis needs neither the CSVs nor the joins. read_table()
+# prunes partitions from a year range and pushes the other filters down to the
+# Parquet row-group statistics, and only the requested columns are decoded.
+# The year is the parsed menu year from dates.py; menu_page and menu_item get
+# theirs through their menu. dish has no year of its own and is one file.
+# The partition key is written and read back as int16 (Int64 in pandas, as
+# dates.py makes it). Rows without a year, an undated menu or a page or item
+# whose menu is missing, go to the year=__HIVE_DEFAULT_PARTITION__ directory,
+# read back with a NULL year and are left out by any `years` range.
+
+# table -> columns renamed in the fact table, where the names would clash
+FACT_COLUMNS = {
+    'menu_item': {
+        'id': 'menu_item_id',
+        'menu_page_id': 'menu_page_id',
+        'dish_id': 'dish_id',
+        'price': 'price',
+        'high_price': 'high_price',
+        'xpos': 'xpos',
+        'ypos': 'ypos',
+        'created_at_epoch': 'created_at_epoch',
+        'updated_at_epoch': 'updated_at_epoch',
+    },
+    'menu_page': {
+        'id': 'menu_page_id',
+        'menu_id': 'menu_id',
+        'page_number': 'page_number',
+    },
+    'menu': {
+        'id': 'menu_id',
+        'name': 'menu_name',
+        'sponsor': 'sponsor',
+        'event': 'event',
+        'venue': 'venue',
+        'place': 'place',
+        'occasion': 'occasion',
+        'location': 'location',
+        'location_type': 'location_type',
+        'currency': 'currency',
+        'currency_symbol': 'currency_symbol',
+        'status': 'status',
+        'date': 'date',
+        'date_epoch': 'date_epoch',
+        'year': 'year',
+    },
+    'dish': {
+        'id': 'dish_id',
+        'name': 'dish_name',
+        'first_appeared': 'dish_first_appeared',
+        'last_appeared': 'dish_last_appeared',
+    },
+}
+
+PARTITION_COLUMN = 'year'
+
+
+def _pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise ImportError('the Parquet export needs pyarrow: pip install pyarrow') from e
+
+
+def _project(frame, columns):
+    present = {column: name for column, name in columns.items() if column in frame.columns}
+    return frame[list(present)].rename(columns=present)
+
+
+def table_years(frames):
+    # {table: year Series aligned with the table}, for the tables that have one
+    menu_year = frames['menu'].set_index('id')['year']
+    years = {'menu': frames['menu']['year']}
+    if 'menu_page' in frames:
+        page_year = frames['menu_page']['menu_id'].map(menu_year)
+        years['menu_page'] = page_year
+        if 'menu_item' in frames:
+            years['menu_item'] = frames['menu_item']['menu_page_id'].map(
+                pd.Series(page_year.to_numpy(), index=frames['menu_page']['id']))
+    return years
+
+
+def fact_table(frames, dish_clusters=None):
+    # menu_item left-joined to its page, menu and dish; one row per menu item.
+    # With a dish_clusters.cluster_dishes() mapping, canonical_dish_id and
+    # canonical_name are added as well.
+    fact = _project(frames['menu_item'], FACT_COLUMNS['menu_item'])
+    fact = fact.merge(_project(frames['menu_page'], FACT_COLUMNS['menu_page']), on='menu_page_id', how='left')
+    fact = fact.merge(_project(frames['menu'], FACT_COLUMNS['menu']), on='menu_id', how='left')
+    fact = fact.merge(_project(frames['dish'], FACT_COLUMNS['dish']), on='dish_id', how='left')
+    if dish_clusters is not None:
+        fact = fact.merge(dish_clusters[['dish_id', 'canonical_dish_id', 'canonical_name']], on='dish_id', how='left')
+    return fact
+
+
+def _partitioning():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    return ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.int16())]), flavor='hive')
+
+
+def _write_dataset(frame, path, partitioned):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    # a rerun replaces the dataset, so partitions of years that are gone don't linger
+    shutil.rmtree(path, ignore_errors=True)
+    sort = [PARTITION_COLUMN, frame.columns[0]] if partitioned else [frame.columns[0]]
+    table = pa.Table.from_pandas(frame.sort_values(sort, kind='stable', na_position='last'), preserve_index=False)
+    partitioning = None
+    if partitioned:
+        table = table.set_column(table.schema.get_field_index(PARTITION_COLUMN), PARTITION_COLUMN,
+                                 table[PARTITION_COLUMN].cast(pa.int16()))
+        partitioning = _partitioning()
+    ds.write_dataset(table, path, format='parquet', partitioning=partitioning,
+                     max_rows_per_group=128 * 1024, existing_data_behavior='overwrite_or_ignore')
+    return table.num_rows
+
+
+# @BEGIN Export_Parquet @desc Write the cleaned tables and the menu item fact table as Parquet partitioned by year.
+# @IN typed_frames
+# @IN dish_clusters
+# @OUT parquet_export @URI file:{export_pth}/{table}/year={year}/*.parquet
+def export_parquet(frames, export_pth, dish_clusters=None):
+    # frames: the typed frames from dates.normalize_dates, keyed like ingest.TABLE_SCHEMAS.
+    # Returns {dataset: rows written}; a manifest.json with the same is written too.
+    _pyarrow()
+    years = table_years(frames)
+    datasets = {}
+    for table, frame in frames.items():
+        if table in years and table != 'menu':
+            frame = frame.assign(**{PARTITION_COLUMN: pd.array(years[table], dtype='Int64')})
+        datasets[table] = (frame, table in years)
+    datasets['fact_menu_item'] = (fact_table(frames, dish_clusters), True)
+    os.makedirs(export_pth, exist_ok=True)
+    rows = {}
+    for name, (frame, partitioned) in datasets.items():
+        rows[name] = _write_dataset(frame, os.path.join(export_pth, name), partitioned)
+    with open(os.path.join(export_pth, 'manifest.json'), 'w') as f:
+        json.dump({
+            'partition_column': PARTITION_COLUMN,
+            'partitioned': [name for name, (_, partitioned) in datasets.items() if partitioned],
+            'rows': rows,
+        }, f, indent=2)
+    return rows
+# @END Export_Parquet
+
+
+def _dataset(export_pth, table):
+    _pyarrow()
+    import pyarrow.dataset as ds
+    # with the key's type given, year reads back as the int16 it was written as
+    # instead of the int32 pyarrow would infer from the directory names
+    with open(os.path.join(export_pth, 'manifest.json')) as f:
+        partitioned = table in json.load(f)['partitioned']
+    return ds.dataset(os.path.join(export_pth, table), format='parquet', partitioning=_partitioning() if partitioned else None)
+
+
+def _filter(years=None, filters=None):
+    # years: (first, last) inclusive, either end None; filters: [(column, op, value)]
+    # as in pandas.read_parquet, e.g. [('price', '>', 1.0)]
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    expression = None
+    terms = []
+    if years is not None:
+        first, last = years
+        if first is not None:
+            terms.append(ds.field(PARTITION_COLUMN) >= first)
+        if last is not None:
+            terms.append(ds.field(PARTITION_COLUMN) <= last)
+    if filters:
+        terms.append(pq.filters_to_expression(filters))
+    for term in terms:
+        expression = term if expression is None else expression & term
+    return expression
+
+
+def read_table(export_pth, table, columns=None, years=None, filters=None):
+    # One exported dataset as a DataFrame. Partitions outside `years` aren't
+    # opened, `filters` skip the row groups whose statistics rule them out, and
+    # only `columns` are read.
+    dataset = _dataset(export_pth, table)
+    if years is not None and PARTITION_COLUMN not in dataset.schema.names:
+        raise ValueError(f'{table} is not partitioned by {PARTITION_COLUMN}')
+    return dataset.to_table(columns=columns, filter=_filter(years, filters)).to_pandas()
+
+
+def files_read(export_pth, table, years=None, filters=None):
+    # The Parquet files read_table() would open for the same arguments.
+    dataset = _dataset(export_pth, table)
+    return sorted(fragment.path for fragment in dataset.get_fragments(filter=_filter(years, filters)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the cleaned tables as year-partitioned Parquet, or read them back.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export = subparsers.add_parser('export', help='export clean_data/<Table>_clean_final.csv')
+    export.add_argument('export_pth')
+    export.add_argument('--file-pth', default='.')
+    read = subparsers.add_parser('read', help='read one dataset with partition and column pruning')
+    read.add_argument('export_pth')
+    read.add_argument('table')
+    read.add_argument('--years', nargs=2, type=int, default=None, metavar=('FIRST', 'LAST'))
+    read.add_argument('--columns', nargs='+', default=None)
+    read.add_argument('--output', default=None, help='write the rows to this CSV instead of summarizing them')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        frames = {table: schema.read_clean_table(args.file_pth, table, 'clean_final') for table in schema.CSV_NAMES}
+        frames, _ = dates.normalize_dates(frames)
+        for name, count in export_parquet(frames, args.export_pth).items():
+            print(f'{name}: {count:,} rows')
+    else:
+        files = files_read(args.export_pth, args.table, args.years)
+        frame = read_table(args.export_pth, args.table, args.columns, args.years)
+        if args.output is not None:
+            frame.to_csv(args.output, index=False)
+        print(f'{len(frame):,} rows, {len(frame.columns)} columns from {len(files)} files '
+              f'({sum(os.path.getsize(f) for f in files):,} bytes)')
@@ -0,0 +1,168 @@
+import numpy as np
+import pandas as pd
+
+# Parses the text dates of the cleaned tables once, before they are loaded, so
+# the database keeps typed columns next to the text: menu.year and
+# menu.date_epoch, menu_item.created_at_epoch and updated_at_epoch (seconds
+# since 1970-01-01 UTC). Each column is parsed with its known formats in turn,
+# vectorized over the rows still unparsed (fixed-width layouts by numpy
+# arithmetic on the characters, anything else by strptime), instead of SQLite
+# re-parsing substr(date, 1, 4) on every query. Values that don't parse, or parse to a year
+# that can't be a menu's (0190-03-06, 1091-01-27, 2928-03-26), become NULL and
+# are listed in the invalid_dates side table.
+
+# Years accepted for a date: the first as in the CHK_first_appeared/
+# CHK_last_appeared constraints, the last a fixed year after the NYPL exports
+# this project cleans (not today's year, so a rerun gives the same result);
+# pass max_year for a newer export.
+MIN_YEAR = 1840
+MAX_YEAR = 2025
+
+# table -> [(text column, formats tried in order, epoch column)]
+DATE_COLUMNS = {
+    'menu': [
+        ('date', ['%Y-%m-%d', '%Y-%m-%dT%H:%M:%SZ'], 'date_epoch'),
+    ],
+    'menu_item': [
+        # as exported by NYPL, and after OpenRefine's value.toDate()
+        ('created_at', ['%Y-%m-%d %H:%M:%S UTC', '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%d %H:%M:%S'], 'created_at_epoch'),
+        ('updated_at', ['%Y-%m-%d %H:%M:%S UTC', '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%d %H:%M:%S'], 'updated_at_epoch'),
+    ],
+}
+
+# table -> (date column, year column)
+YEAR_COLUMNS = {
+    'menu': ('date', 'year'),
+}
+
+
+# strptime directives of fixed width, for the fast path
+_FIELD_WIDTHS = {'%Y': 4, '%m': 2, '%d': 2, '%H': 2, '%M': 2, '%S': 2}
+
+
+def _layout(fmt):
+    # ({directive: offset}, {offset: literal char}, width) when fmt only has
+    # fixed-width fields and literals, else None
+    fields, literals, i, width = {}, {}, 0, 0
+    while i < len(fmt):
+        if fmt[i] == '%':
+            directive = fmt[i:i + 2]
+            if directive not in _FIELD_WIDTHS or directive in fields:
+                return None
+            fields[directive] = width
+            width += _FIELD_WIDTHS[directive]
+            i += 2
+        else:
+            literals[width] = fmt[i]
+            width += 1
+            i += 1
+    return fields, literals, width
+
+
+def _parse_fixed(text, layout):
+    # numpy version of strptime for one fixed-width layout: the strings become
+    # a (rows, width) array of code points and every field is a few array ops.
+    fields, literals, width = layout
+    parsed = np.full(len(text), np.datetime64('NaT'), dtype='datetime64[s]')
+    candidates = (text.str.len() == width).to_numpy(dtype=bool, na_value=False)
+    if not candidates.any():
+        return parsed
+    chars = text[candidates].to_numpy(dtype=object).astype(f'U{width}').view(np.uint32).reshape(-1, width)
+    ok = np.ones(len(chars), dtype=bool)
+    for offset, char in literals.items():
+        ok &= chars[:, offset] == ord(char)
+    values = {}
+    for directive, offset in fields.items():
+        digits = chars[:, offset:offset + _FIELD_WIDTHS[directive]].astype(np.int64) - ord('0')
+        ok &= ((digits >= 0) & (digits <= 9)).all(axis=1)
+        values[directive] = digits @ (10 ** np.arange(digits.shape[1] - 1, -1, -1))
+    year = values['%Y']
+    month = values.get('%m', np.ones_like(year))
+    day = values.get('%d', np.ones_like(year))
+    hour, minute, second = (values.get(d, np.zeros_like(year)) for d in ('%H', '%M', '%S'))
+    ok &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31) & (hour < 24) & (minute < 60) & (second < 60)
+    months = np.where(ok, (year - 1970) * 12 + month - 1, 0).astype('datetime64[M]')
+    days = months.astype('datetime64[D]') + np.where(ok, day - 1, 0)
+    # 1900-02-30 rolls into March
+    ok &= days.astype('datetime64[M]') == months
+    seconds = days.astype('datetime64[s]') + (hour * 3600 + minute * 60 + second)
+    parsed[np.flatnonzero(candidates)] = np.where(ok, seconds, np.datetime64('NaT'))
+    return parsed
+
+
+def parse_dates(values, formats):
+    # datetime64[s] Series, NaT where no format matched. Fixed-width formats go
+    # through _parse_fixed; what's left (padding, other layouts) through strptime.
+    text = values.astype('str').where(values.notna())
+    parsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[s]')
+    remaining = text.notna().to_numpy() & (text != '').to_numpy(dtype=bool, na_value=False)
+    for fmt in formats:
+        layout = _layout(fmt)
+        if layout is None or not remaining.any():
+            continue
+        rows = np.flatnonzero(remaining)
+        attempt = _parse_fixed(text.iloc[rows], layout)
+        parsed.iloc[rows] = attempt
+        remaining[rows] = np.isnat(attempt)
+    for fmt in formats:
+        if not remaining.any():
+            break
+        rows = np.flatnonzero(remaining)
+        attempt = pd.to_datetime(text.iloc[rows].str.strip(), format=fmt, errors='coerce').astype('datetime64[s]')
+        parsed.iloc[rows] = attempt.to_numpy()
+        remaining[rows] = attempt.isna().to_numpy()
+    return parsed
+
+
+def epoch_seconds(parsed):
+    seconds = pd.Series(parsed.to_numpy().astype('int64'), index=parsed.index, dtype='Int64')
+    return seconds.mask(parsed.isna())
+
+
+def _invalid(table, column, frame, mask, reason):
+    ids = frame['id'] if 'id' in frame.columns else pd.Series(frame.index, index=frame.index)
+    return pd.DataFrame({
+        'table_name': table,
+        'column_name': column,
+        'id': pd.to_numeric(ids[mask], errors='coerce').astype('Int64').to_numpy(),
+        'value': frame.loc[mask, column].astype(str).to_numpy(),
+        'reason': reason,
+    })
+
+
+# @BEGIN Normalize_Dates @desc Parse the text date columns into epoch seconds and years, and list the invalid dates.
+# @PARAM min_year
+# @PARAM max_year
+# @IN frames
+# @OUT typed_frames
+# @OUT invalid_dates
+def normalize_dates(frames, min_year=MIN_YEAR, max_year=MAX_YEAR):
+    # frames: {'menu': DataFrame, 'menu_item': ..., ...} keyed like ingest.TABLE_SCHEMAS.
+    # Returns (frames with the epoch and year columns added, DataFrame of
+    # (table_name, column_name, id, value, reason) for every invalid date).
+    typed = dict(frames)
+    invalid = []
+    for table, columns in DATE_COLUMNS.items():
+        if table not in frames:
+            continue
+        frame = frames[table]
+        added = {}
+        for column, formats, epoch_column in columns:
+            parsed = parse_dates(frame[column], formats)
+            text = frame[column].astype('str').str.strip()
+            present = frame[column].notna().to_numpy() & (text != '').to_numpy(dtype=bool, na_value=False)
+            unparsed = present & parsed.isna().to_numpy()
+            years = parsed.dt.year.to_numpy(dtype='float64', na_value=np.nan)
+            with np.errstate(invalid='ignore'):
+                out_of_range = (years < min_year) | (years > max_year)
+            parsed[out_of_range] = pd.NaT
+            invalid.append(_invalid(table, column, frame, unparsed, 'unparseable'))
+            invalid.append(_invalid(table, column, frame, out_of_range, 'out_of_range'))
+            added[epoch_column] = epoch_seconds(parsed)
+            if YEAR_COLUMNS.get(table, (None,))[0] == column:
+                added[YEAR_COLUMNS[table][1]] = parsed.dt.year.astype('Int64')
+        typed[table] = frame.assign(**added)
+    invalid = pd.concat(invalid, ignore_index=True) if invalid else pd.DataFrame(
+        columns=['table_name', 'column_name', 'id', 'value', 'reason'])
+    return typed, invalid
+# @END Normalize_Dates
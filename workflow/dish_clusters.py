@@ -0,0 +1,172 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# Proposes canonical dishes for near-duplicate dish names ("Consommé",
+# "consomme", "Consomme "), the programmatic version of OpenRefine's clustering.
+# Names are first grouped by their key-collision fingerprint (OpenRefine's
+# "fingerprint" method: accents folded, lowercased, punctuation dropped, tokens
+# sorted and deduplicated); letters of other scripts are kept, and a name left
+# with an empty key (only punctuation) is a cluster of its own. Distinct fingerprints are then compared with MinHash
+# signatures over character 3-grams, and LSH banding only compares keys that
+# share a band bucket, so the whole table is clustered in near-linear time.
+# The result maps every dish id to a canonical dish id and name.
+
+_PRIME = (1 << 31) - 1
+
+# Latin letters that NFKD doesn't decompose into a base letter and an accent
+_FOLD = str.maketrans({'ø': 'o', 'æ': 'ae', 'œ': 'oe', 'ß': 'ss', 'ł': 'l', 'đ': 'd', 'ð': 'd', 'þ': 'th', 'ı': 'i'})
+
+
+def fingerprint(names):
+    # Vectorized over the distinct names; returns a Series aligned with `names`.
+    # The accents split off by NFKD are combining marks, which aren't \w and
+    # so go with the punctuation.
+    codes, uniques = pd.factorize(names.fillna(''))
+    keys = (pd.Series(uniques, dtype=object).str.normalize('NFKD')
+            .str.lower()
+            .str.translate(_FOLD)
+            .str.replace(r'[^\w\s]', '', regex=True)
+            .str.split())
+    keys = keys.map(lambda tokens: ' '.join(sorted(set(tokens))))
+    return pd.Series(keys.to_numpy(dtype=object).take(codes), index=names.index)
+
+
+def _ngram_codes(keys, n=3):
+    # (key index, n-gram code) for every character n-gram of the space-padded keys.
+    # A code point takes 21 bits, so an n-gram of up to 3 characters packs into one integer.
+    padded = [f' {key} ' for key in keys]
+    lengths = np.fromiter((len(k) for k in padded), dtype=np.int64, count=len(padded))
+    buf = np.frombuffer(''.join(padded).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    owner = np.repeat(np.arange(len(padded)), lengths)
+    # positions where an n-gram doesn't run past the end of its key
+    offset = np.arange(len(buf)) - np.repeat(starts, lengths)
+    valid = offset <= np.repeat(lengths, lengths) - n
+    pos = np.flatnonzero(valid)
+    codes = np.zeros(len(pos), dtype=np.uint64)
+    for i in range(n):
+        codes = (codes << np.uint64(21)) | buf[pos + i]
+    return owner[pos], codes
+
+
+def minhash_signatures(keys, num_perm=64, seed=0):
+    # (len(keys), num_perm) uint32 MinHash signatures over character 3-grams.
+    owner, codes = _ngram_codes(keys)
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)
+    b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)
+    # n-grams are grouped by key already, so each key's minimum is one reduceat
+    firsts = np.flatnonzero(np.r_[True, owner[1:] != owner[:-1]])
+    signatures = np.full((len(keys), num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+    prime = np.uint64(_PRIME)
+    for i in range(num_perm):
+        hashed = (a[i] * codes + b[i]) % prime
+        signatures[owner[firsts], i] = np.minimum.reduceat(hashed, firsts)
+    return signatures
+
+
+def _components(n, left, right):
+    # Connected components of an edge list by label propagation with pointer jumping.
+    labels = np.arange(n)
+    while True:
+        low = np.minimum(labels[left], labels[right])
+        before = labels.copy()
+        np.minimum.at(labels, left, low)
+        np.minimum.at(labels, right, low)
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+        if np.array_equal(labels, before):
+            return labels
+
+
+def lsh_clusters(signatures, bands=16, threshold=0.6, blocks=None):
+    # Cluster label per signature row. Rows sharing a bucket in any band are
+    # candidates; a candidate is linked to its bucket's first row when their
+    # estimated Jaccard similarity (share of equal MinHashes) reaches threshold
+    # and, if blocks is given, both rows are in the same block.
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    left, right = [], []
+    for band in range(bands):
+        block = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        buckets = pd.factorize(block.view(f'V{block.itemsize * rows}').ravel())[0]
+        order = np.argsort(buckets, kind='stable')
+        sorted_buckets = buckets[order]
+        firsts = np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]]
+        leader = order[np.flatnonzero(firsts)][np.cumsum(firsts) - 1]
+        candidates = leader != order
+        left.append(leader[candidates])
+        right.append(order[candidates])
+    left = np.concatenate(left)
+    right = np.concatenate(right)
+    pairs = np.unique(np.stack([left, right], axis=1), axis=0) if len(left) else np.empty((0, 2), dtype=np.int64)
+    similarity = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+    matched = similarity >= threshold
+    if blocks is not None:
+        matched &= blocks[pairs[:, 0]] == blocks[pairs[:, 1]]
+    keep = pairs[matched]
+    return _components(n, keep[:, 0], keep[:, 1])
+
+
+# @BEGIN Cluster_Dish_Names @desc Map near-duplicate dish names to a canonical dish with fingerprints and MinHash/LSH.
+# @PARAM threshold
+# @IN dish_clean_final
+# @OUT dish_clusters
+def cluster_dishes(dish, threshold=0.6, num_perm=64, bands=16, seed=0):
+    # dish: DataFrame with id, name and (optionally) times_appeared.
+    # Returns DataFrame(dish_id, canonical_dish_id, canonical_name, method) where
+    # method is 'self', 'fingerprint' (same key) or 'minhash' (similar keys).
+    dish = dish[dish['id'].notna()]
+    keys = fingerprint(dish['name'])
+    key_codes, unique_keys = pd.factorize(keys)
+    has_text = pd.Series(unique_keys).str.len().to_numpy() > 0
+    key_cluster = np.arange(len(unique_keys))
+    if has_text.any():
+        text_keys = np.flatnonzero(has_text)
+        signatures = minhash_signatures(unique_keys[text_keys], num_perm, seed)
+        # "Margaux 1870" and "Margaux 1878" are different wines: only names with
+        # the same numbers are merged on similarity
+        numbers = pd.factorize(pd.Series(unique_keys[text_keys]).str.findall(r'\d+').str.join(' '))[0]
+        key_cluster[text_keys] = text_keys[lsh_clusters(signatures, bands, threshold, numbers)]
+    cluster = key_cluster[key_codes]
+    # names without a key have nothing in common with each other
+    no_key = ~has_text[key_codes]
+    cluster[no_key] = len(unique_keys) + np.arange(no_key.sum())
+
+    weight = dish['times_appeared'] if 'times_appeared' in dish.columns else pd.Series(1, index=dish.index)
+    frame = pd.DataFrame({
+        'dish_id': dish['id'].astype('int64').to_numpy(),
+        'name': dish['name'].to_numpy(),
+        'key': key_codes,
+        'cluster': cluster,
+        'weight': pd.to_numeric(weight, errors='coerce').fillna(0).to_numpy(),
+    })
+    # the most-used dish of each cluster (lowest id on ties) is the canonical one
+    leaders = frame.sort_values(['cluster', 'weight', 'dish_id'], ascending=[True, False, True]).drop_duplicates('cluster')
+    leaders = leaders.set_index('cluster')
+    frame['canonical_dish_id'] = leaders['dish_id'].reindex(frame['cluster']).to_numpy()
+    frame['canonical_name'] = leaders['name'].reindex(frame['cluster']).str.strip().to_numpy()
+    canonical_key = leaders['key'].reindex(frame['cluster']).to_numpy()
+    frame['method'] = np.where(frame['dish_id'] == frame['canonical_dish_id'], 'self',
+                               np.where(frame['key'] == canonical_key, 'fingerprint', 'minhash'))
+    return frame[['dish_id', 'canonical_dish_id', 'canonical_name', 'method']]
+# @END Cluster_Dish_Names
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Propose canonical dishes for near-duplicate dish names.')
+    parser.add_argument('dish_csv')
+    parser.add_argument('output_csv')
+    parser.add_argument('--threshold', type=float, default=0.6,
+                        help='estimated 3-gram Jaccard similarity needed to merge two names')
+    args = parser.parse_args()
+    clusters = cluster_dishes(pd.read_csv(args.dish_csv), args.threshold)
+    clusters.to_csv(args.output_csv, index=False)
+    merged = clusters[clusters['method'] != 'self']
+    print(f"{len(clusters):,} dishes, {clusters['canonical_dish_id'].nunique():,} canonical; "
+          f"{(merged['method'] == 'fingerprint').sum():,} merged by fingerprint, {(merged['method'] == 'minhash').sum():,} by MinHash")
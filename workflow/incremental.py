@@ -0,0 +1,425 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+import ingest
+
+# Incremental load of a batch of cleaned rows into an existing restaurant_menus.db,
+# instead of ingest.bulk_load()'s full replace. Rows are matched by primary key
+# and a content hash kept in the row_hashes table: unchanged rows are skipped,
+# new and changed ones are written with INSERT ... ON CONFLICT (id) DO UPDATE.
+# The derived data is then adjusted rather than rebuilt: the menu items the
+# batch touches (its own, and those of changed dishes, pages and menus) are
+# read before and after the upsert, and the difference is applied to
+# dish_year_counts and to the appearance counts of the dishes involved. Rows
+# missing from a batch are kept; the batch never deletes anything. Rows the
+# schema refuses are set aside as by bulk_load(), so a repeated id keeps its
+# first row. A renamed dish loses its dish_clusters entry (and so do the
+# other dishes of its cluster, if it was the canonical one): they are counted
+# under their own names until the dishes are clustered again.
+#
+# This saves the database writes and the dish_year_counts rebuild, not the
+# work before them: workflow3.py --incremental still cleans, date-parses and
+# hashes the whole archive on every run, so that part grows with the archive
+# rather than with the batch.
+
+# foreign key order
+LOAD_ORDER = ['dish', 'menu', 'menu_page', 'menu_item']
+
+_HASH_UPSERT = '''
+    INSERT INTO row_hashes (table_name, id, hash) VALUES (?, ?, ?)
+    ON CONFLICT (table_name, id) DO UPDATE SET hash = excluded.hash
+'''
+
+_BATCH_HASHES = '''
+    SELECT row_hashes.id, row_hashes.hash
+    FROM temp.batch_ids CROSS JOIN row_hashes ON row_hashes.table_name = ? AND row_hashes.id = batch_ids.id
+'''
+
+_COUNTS_UPSERT = '''
+    INSERT INTO dish_year_counts (year, name, occurrences) VALUES (?, ?, ?)
+    ON CONFLICT (year, name) DO UPDATE SET occurrences = occurrences + excluded.occurrences
+'''
+
+# Menu items linked to a row of the batch. CROSS JOIN keeps SQLite from
+# scanning menu_item: the small temp table drives the index lookups.
+_TOUCHED_ITEMS = '''
+    INSERT OR IGNORE INTO temp.touched_items (id)
+    SELECT id FROM temp.delta_rows WHERE table_name = 'menu_item'
+    UNION ALL
+    SELECT menu_item.id FROM temp.delta_rows CROSS JOIN menu_item ON menu_item.dish_id = delta_rows.id
+    WHERE delta_rows.table_name = 'dish'
+    UNION ALL
+    SELECT menu_item.id FROM temp.delta_rows CROSS JOIN menu_item ON menu_item.menu_page_id = delta_rows.id
+    WHERE delta_rows.table_name = 'menu_page'
+    UNION ALL
+    SELECT menu_item.id FROM temp.delta_rows
+        CROSS JOIN menu_page ON menu_page.menu_id = delta_rows.id
+        CROSS JOIN menu_item ON menu_item.menu_page_id = menu_page.id
+    WHERE delta_rows.table_name = 'menu'
+'''
+
+# What the touched items contribute to the derived data; `counted` is the
+# WHERE clause of ingest.DISH_YEAR_COUNTS_REFRESH.
+_TOUCHED_SNAPSHOT = '''
+    SELECT
+        menu_item.id AS item_id,
+        menu_item.dish_id AS dish_id,
+        menu.id AS menu_id,
+        menu.year AS year,
+        COALESCE(dish_clusters.canonical_name, dish.name) AS name,
+        (dish.id IS NOT NULL AND menu_page.id IS NOT NULL AND menu.year IS NOT NULL AND
+         dish.name NOT LIKE '"' AND dish.name NOT LIKE '" %') AS counted
+    FROM
+            temp.touched_items
+            CROSS JOIN menu_item ON menu_item.id = touched_items.id
+            LEFT JOIN dish ON menu_item.dish_id = dish.id
+            LEFT JOIN menu_page ON menu_item.menu_page_id = menu_page.id
+            LEFT JOIN menu ON menu_page.menu_id = menu.id
+            LEFT JOIN dish_clusters ON dish_clusters.dish_id = dish.id
+'''
+
+# The dishes of the batch (temp.batch_dishes) whose name changed, and the
+# dishes clustered with them, so their clusters no longer apply
+_STALE_CLUSTERS = '''
+    WITH renamed AS (
+        SELECT batch_dishes.id FROM temp.batch_dishes CROSS JOIN dish ON dish.id = batch_dishes.id
+        WHERE dish.name IS NOT batch_dishes.name
+    )
+    SELECT dish_id FROM dish_clusters
+    WHERE dish_id IN (SELECT id FROM renamed) OR canonical_dish_id IN (SELECT id FROM renamed)
+'''
+
+_CLUSTERS_UPSERT = '''
+    INSERT INTO dish_clusters (dish_id, canonical_dish_id, canonical_name, method) VALUES (?, ?, ?, ?)
+    ON CONFLICT (dish_id) DO UPDATE SET
+        canonical_dish_id = excluded.canonical_dish_id,
+        canonical_name = excluded.canonical_name,
+        method = excluded.method
+'''
+
+# Items per (dish, menu) pair whose count changed, through the pages of the
+# menu; a popular dish's other menus are never read.
+_DISH_MENU_ITEMS = '''
+    SELECT adjusted_pairs.dish_id, adjusted_pairs.menu_id, COUNT(menu_item.id)
+    FROM
+            temp.adjusted_pairs
+            CROSS JOIN menu_page ON menu_page.menu_id = adjusted_pairs.menu_id
+            CROSS JOIN menu_item ON menu_item.menu_page_id = menu_page.id AND menu_item.dish_id = adjusted_pairs.dish_id
+    GROUP BY adjusted_pairs.dish_id, adjusted_pairs.menu_id
+'''
+
+_DISH_UPDATE = '''
+    UPDATE dish SET
+        times_appeared = MAX(times_appeared + ?, 0),
+        menus_appeared = MAX(menus_appeared + ?, 0),
+        first_appeared = COALESCE(MIN(first_appeared, ?), first_appeared, ?),
+        last_appeared = COALESCE(MAX(last_appeared, ?), last_appeared, ?)
+    WHERE id = ?
+'''
+
+
+def upsert_statement(table):
+    columns = [name for name, _ in ingest.table_columns(table)]
+    updates = ', '.join(f'{name} = excluded.{name}' for name in columns if name != 'id')
+    return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT (id) DO UPDATE SET {updates}")
+
+
+def row_hashes(frame, table):
+    # int64 hash of every row over the table's schema columns, with each column
+    # normalized as it is bound, so a CSV row and the same row read back from
+    # the database hash alike.
+    columns = {}
+    for name, sqltype in ingest.table_columns(table):
+        values = ingest._typed_series(frame[name], sqltype)
+        if sqltype == 'TEXT':
+            values = values.where(values.notna(), '\x00')
+        elif sqltype == 'REAL':
+            # SQLite stores -0.0 as 0
+            values = values + 0.0
+        columns[name] = values
+    hashed = pd.util.hash_pandas_object(pd.DataFrame(columns), index=False)
+    return hashed.to_numpy().view('int64')
+
+
+def _seed_hashes(db_conn, table):
+    # A table loaded by bulk_load() has no hashes yet, so its rows are hashed
+    # once from the database; later batches only look up their own ids.
+    if db_conn.execute('SELECT 1 FROM row_hashes WHERE table_name = ? LIMIT 1', (table,)).fetchone() is not None:
+        return
+    columns = [name for name, _ in ingest.table_columns(table)]
+    existing = pd.read_sql_query(f"SELECT {', '.join(columns)} FROM {table}", db_conn)
+    if not existing.empty:
+        db_conn.executemany(_HASH_UPSERT, zip([table] * len(existing), existing['id'].tolist(),
+                                              row_hashes(existing, table).tolist()))
+
+
+def _stored_hashes(db_conn, table, ids):
+    # Series of hash by id, for the ids of the batch that are already loaded
+    _seed_hashes(db_conn, table)
+    db_conn.execute('CREATE TEMP TABLE batch_ids (id INTEGER PRIMARY KEY)')
+    db_conn.executemany('INSERT INTO temp.batch_ids (id) VALUES (?)', ((i,) for i in ids.tolist()))
+    stored = pd.read_sql_query(_BATCH_HASHES, db_conn, params=(table,))
+    db_conn.execute('DROP TABLE temp.batch_ids')
+    return pd.Series(stored['hash'].to_numpy(dtype='int64'), index=stored['id'].to_numpy(dtype='int64'))
+
+
+def _snapshot(db_conn):
+    snapshot = pd.read_sql_query(_TOUCHED_SNAPSHOT, db_conn)
+    return snapshot.astype({'dish_id': 'Int64', 'menu_id': 'Int64', 'year': 'Int64'})
+
+
+def _year_count_changes(before, after):
+    # {(year, name): occurrences after - before} for the keys that changed
+    def counts(snapshot):
+        counted = snapshot[snapshot['counted'] == 1]
+        return counted.groupby(['year', 'name']).size()
+    change = counts(after).sub(counts(before), fill_value=0).astype('int64')
+    return change[change != 0]
+
+
+def _apply_year_count_changes(db_conn, change):
+    # Adds the changes to dish_year_counts; returns the number of keys adjusted.
+    rows = [(int(year), name, int(n)) for (year, name), n in change.items()]
+    db_conn.executemany(_COUNTS_UPSERT, rows)
+    db_conn.executemany('DELETE FROM dish_year_counts WHERE year = ? AND name = ? AND occurrences <= 0',
+                        [(year, name) for year, name, n in rows if n < 0])
+    return len(rows)
+
+
+def _remap_dishes(db_conn, dish_ids, remap):
+    # Calls remap(), a change to dish_clusters that gives dish_ids another
+    # canonical name, and moves the dish_year_counts of their items from the
+    # old names to the new ones. Returns the number of keys adjusted.
+    db_conn.execute('CREATE TEMP TABLE remapped_dishes (id INTEGER PRIMARY KEY)')
+    db_conn.execute('CREATE TEMP TABLE touched_items (id INTEGER PRIMARY KEY)')
+    db_conn.executemany('INSERT INTO temp.remapped_dishes (id) VALUES (?)', ((int(i),) for i in dish_ids))
+    db_conn.execute('INSERT INTO temp.touched_items (id) SELECT menu_item.id FROM temp.remapped_dishes '
+                    'CROSS JOIN menu_item ON menu_item.dish_id = remapped_dishes.id')
+    before = _snapshot(db_conn)
+    remap()
+    keys = _apply_year_count_changes(db_conn, _year_count_changes(before, _snapshot(db_conn)))
+    db_conn.execute('DROP TABLE temp.remapped_dishes')
+    db_conn.execute('DROP TABLE temp.touched_items')
+    return keys
+
+
+def _drop_stale_clusters(db_conn, dishes):
+    # Removes the dish_clusters entries that a rename among the dish rows of
+    # the batch makes stale; returns (entries dropped, dish_year_counts keys adjusted).
+    db_conn.execute('CREATE TEMP TABLE batch_dishes (id INTEGER PRIMARY KEY, name TEXT)')
+    db_conn.executemany('INSERT INTO temp.batch_dishes (id, name) VALUES (?, ?)', zip(
+        ingest._typed_values(dishes['id'], 'INTEGER'), ingest._typed_values(dishes['name'], 'TEXT')))
+    stale = [dish_id for (dish_id,) in db_conn.execute(_STALE_CLUSTERS)]
+    db_conn.execute('DROP TABLE temp.batch_dishes')
+    if not stale:
+        return 0, 0
+    keys = _remap_dishes(db_conn, stale, lambda: db_conn.executemany(
+        'DELETE FROM dish_clusters WHERE dish_id = ?', ((dish_id,) for dish_id in stale)))
+    return len(stale), keys
+
+
+def _dish_changes(db_conn, before, after, skip, clip_lower, clip_upper):
+    # DataFrame(id, times, menus, first, last) of the adjustments for the dishes
+    # whose items changed, except those whose own row is in the batch (`skip`).
+    dish_ids = pd.concat([before['dish_id'], after['dish_id']]).dropna().astype('int64').unique()
+    dish_ids = dish_ids[~np.isin(dish_ids, skip)]
+    if len(dish_ids) == 0:
+        return pd.DataFrame(columns=['id', 'times', 'menus', 'first', 'last'])
+    before = before[before['dish_id'].isin(dish_ids)]
+    after = after[after['dish_id'].isin(dish_ids)]
+    times = after.groupby('dish_id').size().sub(before.groupby('dish_id').size(), fill_value=0)
+
+    # a dish gains (loses) a menu when that menu had none (no longer has any) of its items
+    pair_change = (after.groupby(['dish_id', 'menu_id']).size()
+                   .sub(before.groupby(['dish_id', 'menu_id']).size(), fill_value=0))
+    pair_change = pair_change[pair_change != 0]
+    db_conn.execute('CREATE TEMP TABLE adjusted_pairs (dish_id INTEGER, menu_id INTEGER, PRIMARY KEY (dish_id, menu_id))')
+    db_conn.executemany('INSERT INTO temp.adjusted_pairs (dish_id, menu_id) VALUES (?, ?)',
+                        ((int(d), int(m)) for d, m in pair_change.index))
+    now = pd.DataFrame(db_conn.execute(_DISH_MENU_ITEMS).fetchall(), columns=['dish_id', 'menu_id', 'items'])
+    db_conn.execute('DROP TABLE temp.adjusted_pairs')
+    now = now.astype({'dish_id': 'Int64', 'menu_id': 'Int64'}).set_index(['dish_id', 'menu_id'])['items']
+    items_now = now.reindex(pair_change.index, fill_value=0)
+    items_before = items_now - pair_change
+    menus = ((items_now > 0).astype('int64') - (items_before > 0).astype('int64')).groupby(level=0).sum()
+
+    # new appearances can only widen first/last_appeared, within the CHECK range
+    years = after['year'].where(after['year'].between(clip_lower, clip_upper))
+    span = years.groupby(after['dish_id']).agg(['min', 'max'])
+    changes = pd.DataFrame({'times': times, 'menus': menus}).reindex(dish_ids).fillna(0).astype('int64')
+    changes['first'] = span['min'].reindex(dish_ids).astype('Int64')
+    changes['last'] = span['max'].reindex(dish_ids).astype('Int64')
+    return changes.rename_axis('id').reset_index()
+
+
+# @BEGIN Incremental_Load @desc Upsert the new and changed rows of a batch and adjust the derived counts for them.
+# @PARAM clip_lower
+# @PARAM clip_upper
+# @IN frames
+# @IN db_conn
+# @OUT data_inserted
+# @OUT dish_year_counts
+def incremental_load(db_conn, frames, clip_lower=1840, clip_upper=2008, rejected=None):
+    # frames: {'dish': DataFrame, ...} keyed like ingest.TABLE_SCHEMAS, in the
+    # typed form bulk_load() takes; any subset of the tables and of their rows.
+    # rejected: as for bulk_load(), the rejected rows when the caller already
+    # ran ingest.split_rejected(), with frames being the accepted ones.
+    # Returns {table: {'rows', 'rejected', 'new', 'changed', 'seconds'},
+    # 'dish_clusters': {'dropped', 'keys', 'seconds'}, 'dish_year_counts':
+    # {'keys', 'seconds'}, 'dish': {..., 'adjusted'}}.
+    ingest.check_columns(frames)
+    if rejected is None:
+        frames, rejected = ingest.split_rejected(frames, clip_lower, clip_upper)
+    db_conn.commit()
+    ingest.create_tables(db_conn, clip_lower=clip_lower, clip_upper=clip_upper)
+    for table in LOAD_ORDER:
+        for index in ingest.TABLE_INDEXES[table]:
+            db_conn.execute(index)
+    stats = {}
+    db_conn.execute('BEGIN')
+    try:
+        deltas = {}
+        for table in LOAD_ORDER:
+            if table not in frames:
+                continue
+            start = time.perf_counter()
+            frame = frames[table]
+            hashes = row_hashes(frame, table)
+            ids = frame['id'].to_numpy(dtype='int64')
+            stored = _stored_hashes(db_conn, table, ids)
+            position = stored.index.get_indexer(ids)
+            new = position == -1
+            changed = ~new
+            changed[~new] = stored.to_numpy()[position[~new]] != hashes[~new]
+            write = new | changed
+            deltas[table] = (frame[write], ids[write], hashes[write])
+            stats[table] = {'rows': len(frame), 'rejected': int((rejected['table_name'] == table).sum()),
+                            'new': int(new.sum()), 'changed': int(changed.sum()), 'seconds': time.perf_counter() - start}
+
+        if 'dish' in deltas:
+            # before the upsert, while the stored names are the old ones
+            start = time.perf_counter()
+            dropped, keys = _drop_stale_clusters(db_conn, deltas['dish'][0])
+            stats['dish_clusters'] = {'dropped': dropped, 'keys': keys, 'seconds': time.perf_counter() - start}
+
+        db_conn.execute('CREATE TEMP TABLE delta_rows (table_name TEXT NOT NULL, id INTEGER NOT NULL)')
+        db_conn.execute('CREATE TEMP TABLE touched_items (id INTEGER PRIMARY KEY)')
+        for table, (_, ids, _) in deltas.items():
+            db_conn.executemany('INSERT INTO temp.delta_rows (table_name, id) VALUES (?, ?)',
+                                zip([table] * len(ids), ids.tolist()))
+        db_conn.execute(_TOUCHED_ITEMS)
+        before = _snapshot(db_conn)
+
+        for table, (delta, ids, hashes) in deltas.items():
+            start = time.perf_counter()
+            db_conn.executemany(upsert_statement(table), ingest.table_rows(delta, table))
+            db_conn.executemany(_HASH_UPSERT, zip([table] * len(ids), ids.tolist(), hashes.tolist()))
+            stats[table]['seconds'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        after = _snapshot(db_conn)
+        keys = _apply_year_count_changes(db_conn, _year_count_changes(before, after))
+        stats['dish_year_counts'] = {'keys': keys, 'seconds': time.perf_counter() - start}
+
+        start = time.perf_counter()
+        # a dish row in the batch, changed or not, already has the counts of the export
+        skip = frames['dish']['id'].to_numpy(dtype='int64') if 'dish' in frames else np.empty(0, dtype='int64')
+        dishes = _dish_changes(db_conn, before, after, skip, clip_lower, clip_upper)
+        first = ingest._typed_values(dishes['first'], 'INTEGER')
+        last = ingest._typed_values(dishes['last'], 'INTEGER')
+        db_conn.executemany(_DISH_UPDATE, zip(
+            dishes['times'].tolist(),
+            dishes['menus'].tolist(),
+            first, first,
+            last, last,
+            dishes['id'].tolist(),
+        ))
+        stats.setdefault('dish', {'rows': 0, 'new': 0, 'changed': 0, 'seconds': 0.0})
+        stats['dish']['adjusted'] = len(dishes)
+        stats['dish']['seconds'] += time.perf_counter() - start
+
+        db_conn.execute('DROP TABLE temp.delta_rows')
+        db_conn.execute('DROP TABLE temp.touched_items')
+    except Exception:
+        db_conn.rollback()
+        raise
+    db_conn.commit()
+    ingest.load_rejected_rows(db_conn, rejected)
+    return stats
+# @END Incremental_Load
+
+
+# @BEGIN Update_Dish_Clusters @desc Replace the dish_clusters mapping, moving only the dish_year_counts of the dishes whose canonical name changed.
+# @IN dish_clusters
+# @IN db_conn
+# @OUT dish_year_counts
+def update_dish_clusters(db_conn, clusters):
+    # clusters: DataFrame(dish_id, canonical_dish_id, canonical_name, method)
+    # from dish_clusters.cluster_dishes, as for ingest.load_dish_clusters(),
+    # which recounts all of dish_year_counts instead.
+    # Returns {'rows', 'changed', 'keys', 'seconds'}.
+    start = time.perf_counter()
+    columns = ['canonical_dish_id', 'canonical_name', 'method']
+    new = pd.DataFrame({
+        'dish_id': ingest._typed_series(clusters['dish_id'], 'INTEGER'),
+        'canonical_dish_id': ingest._typed_series(clusters['canonical_dish_id'], 'INTEGER'),
+        'canonical_name': ingest._typed_series(clusters['canonical_name'], 'TEXT'),
+        'method': ingest._typed_series(clusters['method'], 'TEXT'),
+    })
+    db_conn.commit()
+    db_conn.execute('BEGIN')
+    try:
+        old = pd.read_sql_query('SELECT dish_id, canonical_dish_id, canonical_name, method FROM dish_clusters', db_conn)
+        old = old.astype({'dish_id': 'Int64', 'canonical_dish_id': 'Int64'})
+        merged = old.merge(new, on='dish_id', how='outer', suffixes=('_old', ''), indicator=True)
+        removed = (merged['_merge'] == 'left_only').to_numpy()
+        differs = np.zeros(len(merged), dtype=bool)
+        for column in columns:
+            before, after = merged[f'{column}_old'].astype(object), merged[column].astype(object)
+            differs |= ~((before == after) | (before.isna() & after.isna())).to_numpy(dtype=bool)
+        renamed = differs & ~((merged['canonical_name_old'] == merged['canonical_name'])
+                              | (merged['canonical_name_old'].isna() & merged['canonical_name'].isna())).to_numpy(dtype=bool)
+        written = merged[differs & ~removed]
+
+        def remap():
+            db_conn.executemany('DELETE FROM dish_clusters WHERE dish_id = ?',
+                                ((int(i),) for i in merged.loc[removed, 'dish_id']))
+            db_conn.executemany(_CLUSTERS_UPSERT, zip(
+                ingest._typed_values(written['dish_id'], 'INTEGER'),
+                ingest._typed_values(written['canonical_dish_id'], 'INTEGER'),
+                ingest._typed_values(written['canonical_name'], 'TEXT'),
+                ingest._typed_values(written['method'], 'TEXT'),
+            ))
+        keys = _remap_dishes(db_conn, merged.loc[renamed, 'dish_id'].tolist(), remap)
+    except Exception:
+        db_conn.rollback()
+        raise
+    db_conn.commit()
+    return {
+        'rows': len(clusters),
+        'changed': int(differs.sum()),
+        'keys': keys,
+        'seconds': time.perf_counter() - start,
+    }
+# @END Update_Dish_Clusters
+
+
+def format_incremental_stats(stats):
+    lines = []
+    for table, s in stats.items():
+        if table == 'dish_year_counts':
+            lines.append(f"{table}: {s['keys']:,} (year, dish) counts adjusted in {s['seconds']:.2f}s")
+            continue
+        if table == 'dish_clusters':
+            lines.append(f"{table}: {s['dropped']:,} entries of renamed dishes dropped in {s['seconds']:.2f}s")
+            continue
+        rejected = f", {s['rejected']:,} rejected" if s.get('rejected') else ''
+        line = (f"{table}: {s['new']:,} new, {s['changed']:,} changed, {s['rows'] - s['new'] - s['changed']:,} unchanged"
+                f"{rejected} in {s['seconds']:.2f}s")
+        if 'adjusted' in s:
+            line += f"; appearance counts of {s['adjusted']:,} other dishes adjusted"
+        lines.append(line)
+    return '\n'.join(lines)
@@ -0,0 +1,564 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+import dates
+import integrity
+
+# Bulk loader for restaurant_menus.db. The CREATE TABLE / INSERT statements are
+# Queries 1.1 - 4.2 from analysis/queries.md; the frames are bound straight to
+# those prepared statements with executemany, one transaction per table, and the
+# indexes are only built once the rows are in. Rows the schema would refuse (a
+# repeated id, a NULL in a NOT NULL column, a failed CHECK) are set aside in
+# rejected_rows instead of aborting the load.
+#
+# This buys typed columns, constraints and indexes, not speed: on a 1M-row
+# menu_item the insert takes about as long as DataFrame.to_sql (~5s, almost
+# all of it inside executemany), and the two indexes add ~2.5s on top.
+
+# table -> (CREATE TABLE statement, INSERT statement); the dish year CHECKs
+# take the Clip_Values bounds, filled in by create_statement()
+TABLE_SCHEMAS = {
+    'dish': (
+        '''
+        CREATE TABLE IF NOT EXISTS dish (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            menus_appeared INTEGER NOT NULL,
+            times_appeared INTEGER NOT NULL CHECK (times_appeared >= 0),
+            first_appeared INTEGER NOT NULL,
+            last_appeared INTEGER NOT NULL,
+            lowest_price REAL,
+            highest_price REAL,
+            CONSTRAINT CHK_first_appeared CHECK (first_appeared >= {clip_lower} AND first_appeared <= {clip_upper}),
+            CONSTRAINT CHK_last_appeared CHECK (last_appeared >= {clip_lower} AND last_appeared <= {clip_upper})
+        )
+        ''',
+        '''
+        INSERT INTO dish (id, name, menus_appeared, times_appeared, first_appeared, last_appeared, lowest_price, highest_price)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''',
+    ),
+    'menu': (
+        '''
+        CREATE TABLE IF NOT EXISTS menu (
+            id INTEGER PRIMARY KEY,
+            name TEXT,
+            sponsor TEXT,
+            event TEXT,
+            venue TEXT,
+            place TEXT,
+            physical_description TEXT,
+            occasion TEXT,
+            notes TEXT,
+            call_number TEXT,
+            keywords TEXT,
+            language TEXT,
+            date TEXT,
+            location TEXT NOT NULL,
+            location_type TEXT,
+            currency TEXT,
+            currency_symbol TEXT,
+            status TEXT NOT NULL,
+            page_count INTEGER NOT NULL,
+            dish_count INTEGER NOT NULL,
+            date_epoch INTEGER,
+            year INTEGER
+        )
+        ''',
+        '''
+        INSERT INTO menu (id, name, sponsor, event, venue, place, physical_description, occasion,
+                          notes, call_number, keywords, language, date, location, location_type,
+                          currency, currency_symbol, status, page_count, dish_count, date_epoch, year)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''',
+    ),
+    'menu_page': (
+        '''
+        CREATE TABLE IF NOT EXISTS menu_page (
+            id INTEGER PRIMARY KEY,
+            menu_id INTEGER NOT NULL,
+            page_number INTEGER,
+            image_id TEXT NOT NULL,
+            full_height REAL,
+            full_width REAL,
+            uuid TEXT NOT NULL,
+            FOREIGN KEY(menu_id) REFERENCES menu(id)
+        )
+        ''',
+        '''
+        INSERT INTO menu_page (id, menu_id, page_number, image_id, full_height, full_width, uuid)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''',
+    ),
+    'menu_item': (
+        '''
+        CREATE TABLE IF NOT EXISTS menu_item (
+            id INTEGER PRIMARY KEY,
+            menu_page_id INTEGER NOT NULL,
+            price REAL,
+            high_price REAL,
+            dish_id INTEGER,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            xpos REAL NOT NULL,
+            ypos REAL NOT NULL,
+            created_at_epoch INTEGER,
+            updated_at_epoch INTEGER,
+            FOREIGN KEY(menu_page_id) REFERENCES menu_page(id),
+            FOREIGN KEY(dish_id) REFERENCES dish(id)
+        )
+        ''',
+        '''
+        INSERT INTO menu_item (id, menu_page_id, price, high_price, dish_id, created_at, updated_at, xpos, ypos,
+                               created_at_epoch, updated_at_epoch)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''',
+    ),
+}
+
+# Indexes on the join keys, built after the bulk insert. The menu_item index
+# covers both join keys so the Use Case 1 join never touches the table rows.
+TABLE_INDEXES = {
+    'dish': [],
+    'menu': [
+        'CREATE INDEX IF NOT EXISTS idx_menu_year ON menu (year)',
+    ],
+    'menu_page': [
+        'CREATE INDEX IF NOT EXISTS idx_menu_page_menu_id ON menu_page (menu_id)',
+    ],
+    'menu_item': [
+        'CREATE INDEX IF NOT EXISTS idx_menu_item_menu_page_id_dish_id ON menu_item (menu_page_id, dish_id)',
+        'CREATE INDEX IF NOT EXISTS idx_menu_item_dish_id ON menu_item (dish_id)',
+    ],
+}
+
+# Canonical dish of every dish id, as proposed by dish_clusters.py. Empty
+# unless a clustering was loaded with load_dish_clusters().
+DISH_CLUSTERS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS dish_clusters (
+        dish_id INTEGER PRIMARY KEY,
+        canonical_dish_id INTEGER NOT NULL,
+        canonical_name TEXT NOT NULL,
+        method TEXT NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_dish_clusters_canonical_dish_id ON dish_clusters (canonical_dish_id)',
+]
+
+DISH_CLUSTERS_INSERT = '''
+    INSERT INTO dish_clusters (dish_id, canonical_dish_id, canonical_name, method)
+    VALUES (?, ?, ?, ?)
+'''
+
+# Dates that dates.normalize_dates() couldn't parse or that fall outside the
+# accepted years; their typed columns (menu.year, *_epoch) are NULL.
+INVALID_DATES_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS invalid_dates (
+        table_name TEXT NOT NULL,
+        column_name TEXT NOT NULL,
+        id INTEGER,
+        value TEXT NOT NULL,
+        reason TEXT NOT NULL
+    )
+    ''',
+]
+
+INVALID_DATES_INSERT = '''
+    INSERT INTO invalid_dates (table_name, column_name, id, value, reason)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+# Rows the last load set aside because an INSERT would have failed on them
+# (integrity.rejected_rows), with the constraint and the row itself as JSON.
+REJECTED_ROWS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS rejected_rows (
+        table_name TEXT NOT NULL,
+        id INTEGER,
+        constraint_name TEXT NOT NULL,
+        row TEXT NOT NULL
+    )
+    ''',
+]
+
+REJECTED_ROWS_INSERT = '''
+    INSERT INTO rejected_rows (table_name, id, constraint_name, row)
+    VALUES (?, ?, ?, ?)
+'''
+
+# Content hash of every row loaded by incremental.incremental_load(), so a
+# later batch only writes the rows that are new or changed.
+ROW_HASHES_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS row_hashes (
+        table_name TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        hash INTEGER NOT NULL,
+        PRIMARY KEY (table_name, id)
+    ) WITHOUT ROWID
+    ''',
+]
+
+# Occurrences of every dish name per menu year, i.e. the inner GROUP BY of
+# Query 5 in analysis/queries.md, materialized once per load. Clustered dishes
+# are counted under their canonical name.
+DISH_YEAR_COUNTS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS dish_year_counts (
+        year INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        occurrences INTEGER NOT NULL,
+        PRIMARY KEY (year, name)
+    ) WITHOUT ROWID
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_dish_year_counts_rank ON dish_year_counts (year, occurrences DESC, name)',
+]
+
+DISH_YEAR_COUNTS_REFRESH = '''
+    INSERT INTO dish_year_counts (year, name, occurrences)
+    SELECT menu.year, COALESCE(dish_clusters.canonical_name, dish.name) AS dish_name, COUNT(dish.name)
+    FROM
+            menu_item
+            JOIN dish ON menu_item.dish_id = dish.id
+            JOIN menu_page ON menu_item.menu_page_id = menu_page.id
+            JOIN menu ON menu_page.menu_id = menu.id
+            LEFT JOIN dish_clusters ON dish_clusters.dish_id = dish.id
+    WHERE
+            menu.year IS NOT NULL AND
+            (dish.name NOT LIKE '"' AND dish.name NOT LIKE '" %')
+    GROUP BY menu.year, dish_name
+'''
+
+# Use Case 1: top 10 dishes per year, answered from dish_year_counts.
+TOP_DISHES_QUERY = '''
+    SELECT Year, DishName, Occurrences, Rank
+    FROM
+    (
+            SELECT
+                year AS Year,
+                name AS DishName,
+                occurrences AS Occurrences,
+                ROW_NUMBER () OVER (
+                    PARTITION BY year
+                    ORDER BY occurrences DESC, name
+                ) Rank
+            FROM dish_year_counts
+    ) t
+    WHERE Rank <= 10
+'''
+
+LOAD_PRAGMAS = {
+    'journal_mode': 'MEMORY',
+    'synchronous': 'OFF',
+    'cache_size': -262144,  # KiB, i.e. 256 MiB of page cache
+    'temp_store': 'MEMORY',
+}
+
+
+def table_columns(table):
+    # Column names and declared types, in CREATE TABLE order; generated
+    # columns would be computed by SQLite and are not inserted.
+    create = TABLE_SCHEMAS[table][0]
+    body = create[create.index('(') + 1:create.rindex(')')]
+    columns = []
+    for line in body.split('\n'):
+        parts = line.strip().rstrip(',').split()
+        if len(parts) >= 2 and parts[0] not in ('CONSTRAINT', 'FOREIGN', 'PRIMARY', 'CHECK') and 'GENERATED' not in parts:
+            columns.append((parts[0], parts[1]))
+    return columns
+
+
+def create_statement(table, clip_lower=1840, clip_upper=2008):
+    # The CREATE TABLE statement with the year bounds the cleaning clipped to.
+    return TABLE_SCHEMAS[table][0].format(clip_lower=int(clip_lower), clip_upper=int(clip_upper))
+
+
+def create_tables(db_conn, replace=False, clip_lower=1840, clip_upper=2008):
+    # An existing table keeps the bounds it was created with; replace=True
+    # recreates it with these.
+    for table in TABLE_SCHEMAS:
+        if replace:
+            db_conn.execute(f'DROP TABLE IF EXISTS {table}')
+        db_conn.execute(create_statement(table, clip_lower, clip_upper))
+    if replace:
+        # a clustering of the old dish ids doesn't apply to the new ones
+        db_conn.execute('DROP TABLE IF EXISTS dish_clusters')
+        db_conn.execute('DROP TABLE IF EXISTS invalid_dates')
+        db_conn.execute('DROP TABLE IF EXISTS rejected_rows')
+        db_conn.execute('DROP TABLE IF EXISTS row_hashes')
+        db_conn.execute('DROP TABLE IF EXISTS dish_year_counts')
+    for statement in (DISH_CLUSTERS_SCHEMA + INVALID_DATES_SCHEMA + REJECTED_ROWS_SCHEMA + ROW_HASHES_SCHEMA
+                      + DISH_YEAR_COUNTS_SCHEMA):
+        db_conn.execute(statement)
+    db_conn.commit()
+
+
+# @BEGIN Refresh_Dish_Year_Counts @desc Rebuild the materialized per-year dish counts behind Use Case 1.
+# @IN db_conn
+# @OUT dish_year_counts
+def refresh_dish_year_counts(db_conn):
+    start = time.perf_counter()
+    db_conn.execute('BEGIN')
+    try:
+        db_conn.execute('DELETE FROM dish_year_counts')
+        db_conn.execute(DISH_YEAR_COUNTS_REFRESH)
+    except Exception:
+        db_conn.rollback()
+        raise
+    db_conn.commit()
+    return time.perf_counter() - start
+# @END Refresh_Dish_Year_Counts
+
+
+# @BEGIN Load_Invalid_Dates @desc Replace the invalid_dates side table.
+# @IN invalid_dates
+# @IN db_conn
+# @OUT invalid_dates_table
+def load_invalid_dates(db_conn, invalid):
+    # invalid: DataFrame(table_name, column_name, id, value, reason) from dates.normalize_dates
+    start = time.perf_counter()
+    db_conn.execute('BEGIN')
+    try:
+        db_conn.execute('DELETE FROM invalid_dates')
+        db_conn.executemany(INVALID_DATES_INSERT, zip(
+            _typed_values(invalid['table_name'], 'TEXT'),
+            _typed_values(invalid['column_name'], 'TEXT'),
+            _typed_values(invalid['id'], 'INTEGER'),
+            _typed_values(invalid['value'], 'TEXT'),
+            _typed_values(invalid['reason'], 'TEXT'),
+        ))
+    except Exception:
+        db_conn.rollback()
+        raise
+    db_conn.commit()
+    return {'rows': len(invalid), 'seconds': time.perf_counter() - start}
+# @END Load_Invalid_Dates
+
+
+def split_rejected(frames, clip_lower=1840, clip_upper=2008):
+    # Returns ({table: the rows the schema accepts}, DataFrame(table_name, id,
+    # constraint_name, row) of the others), keeping the accepted rows in order.
+    accepted = {}
+    rejected = []
+    for table, frame in frames.items():
+        reasons = integrity.rejected_rows(frame, table, clip_lower, clip_upper)
+        mask = pd.notna(reasons)
+        if not mask.any():
+            accepted[table] = frame
+            continue
+        accepted[table] = frame[~mask]
+        rows = frame[mask]
+        rejected.append(pd.DataFrame({
+            'table_name': table,
+            'id': pd.to_numeric(rows['id'], errors='coerce').to_numpy(),
+            'constraint_name': reasons[mask],
+            'row': rows.to_json(orient='records', lines=True).splitlines(),
+        }))
+    if not rejected:
+        return accepted, pd.DataFrame(columns=['table_name', 'id', 'constraint_name', 'row'])
+    return accepted, pd.concat(rejected, ignore_index=True)
+
+
+# @BEGIN Load_Rejected_Rows @desc Replace the rejected_rows side table.
+# @IN rejected_rows
+# @IN db_conn
+# @OUT rejected_rows_table
+def load_rejected_rows(db_conn, rejected):
+    # rejected: DataFrame(table_name, id, constraint_name, row) from split_rejected
+    start = time.perf_counter()
+    db_conn.execute('BEGIN')
+    try:
+        db_conn.execute('DELETE FROM rejected_rows')
+        db_conn.executemany(REJECTED_ROWS_INSERT, zip(
+            _typed_values(rejected['table_name'], 'TEXT'),
+            _typed_values(rejected['id'], 'INTEGER'),
+            _typed_values(rejected['constraint_name'], 'TEXT'),
+            _typed_values(rejected['row'], 'TEXT'),
+        ))
+    except Exception:
+        db_conn.rollback()
+        raise
+    db_conn.commit()
+    return {'rows': len(rejected), 'seconds': time.perf_counter() - start}
+# @END Load_Rejected_Rows
+
+
+# @BEGIN Load_Dish_Clusters @desc Replace the dish_clusters mapping and recount dish_year_counts by canonical name.
+# @IN dish_clusters
+# @IN db_conn
+# @OUT dish_year_counts
+def load_dish_clusters(db_conn, clusters):
+    # clusters: DataFrame(dish_id, canonical_dish_id, canonical_name, method) from dish_clusters.cluster_dishes
+    start = time.perf_counter()
+    db_conn.execute('BEGIN')
+    try:
+        db_conn.execute('DELETE FROM dish_clusters')
+        db_conn.executemany(DISH_CLUSTERS_INSERT, zip(
+            _typed_values(clusters['dish_id'], 'INTEGER'),
+            _typed_values(clusters['canonical_dish_id'], 'INTEGER'),
+            _typed_values(clusters['canonical_name'], 'TEXT'),
+            _typed_values(clusters['method'], 'TEXT'),
+        ))
+    except Exception:
+        db_conn.rollback()
+        raise
+    db_conn.commit()
+    return {
+        'rows': len(clusters),
+        'seconds': time.perf_counter() - start,
+        'refresh_seconds': refresh_dish_year_counts(db_conn),
+    }
+# @END Load_Dish_Clusters
+
+
+def _widen_float32(series):
+    # float32 -> float64 through the shortest decimal that reads back as the
+    # same float32, as str() would, so 0.74 stays 0.74 and not 0.7400000095367432.
+    # Rounds to 1..9 significant digits with numpy instead of formatting every
+    # value; values that need a power of ten beyond 1e22 go through str().
+    narrow = series.to_numpy(dtype='float32', na_value=np.nan)
+    wide = narrow.astype('float64')
+    nonzero = np.isfinite(narrow) & (narrow != 0)
+    exponent = np.floor(np.log10(np.abs(wide, where=nonzero, out=np.ones_like(wide)))).astype(int)
+    # beyond 1e22 a power of ten is inexact, and so would be the rounding
+    within = (exponent >= -14) & (exponent <= 22)
+    todo = np.flatnonzero(nonzero & within)
+    exponent = exponent[todo]
+    for digits in range(1, 10):
+        places = digits - 1 - exponent
+        scale = 10.0 ** np.abs(places)
+        rounded = np.where(places >= 0, np.round(wide[todo] * scale) / scale, np.round(wide[todo] / scale) * scale)
+        exact = rounded.astype('float32') == narrow[todo]
+        wide[todo[exact]] = rounded[exact]
+        todo, exponent = todo[~exact], exponent[~exact]
+    todo = np.concatenate([todo, np.flatnonzero(nonzero & ~within)])
+    wide[todo] = [float(str(value)) for value in narrow[todo]]
+    return pd.Series(wide, index=series.index)
+
+
+def _typed_series(series, sqltype):
+    # The column as sqlite3 should see it: nullable Int64, float64 or str, so a
+    # value binds (and hashes) the same whatever dtype pandas inferred from the CSV.
+    if sqltype == 'INTEGER':
+        series = series.astype('Int64')
+    elif sqltype == 'REAL':
+        if series.dtype == 'float32':
+            series = _widen_float32(series)
+        series = series.astype('float64')
+    elif sqltype == 'TEXT':
+        series = series.astype(object).where(series.isna(), series.astype(str))
+    return series
+
+
+def _typed_values(series, sqltype):
+    # Python scalars with NULLs as None, so sqlite3 binds each value with the
+    # column's declared type instead of whatever pandas inferred from the CSV.
+    # Skips the pandas object round trip where it can: an int column has no
+    # NULLs, a str column is already str, and a float column only needs its NaNs swapped.
+    if sqltype == 'INTEGER' and series.dtype.kind in 'iu':
+        return series.to_numpy().tolist()
+    if sqltype == 'REAL':
+        values = _typed_series(series, sqltype).to_numpy()
+        missing = np.isnan(values)
+        if missing.any():
+            values = values.astype(object)
+            values[missing] = None
+        return values.tolist()
+    if sqltype == 'TEXT' and pd.api.types.is_string_dtype(series.dtype) and series.dtype != object:
+        return series.to_numpy(dtype=object, na_value=None).tolist()
+    series = _typed_series(series, sqltype)
+    if series.hasnans:
+        series = series.astype(object).where(series.notna(), None)
+    return series.tolist()
+
+
+def check_columns(frames):
+    # Raises a ValueError naming the columns a frame lacks, instead of a
+    # KeyError halfway through the load; the typed date columns (menu.year,
+    # date_epoch, menu_item.*_epoch) are added by dates.normalize_dates().
+    for table, frame in frames.items():
+        missing = [name for name, _ in table_columns(table) if name not in frame.columns]
+        if missing:
+            raise ValueError(f"{table} has no column {', '.join(missing)}"
+                             f"{'; run dates.normalize_dates() on the frames first' if table in dates.DATE_COLUMNS else ''}")
+
+
+def table_rows(frame, table):
+    columns = [_typed_values(frame[name], sqltype) for name, sqltype in table_columns(table)]
+    return zip(*columns)
+
+
+def _set_pragmas(db_conn, pragmas):
+    previous = {}
+    for name, value in pragmas.items():
+        previous[name] = db_conn.execute(f'PRAGMA {name}').fetchone()[0]
+        if name == 'journal_mode' and previous[name] == 'wal':
+            # a database in WAL mode stays in it: leaving it would need the
+            # readers of query_service.py gone, and WAL lets them read on during the load
+            continue
+        db_conn.execute(f'PRAGMA {name} = {value}')
+    return previous
+
+
+# @BEGIN Bulk_Load_Tables @desc Load DataFrames into the prepared schemas with executemany, then build indexes.
+# @IN frames
+# @IN db_conn
+# @OUT load_stats
+def bulk_load(db_conn, frames, pragmas=LOAD_PRAGMAS, replace=True, rejected=None, clip_lower=1840, clip_upper=2008):
+    # frames: {'dish': DataFrame, 'menu': ..., 'menu_page': ..., 'menu_item': ...}
+    # rejected: when the caller already ran split_rejected(), its rejected rows,
+    # with frames being the accepted ones.
+    # clip_lower/clip_upper: the dish year bounds of the CHECK constraints.
+    # Returns {table: {'rows', 'rejected', 'seconds', 'index_seconds', 'rows_per_sec'}}.
+    check_columns(frames)
+    db_conn.commit()
+    if rejected is None:
+        frames, rejected = split_rejected(frames, clip_lower, clip_upper)
+    previous = _set_pragmas(db_conn, pragmas)
+    stats = {}
+    try:
+        create_tables(db_conn, replace, clip_lower, clip_upper)
+        for table, frame in frames.items():
+            insert = TABLE_SCHEMAS[table][1]
+            start = time.perf_counter()
+            db_conn.execute('BEGIN')
+            try:
+                db_conn.executemany(insert, table_rows(frame, table))
+                loaded = time.perf_counter()
+                for index in TABLE_INDEXES[table]:
+                    db_conn.execute(index)
+            except Exception:
+                db_conn.rollback()
+                raise
+            db_conn.commit()
+            insert_seconds = loaded - start
+            stats[table] = {
+                'rows': len(frame),
+                'rejected': int((rejected['table_name'] == table).sum()),
+                'seconds': insert_seconds,
+                'index_seconds': time.perf_counter() - loaded,
+                'rows_per_sec': len(frame) / insert_seconds if insert_seconds else float('inf'),
+            }
+        load_rejected_rows(db_conn, rejected)
+        db_conn.execute('ANALYZE')
+        stats['dish_year_counts'] = {'seconds': refresh_dish_year_counts(db_conn)}
+    finally:
+        _set_pragmas(db_conn, previous)
+    return stats
+# @END Bulk_Load_Tables
+
+
+def format_load_stats(stats):
+    lines = []
+    for table, s in stats.items():
+        if 'rows' in s:
+            rejected = f", {s['rejected']:,} rejected" if s.get('rejected') else ''
+            lines.append(f"{table}: {s['rows']:,} rows in {s['seconds']:.2f}s ({s['rows_per_sec']:,.0f} rows/s){rejected}, "
+                         f"indexes in {s['index_seconds']:.2f}s")
+        else:
+            lines.append(f"{table}: refreshed in {s['seconds']:.2f}s")
+    return '\n'.join(lines)
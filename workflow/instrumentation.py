@@ -0,0 +1,256 @@
+import argparse
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import resource
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+from scheduler import parse_annotations
+
+# StageRunner hook that measures what every YesWorkflow stage costs: wall and
+# CPU time, RSS and peak-RSS growth (of this process and of the largest child
+# process it ran), rows in and out, and bytes read and written.
+# Chosen stages can also run under cProfile or tracemalloc. The trace is JSON
+# keyed by the @BEGIN names, and overlay_graph() writes the timings into the
+# stage boxes of a YesWorkflow Graphviz file (wf1.gv, wf3.gv), coloured by
+# each stage's share of the run time.
+
+
+def _reset_peak_rss():
+    # Linux only: writing 5 to clear_refs resets VmHWM, so each stage gets its own peak.
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _proc_status(field):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def rss_kb():
+    return _proc_status('VmRSS')
+
+
+def peak_rss_kb():
+    peak = _proc_status('VmHWM')
+    if peak is not None:
+        return peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def children_peak_rss_kb():
+    # Largest peak RSS of any child process waited for so far, e.g. the
+    # workers of a process pool once it has shut down; 0 before the first one.
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def io_bytes():
+    # (bytes read, bytes written) by this process through read/write calls,
+    # page cache included; (None, None) where /proc/self/io isn't available.
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def count_rows(value):
+    # Rows in the DataFrames a stage takes or returns, including tuples and dicts of them.
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(count_rows(v) for v in value)
+    if isinstance(value, dict):
+        return sum(count_rows(v) for v in value.values())
+    return 0
+
+
+def _delta(after, before):
+    return None if after is None or before is None else after - before
+
+
+class StageTracer:
+    # profile / trace_memory: stage names to run under cProfile / tracemalloc.
+    # cProfile output is also dumped to <profile_dir>/<stage>.prof when profile_dir is set.
+    def __init__(self, profile=(), trace_memory=(), profile_dir=None, top=15):
+        self.profile = set(profile)
+        self.trace_memory = set(trace_memory)
+        self.profile_dir = profile_dir
+        self.top = top
+        self.stages = []
+        self._started = []
+
+    def before_stage(self, name, args, kwargs):
+        _reset_peak_rss()
+        state = {
+            'rows_in': count_rows(args) + count_rows(kwargs),
+            'rss_kb': rss_kb(),
+            'children_peak_rss_kb': children_peak_rss_kb(),
+            'io': io_bytes(),
+            'profiler': None,
+            'tracing': False,
+        }
+        if name in self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            state['tracing'] = True
+        if name in self.profile:
+            state['profiler'] = cProfile.Profile()
+        state['wall'] = time.perf_counter()
+        state['cpu'] = time.process_time()
+        if state['profiler'] is not None:
+            state['profiler'].enable()
+        self._started.append(state)
+
+    def after_stage(self, name, result):
+        self._finish(name, result)
+
+    def stage_failed(self, name, error):
+        # the stage is still recorded, and its profiler and tracemalloc stopped
+        self._finish(name, None, error)
+
+    def _finish(self, name, result, error=None):
+        state = self._started.pop()
+        if state['profiler'] is not None:
+            state['profiler'].disable()
+        wall = time.perf_counter() - state['wall']
+        cpu = time.process_time() - state['cpu']
+        read, written = io_bytes()
+        peak = peak_rss_kb()
+        children_peak = children_peak_rss_kb()
+        record = {
+            'stage': name,
+            'seconds': wall,
+            'cpu_seconds': cpu,
+            'rss_kb': rss_kb(),
+            'peak_rss_kb': peak,
+            'peak_rss_delta_kb': _delta(peak, state['rss_kb']),
+            # peak of the largest child process the stage ran (None if it ran
+            # none bigger than earlier ones); not included in peak_rss_kb
+            'children_peak_rss_kb': children_peak if children_peak > state['children_peak_rss_kb'] else None,
+            'rows_in': state['rows_in'],
+            'rows_out': count_rows(result),
+            'bytes_read': _delta(read, state['io'][0]),
+            'bytes_written': _delta(written, state['io'][1]),
+        }
+        if error is not None:
+            record['error'] = repr(error)
+        if state['tracing']:
+            snapshot = tracemalloc.take_snapshot()
+            record['tracemalloc_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            record['tracemalloc_top'] = [
+                {'where': str(stat.traceback), 'bytes': stat.size, 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:self.top]
+            ]
+        if state['profiler'] is not None:
+            record['profile_top'] = self._profile_summary(name, state['profiler'])
+        self.stages.append(record)
+
+    def _profile_summary(self, name, profiler):
+        if self.profile_dir is not None:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_dir, f'{name}.prof'))
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(self.top)
+        return out.getvalue().splitlines()
+
+    def trace(self, script_pth=None):
+        # {'stages': {name: record}, 'order': [...], 'total_seconds'}; with the
+        # workflow script, each record also gets its @IN/@OUT annotations.
+        annotations = {}
+        if script_pth is not None:
+            annotations = {block['name']: block for block in parse_annotations(script_pth)}
+        stages = {}
+        for record in self.stages:
+            record = dict(record)
+            block = annotations.get(record['stage'])
+            if block is not None:
+                record['ins'] = block['ins']
+                record['outs'] = block['outs']
+            stages[record.pop('stage')] = record
+        return {
+            'workflow': os.path.basename(script_pth) if script_pth is not None else None,
+            'order': [record['stage'] for record in self.stages],
+            'total_seconds': sum(record['seconds'] for record in self.stages),
+            'stages': stages,
+        }
+
+    def write(self, path, script_pth=None):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.trace(script_pth), f, indent=2)
+
+
+_NODE = re.compile(r'^(\w+) \[shape=record rankdir=LR label="\{<f0> (\w+) \|<f1> (.*)\}"\];$')
+
+
+def _heat(share):
+    # light green (#CCFFCC) for a negligible stage to red for one taking the whole run
+    share = min(max(share, 0.0), 1.0)
+    red = 0xCC + round((0xFF - 0xCC) * share)
+    green = 0xFF - round((0xFF - 0x66) * share)
+    blue = 0xCC - round((0xCC - 0x66) * share)
+    return f'#{red:02X}{green:02X}{blue:02X}'
+
+
+def _fmt_bytes(n):
+    if n is None:
+        return '?'
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if abs(n) < 1024 or unit == 'GiB':
+            return f'{n:.0f} {unit}' if unit == 'B' else f'{n:.1f} {unit}'
+        n /= 1024
+
+
+# @BEGIN Overlay_Trace_On_Graph @desc Annotate the stage boxes of a YesWorkflow Graphviz file with a stage trace.
+# @IN trace
+# @IN workflow_gv
+# @OUT traced_gv
+def overlay_graph(trace, gv_pth, out_pth):
+    total = trace['total_seconds'] or 1.0
+    lines = []
+    with open(gv_pth) as f:
+        for line in f.read().splitlines():
+            match = _NODE.match(line)
+            if match and match.group(2) in trace['stages']:
+                node, name, desc = match.groups()
+                s = trace['stages'][name]
+                peak = None if s['peak_rss_delta_kb'] is None else s['peak_rss_delta_kb'] * 1024
+                metrics = (f"{s['seconds']:.2f}s wall, {s['cpu_seconds']:.2f}s cpu ({100 * s['seconds'] / total:.0f}%)\\l"
+                           f"peak +{_fmt_bytes(peak)}, rows {s['rows_in']:,} -> {s['rows_out']:,}\\l"
+                           f"read {_fmt_bytes(s['bytes_read'])}, wrote {_fmt_bytes(s['bytes_written'])}\\l")
+                line = (f'{node} [shape=record rankdir=LR style=filled fillcolor="{_heat(s["seconds"] / total)}" '
+                        f'label="{{<f0> {name} |<f1> {desc}|<f2> {metrics}}}"];')
+            lines.append(line)
+    with open(out_pth, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+# @END Overlay_Trace_On_Graph
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Overlay a stage trace on a YesWorkflow Graphviz file.')
+    parser.add_argument('trace')
+    parser.add_argument('gv')
+    parser.add_argument('output')
+    args = parser.parse_args()
+    with open(args.trace) as f:
+        overlay_graph(json.load(f), args.gv, args.output)
@@ -0,0 +1,198 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+import dates
+import ingest
+
+# Integrity constraints of the restaurant_menus.db schema (ingest.TABLE_SCHEMAS,
+# i.e. Queries 1.1 - 4.1 in analysis/queries.md), checked column-wise on the
+# DataFrames before or after they are loaded. Every constraint is one vectorized
+# pass: np.isin against the sorted parent keys for foreign keys, a hashed
+# duplicated() for primary keys and array comparisons for NOT NULL and CHECK.
+# Violations come back as arrays of the offending rows' ids, not row copies.
+
+_FOREIGN_KEY = re.compile(r'FOREIGN KEY\s*\((\w+)\)\s*REFERENCES\s+(\w+)\s*\((\w+)\)')
+_CHECK = re.compile(r'(?:CONSTRAINT\s+(\w+)\s+)?CHECK\s*\((.*)\)')
+_COMPARISON = re.compile(r'^(\w+)\s*(>=|<=|<>|!=|=|>|<)\s*(-?\d+(?:\.\d+)?)$')
+
+_OPERATORS = {
+    '>=': np.greater_equal,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '<': np.less,
+    '=': np.equal,
+    '!=': np.not_equal,
+    '<>': np.not_equal,
+}
+
+
+def table_constraints(table, clip_lower=1840, clip_upper=2008):
+    # [(name, kind, spec)] parsed from the CREATE TABLE statement, where kind is
+    # 'primary_key', 'not_null', 'foreign_key' or 'check'.
+    create = ingest.create_statement(table, clip_lower, clip_upper)
+    body = create[create.index('(') + 1:create.rindex(')')]
+    constraints = []
+    for line in body.split('\n'):
+        line = line.strip().rstrip(',')
+        if not line:
+            continue
+        match = _FOREIGN_KEY.search(line)
+        if match:
+            column, parent, parent_column = match.groups()
+            constraints.append((f'{table}.{column} -> {parent}.{parent_column}', 'foreign_key', (column, parent, parent_column)))
+            continue
+        parts = line.split()
+        column = parts[0]
+        if 'PRIMARY KEY' in line and not line.startswith('PRIMARY'):
+            constraints.append((f'{table}.{column} PRIMARY KEY', 'primary_key', column))
+        if 'NOT NULL' in line:
+            constraints.append((f'{table}.{column} NOT NULL', 'not_null', column))
+        match = _CHECK.search(line)
+        if match:
+            name, condition = match.groups()
+            constraints.append((f"{table}.{name or condition}", 'check', _parse_check(condition)))
+    return constraints
+
+
+def _parse_check(condition):
+    # Conjunctions of column-vs-number comparisons, which is all the schema uses.
+    terms = []
+    for term in re.split(r'\s+AND\s+', condition.strip(), flags=re.IGNORECASE):
+        match = _COMPARISON.match(term.strip().strip('()'))
+        if not match:
+            raise ValueError(f'unsupported CHECK constraint: {condition}')
+        column, op, value = match.groups()
+        terms.append((column, op, float(value)))
+    return terms
+
+
+def _nulls(values):
+    # only real missing values: NOT NULL takes '' like SQLite does, and no
+    # CHECK of the schema rules out empty strings
+    return values.isna().to_numpy(dtype=bool)
+
+
+def _numbers(values):
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        return values.to_numpy(dtype='float64', na_value=np.nan)
+    return pd.to_numeric(values, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+
+
+def _row_ids(frame, mask):
+    ids = frame['id'] if 'id' in frame.columns else pd.Series(frame.index, index=frame.index)
+    ids = pd.to_numeric(ids, errors='coerce')
+    # -1 for rows whose own id is missing or not a number
+    return ids[mask].fillna(-1).to_numpy(dtype='int64')
+
+
+def _violations(frame, kind, spec, frames):
+    if kind == 'primary_key':
+        values = frame[spec]
+        return _nulls(values) | values.duplicated(keep=False).to_numpy()
+    if kind == 'not_null':
+        return _nulls(frame[spec])
+    if kind == 'check':
+        # SQL semantics: a CHECK that evaluates to NULL passes, a non-numeric value fails
+        mask = np.zeros(len(frame), dtype=bool)
+        for column, op, value in spec:
+            numbers = _numbers(frame[column])
+            unparsed = np.isnan(numbers) & ~_nulls(frame[column])
+            with np.errstate(invalid='ignore'):
+                failed = ~_OPERATORS[op](numbers, value) & ~np.isnan(numbers)
+            mask |= failed | unparsed
+        return mask
+    column, parent, parent_column = spec
+    children = _numbers(frame[column])
+    keys = np.unique(_numbers(frames[parent][parent_column]))
+    present = ~np.isnan(children)
+    return present & ~np.isin(children, keys, assume_unique=False)
+
+
+# Constraint kinds SQLite enforces when a row is inserted; foreign keys are
+# only reported, the loads run with PRAGMA foreign_keys off.
+ENFORCED_KINDS = ('not_null', 'check', 'primary_key')
+
+
+def rejected_rows(frame, table, clip_lower=1840, clip_upper=2008):
+    # The constraint each row would fail when inserted into the table, or None:
+    # a NULL in a NOT NULL column, a failed CHECK, or a NULL or repeated primary
+    # key. Of the rows sharing a key, the first one left by the other
+    # constraints is accepted, as an INSERT of the rows in order would do.
+    # Returns an object array with one entry per row.
+    reasons = np.full(len(frame), None, dtype=object)
+    constraints = table_constraints(table, clip_lower, clip_upper)
+    for kind in ENFORCED_KINDS:
+        for name, _, spec in [constraint for constraint in constraints if constraint[1] == kind]:
+            columns = [spec] if kind in ('primary_key', 'not_null') else [column for column, _, _ in spec]
+            if any(column not in frame.columns for column in columns):
+                continue
+            if kind == 'primary_key':
+                accepted = pd.isna(reasons)
+                keys = frame[spec][accepted]
+                mask = np.zeros(len(frame), dtype=bool)
+                mask[accepted] = _nulls(keys) | keys.duplicated().to_numpy()
+            else:
+                mask = _violations(frame, kind, spec, None)
+            reasons[mask & pd.isna(reasons)] = name
+    return reasons
+
+
+# @BEGIN Check_Integrity_Constraints @desc Find the rows violating each primary key, NOT NULL, CHECK and foreign key constraint.
+# @IN frames
+# @OUT ic_violations
+def check_integrity(frames, clip_lower=1840, clip_upper=2008):
+    # frames: {'dish': DataFrame, ...} keyed like ingest.TABLE_SCHEMAS; any subset works,
+    # foreign keys to a table that isn't there are skipped; clip_lower/clip_upper
+    # are the dish year bounds of the CHECK constraints.
+    # Returns {constraint name: int64 array of violating row ids}.
+    violations = {}
+    for table, frame in frames.items():
+        for name, kind, spec in table_constraints(table, clip_lower, clip_upper):
+            if kind == 'foreign_key' and spec[1] not in frames:
+                continue
+            columns = [spec] if kind in ('primary_key', 'not_null') else (
+                [spec[0]] if kind == 'foreign_key' else [column for column, _, _ in spec])
+            if any(column not in frame.columns for column in columns):
+                continue
+            violations[name] = _row_ids(frame, _violations(frame, kind, spec, frames))
+    return violations
+# @END Check_Integrity_Constraints
+
+
+def source_columns(table):
+    # The table's columns as in the NYPL CSVs, i.e. without the typed date
+    # columns dates.normalize_dates() derives (date_epoch, year, *_epoch).
+    derived = {epoch for _, _, epoch in dates.DATE_COLUMNS.get(table, [])}
+    derived.update(dates.YEAR_COLUMNS.get(table, ())[1:])
+    return [name for name, _ in ingest.table_columns(table) if name not in derived]
+
+
+def match_table(frame):
+    # The schema table whose source columns the frame has, for single-table
+    # workflows on raw or cleaned CSVs.
+    for table in ingest.TABLE_SCHEMAS:
+        if all(name in frame.columns for name in source_columns(table)):
+            return table
+    return None
+
+
+def violation_counts(violations):
+    return {name: len(ids) for name, ids in violations.items()}
+
+
+def table_violation_counts(violations):
+    # total violating rows per table (a row breaking two constraints counts twice)
+    counts = {table: 0 for table in ingest.TABLE_SCHEMAS}
+    for name, ids in violations.items():
+        counts[name.split('.', 1)[0]] += len(ids)
+    return counts
+
+
+def violations_frame(violations):
+    # Long format (constraint, id) for writing to CSV.
+    return pd.DataFrame({
+        'constraint': np.repeat(list(violations), [len(ids) for ids in violations.values()]),
+        'id': np.concatenate(list(violations.values())) if violations else np.empty(0, dtype='int64'),
+    })
@@ -0,0 +1,297 @@
+import argparse
+import json
+import re
+
+import pandas as pd
+
+# Headless replay of OpenRefine operation histories (openrefine/*_OpenRefineHistory.json).
+# Each supported operation is compiled into a function over a column of strings and
+# run with pandas' vectorized .str methods; consecutive text transforms on the same
+# column are fused so the column is extracted, masked and written back only once.
+
+
+class UnsupportedOperationError(ValueError):
+    pass
+
+
+# Java regex \p{Zs} (Unicode space separators) has no equivalent in Python's re module.
+_ZS_CHARS = '\u0020\u00a0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a\u202f\u205f\u3000'
+
+# Java SimpleDateFormat letters -> strftime directives, longest first.
+_DATE_PATTERNS = [
+    ('yyyy', '%Y'), ('yy', '%y'), ('MMMM', '%B'), ('MMM', '%b'), ('MM', '%m'), ('dd', '%d'),
+    ('HH', '%H'), ('hh', '%I'), ('mm', '%M'), ('ss', '%S'), ('a', '%p'),
+]
+
+# How OpenRefine writes a date cell when the project is exported to CSV.
+OPENREFINE_DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def java_regex_to_python(pattern):
+    out = []
+    in_class = False
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('\\p{Zs}', i):
+            out.append(re.escape(_ZS_CHARS) if in_class else f'[{re.escape(_ZS_CHARS)}]')
+            i += len('\\p{Zs}')
+            continue
+        char = pattern[i]
+        if char == '\\':
+            out.append(pattern[i:i + 2])
+            i += 2
+            continue
+        if char == '[':
+            in_class = True
+        elif char == ']':
+            in_class = False
+        out.append(char)
+        i += 1
+    return ''.join(out)
+
+
+def java_date_format_to_strftime(fmt):
+    out = []
+    i = 0
+    while i < len(fmt):
+        for java, python in _DATE_PATTERNS:
+            if fmt.startswith(java, i):
+                out.append(python)
+                i += len(java)
+                break
+        else:
+            out.append(fmt[i].replace('%', '%%'))
+            i += 1
+    return ''.join(out)
+
+
+# Every step takes and returns a Series of strings; cells it cannot handle come
+# back as NaN and are restored to their input value (onError: keep-original).
+
+def _trim(values):
+    return values.str.strip()
+
+
+def _replace(pattern, replacement):
+    regex = re.compile(java_regex_to_python(pattern))
+    # GREL's replace() with a regex replaces every match, like Java's replaceAll,
+    # and refers to groups as $1 rather than \1.
+    replacement = re.sub(r'\$(\d+)', r'\\g<\1>', replacement.replace('\\', '\\\\'))
+    return lambda values: values.str.replace(regex, replacement, regex=True)
+
+
+def _replace_string(old, new):
+    return lambda values: values.str.replace(old, new, regex=False)
+
+
+def _strftime(parsed, fmt):
+    # Dates repeat a lot (whole menus share one), so format each distinct
+    # timestamp once. strftime('%Y') does not zero-pad years before 1000 on
+    # glibc, but Java's yyyy does (and the NYPL data has dates like 0190-03-06).
+    codes, uniques = pd.factorize(parsed)
+    if not len(uniques):
+        return pd.Series(None, index=parsed.index, dtype=object)
+    uniques = pd.Series(pd.DatetimeIndex(uniques))
+    parts = fmt.split('%Y')
+    formatted = uniques.dt.strftime(parts[0]) if parts[0] else pd.Series('', index=uniques.index)
+    year = uniques.dt.year.astype(str).str.zfill(4)
+    for part in parts[1:]:
+        formatted = formatted + year
+        if part:
+            formatted = formatted + uniques.dt.strftime(part)
+    result = formatted.to_numpy(dtype=object).take(codes, mode='clip')
+    return pd.Series(result, index=parsed.index).where(codes >= 0)
+
+
+def _parse_dates(values):
+    # One vectorized parse with the format inferred from the first value; only the
+    # leftovers that look like they could be dates go through per-value parsing.
+    parsed = pd.to_datetime(values, errors='coerce', utc=True)
+    rest = parsed.isna() & values.str.contains(r'\d', regex=True).fillna(False).astype(bool)
+    if rest.any():
+        parsed[rest] = pd.to_datetime(values[rest], errors='coerce', utc=True, format='mixed')
+    return parsed
+
+
+def _to_date(values):
+    return _strftime(_parse_dates(values), OPENREFINE_DATE_FORMAT)
+
+
+def _format_date(fmt):
+    strftime = java_date_format_to_strftime(fmt)
+
+    def format_date(values):
+        return _strftime(_parse_dates(values), strftime)
+    return format_date
+
+
+def _to_number(values):
+    numbers = pd.to_numeric(values, errors='coerce')
+    # keep the cell a string so later steps still see text, e.g. "12.50" -> "12.5"
+    return numbers.astype(object).where(numbers.isna(), numbers.astype(str))
+
+
+_METHODS = {
+    'trim': lambda: _trim,
+    'strip': lambda: _trim,
+    'toLowercase': lambda: lambda values: values.str.lower(),
+    'toUppercase': lambda: lambda values: values.str.upper(),
+    'toTitlecase': lambda: lambda values: values.str.title(),
+    'toDate': lambda: _to_date,
+    'toNumber': lambda: _to_number,
+    'toString': lambda: lambda values: values,
+}
+
+_STRING = r'(?:"((?:[^"\\]|\\.)*)"|\'((?:[^\'\\]|\\.)*)\')'
+_REGEX = r'/((?:[^/\\]|\\.)*)/'
+_CALL = re.compile(r'\.(\w+)\(\)')
+_REPLACE_CALL = re.compile(r'\.replace\(\s*(?:' + _REGEX + r'|' + _STRING + r')\s*,\s*' + _STRING + r'\s*\)')
+_FORMAT_DATE = re.compile(r'toString\(\s*toDate\(\s*value\s*\)\s*,\s*' + _STRING + r'\s*\)$')
+
+
+def compile_expression(expression):
+    # Supports `value` followed by a chain of the methods above and
+    # .replace(/regex/ or "string", "replacement"), plus toString(toDate(value), "format").
+    source = expression.strip()
+    if source.startswith('grel:'):
+        source = source[len('grel:'):].strip()
+    match = _FORMAT_DATE.match(source)
+    if match:
+        return [_format_date(match.group(1) if match.group(1) is not None else match.group(2))]
+    if not source.startswith('value'):
+        raise UnsupportedOperationError(f'unsupported GREL expression: {expression}')
+    steps = []
+    rest = source[len('value'):]
+    while rest:
+        match = _REPLACE_CALL.match(rest)
+        if match:
+            regex, old_dq, old_sq, new_dq, new_sq = match.groups()
+            new = new_dq if new_dq is not None else new_sq
+            if regex is not None:
+                steps.append(_replace(regex.replace('\\/', '/'), new))
+            else:
+                steps.append(_replace_string(old_dq if old_dq is not None else old_sq, new))
+            rest = rest[match.end():]
+            continue
+        match = _CALL.match(rest)
+        if match and match.group(1) in _METHODS:
+            steps.append(_METHODS[match.group(1)]())
+            rest = rest[match.end():]
+            continue
+        raise UnsupportedOperationError(f'unsupported GREL expression: {expression}')
+    return steps
+
+
+def _check_engine(operation):
+    facets = operation.get('engineConfig', {}).get('facets', [])
+    if facets:
+        raise UnsupportedOperationError(f"faceted operations are not supported: {operation.get('description')}")
+
+
+def compile_history(history):
+    # Returns a list of ('transform', column, steps) / ('rename', old, new) /
+    # ('remove', column, None) / ('mass-edit', column, mapping) actions, with
+    # consecutive transforms of one column already fused into a single action.
+    actions = []
+    for operation in history:
+        op = operation['op']
+        if op == 'core/text-transform':
+            _check_engine(operation)
+            if operation.get('onError', 'keep-original') != 'keep-original':
+                raise UnsupportedOperationError(f"onError={operation['onError']} is not supported")
+            steps = compile_expression(operation['expression'])
+            if operation.get('repeat'):
+                steps = [_repeat(steps, operation.get('repeatCount', 10))]
+            column = operation['columnName']
+            if actions and actions[-1][0] == 'transform' and actions[-1][1] == column:
+                actions[-1][2].extend(steps)
+            else:
+                actions.append(('transform', column, list(steps)))
+        elif op == 'core/mass-edit':
+            _check_engine(operation)
+            mapping = {}
+            for edit in operation['edits']:
+                for value in edit['from']:
+                    mapping[value] = edit['to']
+            actions.append(('mass-edit', operation['columnName'], mapping))
+        elif op == 'core/column-rename':
+            actions.append(('rename', operation['oldColumnName'], operation['newColumnName']))
+        elif op == 'core/column-removal':
+            actions.append(('remove', operation['columnName'], None))
+        else:
+            raise UnsupportedOperationError(f'unsupported operation: {op}')
+    return actions
+
+
+def _repeat(steps, count):
+    def repeat(values):
+        for _ in range(count):
+            changed = _apply_steps(steps, values)
+            if changed.equals(values):
+                break
+            values = changed
+        return values
+    return repeat
+
+
+def _apply_steps(steps, values):
+    for step in steps:
+        result = step(values)
+        values = result.where(result.notna(), values)
+    return values
+
+
+def _string_mask(column):
+    if pd.api.types.is_string_dtype(column.dtype) and column.dtype != object:
+        return column.notna()
+    if column.dtype == object:
+        if pd.api.types.infer_dtype(column, skipna=True) == 'string':
+            return column.notna()
+        return column.map(type, na_action='ignore') == str
+    return pd.Series(False, index=column.index)
+
+
+# @BEGIN Replay_OpenRefine_History @desc Apply an OpenRefine operation history to a DataFrame, one fused pass per column run.
+# @IN history
+# @IN frame
+# @OUT transformed_frame
+def replay_history(frame, history):
+    frame = frame.copy()
+    for action, column, arg in compile_history(history):
+        if action == 'transform':
+            mask = _string_mask(frame[column])
+            if mask.any():
+                # GREL transforms are pure functions of the cell, so the fused
+                # steps only run once per distinct value of the column.
+                codes, uniques = pd.factorize(frame.loc[mask, column])
+                values = _apply_steps(arg, pd.Series(uniques, dtype=object))
+                frame[column] = frame[column].astype(object)
+                frame.loc[mask, column] = values.to_numpy(dtype=object).take(codes)
+        elif action == 'mass-edit':
+            frame[column] = frame[column].replace(arg)
+        elif action == 'rename':
+            frame = frame.rename(columns={column: arg})
+        elif action == 'remove':
+            frame = frame.drop(columns=[column])
+    return frame
+# @END Replay_OpenRefine_History
+
+
+def load_history(history_pth):
+    with open(history_pth) as f:
+        return json.load(f)
+
+
+def replay_history_file(frame, history_pth):
+    return replay_history(frame, load_history(history_pth))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay an OpenRefine operation history on a CSV file.')
+    parser.add_argument('history')
+    parser.add_argument('input_csv')
+    parser.add_argument('output_csv')
+    args = parser.parse_args()
+    # OpenRefine imports every cell as text, so do the same
+    data = pd.read_csv(args.input_csv, dtype=str, keep_default_na=False)
+    replay_history_file(data, args.history).to_csv(args.output_csv, index=False)
@@ -0,0 +1,417 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import schema
+
+# Profiles a table in one pass over its rows, chunk by chunk, instead of
+# describe(include='all') and a separate isnull()/notnull()/value_counts() scan
+# per column. Every column keeps small mergeable summaries: null and value
+# counts, min/max, mean and variance (Chan's parallel update), a HyperLogLog
+# for the distinct count, a KLL-style sketch for the quantiles of numbers, and
+# Misra-Gries summaries of the most frequent values and of their shapes
+# ("1900-01-01" -> "9999-99-99", "Hotel Astor" -> "Aa Aa"). Profiles of chunks,
+# or of the same table in different worker processes, merge into the profile
+# of the whole table; the counts, min and max are exact, the rest approximate.
+# Optionally a profile also counts the values outside given bounds and keeps a
+# 64-bit hash per row, so duplicate rows are counted without another pass.
+
+
+class HyperLogLog:
+    # 2**p one-byte registers over 64-bit value hashes; the distinct count is
+    # off by about 1.04 / sqrt(2**p), 0.8% at p=14.
+    def __init__(self, p=14):
+        self.p = p
+        self.registers = np.zeros(1 << p, dtype=np.uint8)
+
+    def add_hashes(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if not len(hashes):
+            return
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.intp)
+        # the rank (position of the first 1 bit) is read off the next 32 bits,
+        # whose bit length frexp gives exactly; longer runs of zeros are capped
+        following = (hashes >> np.uint64(32 - self.p)) & np.uint64(0xFFFFFFFF)
+        _, bits = np.frexp(following.astype(np.float64))
+        np.maximum.at(self.registers, index, (33 - bits).astype(np.uint8))
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / np.exp2(-self.registers.astype(np.float64)).sum()
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is the better estimate for small counts
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+
+class QuantileSketch:
+    # KLL-style compactors: level h keeps values that each stand for 2**h of the
+    # input. A level holding more than k values is sorted and every other one
+    # (from a random start) moves up a level, so the sketch stays O(k log n) and
+    # a quantile's rank is off by a small multiple of n / k.
+    def __init__(self, k=512, seed=0):
+        self.k = k
+        self.levels = []
+        self._rng = np.random.default_rng(seed)
+
+    def _add(self, level, values):
+        while len(self.levels) <= level:
+            self.levels.append(np.empty(0, dtype=np.float64))
+        self.levels[level] = np.concatenate([self.levels[level], values])
+
+    def _compact(self):
+        level = 0
+        while level < len(self.levels):
+            values = self.levels[level]
+            if len(values) > self.k:
+                values = np.sort(values)
+                odd = len(values) % 2
+                self.levels[level] = values[len(values) - odd:]
+                self._add(level + 1, values[self._rng.integers(2):len(values) - odd:2])
+            level += 1
+
+    def update(self, values):
+        values = np.sort(np.asarray(values, dtype=np.float64))
+        if not len(values):
+            return
+        # a big chunk goes straight to the level it would be compacted to
+        level = max(0, int(np.ceil(np.log2(len(values) / self.k))))
+        if level:
+            values = values[self._rng.integers(1 << level)::1 << level]
+        self._add(level, values)
+        self._compact()
+
+    def merge(self, other):
+        for level, values in enumerate(other.levels):
+            self._add(level, values)
+        self._compact()
+
+    def quantiles(self, qs):
+        if not any(len(values) for values in self.levels):
+            return np.full(len(qs), np.nan)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(v), 1 << level, dtype=np.int64) for level, v in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        cumulative = np.cumsum(weights[order])
+        position = np.searchsorted(cumulative, np.asarray(qs) * cumulative[-1], side='left')
+        return values[order][position.clip(0, len(values) - 1)]
+
+
+class FrequentItems:
+    # Misra-Gries summary: at most `capacity` values with lower bounds of their
+    # counts. Every value seen more than n / (capacity + 1) times is kept, and
+    # the counts are exact while there are no more than `capacity` distinct values.
+    # `error` is the most a count can be short by (the sum of the cuts, at most
+    # n / (capacity + 1)); a value that was dropped was seen at most `error` times.
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.counts = pd.Series(dtype='int64')
+        self.error = 0
+
+    def update(self, counts, error=0):
+        # counts: Series of count by value
+        merged = self.counts.add(counts, fill_value=0) if len(self.counts) else counts
+        self.error += error
+        if len(merged) > self.capacity:
+            cut = merged.nlargest(self.capacity + 1).iloc[-1]
+            merged = merged[merged > cut] - cut
+            self.error += int(cut)
+        self.counts = merged.astype('int64')
+
+    def merge(self, other):
+        self.update(other.counts, other.error)
+
+    def top(self, k=10):
+        return self.counts.sort_values(ascending=False, kind='stable').head(k)
+
+    def most_frequent(self):
+        # (value, count lower bound) when the value is certainly the most
+        # frequent one, i.e. no other value can have been seen more often;
+        # (None, None) when the summary can't tell.
+        top = self.top(2)
+        if not len(top):
+            return None, None
+        runner_up = top.iloc[1] if len(top) > 1 else 0
+        if top.iloc[0] < runner_up + self.error:
+            return None, None
+        return top.index[0], int(top.iloc[0])
+
+
+class _Shapes(dict):
+    # Every letter becomes A or a and every digit 9, in any script; runs of
+    # letters and of spaces are then collapsed, while digits keep their width.
+    # The table for all of Unicode would be large, so each code point is added
+    # the first time str.translate meets it.
+    def __missing__(self, c):
+        char = chr(c)
+        if char.isalpha():
+            shape = 'A' if char.isupper() else 'a'
+        elif char.isdigit():
+            shape = '9'
+        elif char.isalnum() or char.isspace():
+            shape = ' '
+        else:
+            shape = char
+        self[c] = shape
+        return shape
+
+
+_SHAPES = _Shapes()
+
+
+def patterns(values):
+    # Shape of every string in `values` (a Series). Far fewer distinct strings
+    # are left after the translation, so only those go through the regex.
+    codes, shapes = pd.factorize(values.str.translate(_SHAPES))
+    shapes = pd.Series(shapes, dtype=object).str.replace(r'([Aa ])\1+', r'\1', regex=True)
+    return pd.Series(shapes.to_numpy(dtype=object).take(codes), index=values.index)
+
+
+def _is_numeric(series):
+    return pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype)
+
+
+def _lesser(a, b):
+    return b if a is None else a if b is None else min(a, b)
+
+
+def _greater(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+
+class ColumnProfile:
+    # Numbers get moments and quantiles, everything else frequent values and
+    # shapes. A column is numeric while all its non-null chunks are; one that
+    # isn't (or merging a profile that isn't) makes it non-numeric for good.
+    # bounds: (lower, upper) to count the numbers outside of, or None.
+    def __init__(self, bounds=None):
+        self.numeric = None
+        self.bounds = bounds
+        self.out_of_range = 0
+        self.count = 0
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.distinct = HyperLogLog()
+        self.quantiles = QuantileSketch()
+        self.top = FrequentItems()
+        self.patterns = FrequentItems()
+
+    def _add_moments(self, count, mean, m2):
+        total = self.count + count
+        if count:
+            delta = mean - self.mean
+            self.mean += delta * count / total
+            self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def _downgrade(self):
+        # The numbers seen so far were summarized without their frequencies and
+        # shapes, so any count of those can be short by all of them; min/max,
+        # moments and quantiles of numbers don't apply to the column any more.
+        self.numeric = False
+        self.top.error += self.count
+        self.patterns.error += self.count
+        self.min = self.max = None
+        self.mean = self.m2 = 0.0
+        self.quantiles = QuantileSketch()
+
+    def _count_out_of_range(self, series):
+        if self.bounds is None:
+            return
+        numbers = series if _is_numeric(series) else pd.to_numeric(series, errors='coerce')
+        lower, upper = self.bounds
+        self.out_of_range += int(((numbers < lower) | (numbers > upper)).sum())
+
+    def update(self, series):
+        present = series.notna().to_numpy(dtype=bool)
+        self.nulls += len(series) - int(present.sum())
+        if not present.any():
+            return
+        self._count_out_of_range(series)
+        numeric = _is_numeric(series)
+        if self.numeric is None:
+            self.numeric = numeric
+        elif self.numeric and not numeric:
+            self._downgrade()
+        if self.numeric:
+            values = series[present].to_numpy(dtype=np.float64)
+            self._add_moments(len(values), values.mean(), ((values - values.mean()) ** 2).sum())
+            self.min = _lesser(self.min, values.min())
+            self.max = _greater(self.max, values.max())
+            self.distinct.add_hashes(pd.util.hash_array(values + 0.0))
+            self.quantiles.update(values)
+            return
+        # one hash table pass; everything else is computed over the distinct values
+        codes, uniques = pd.factorize(series)
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        uniques = pd.Index(np.asarray(uniques, dtype=object))
+        self.count += int(counts.sum())
+        if uniques.inferred_type == 'string':
+            self.min = _lesser(self.min, uniques.min())
+            self.max = _greater(self.max, uniques.max())
+        self.distinct.add_hashes(pd.util.hash_array(uniques.to_numpy()))
+        self.top.update(pd.Series(counts, index=uniques))
+        shapes = patterns(pd.Series(uniques.astype(str), dtype=object))
+        self.patterns.update(pd.Series(counts).groupby(shapes.to_numpy()).sum())
+
+    def merge(self, other):
+        if self.numeric is None:
+            self.numeric = other.numeric
+        elif self.numeric and other.numeric is False:
+            self._downgrade()
+        self.nulls += other.nulls
+        self.out_of_range += other.out_of_range
+        self.distinct.merge(other.distinct)
+        if self.numeric is False and other.numeric:
+            # other's numbers have no frequencies or shapes to merge
+            self.count += other.count
+            self.top.error += other.count
+            self.patterns.error += other.count
+            return
+        self._add_moments(other.count, other.mean, other.m2)
+        self.min = _lesser(self.min, other.min)
+        self.max = _greater(self.max, other.max)
+        self.quantiles.merge(other.quantiles)
+        self.top.merge(other.top)
+        self.patterns.merge(other.patterns)
+
+    def summary(self):
+        # The rows of describe(include='all'), plus nulls and the top pattern
+        summary = {'count': self.count, 'nulls': self.nulls, 'unique': self.distinct.count() if self.count else 0}
+        if self.numeric:
+            q25, q50, q75 = self.quantiles.quantiles([0.25, 0.5, 0.75])
+            summary.update({
+                'mean': self.mean if self.count else np.nan,
+                'std': np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan,
+                'min': self.min, '25%': q25, '50%': q50, '75%': q75, 'max': self.max,
+            })
+        else:
+            # left empty when the summaries can't tell the most frequent value;
+            # freq is short by at most freq_error
+            top, freq = self.top.most_frequent()
+            pattern, pattern_freq = self.patterns.most_frequent()
+            summary.update({
+                'top': top, 'freq': freq, 'freq_error': self.top.error if top is not None else None,
+                'min': self.min, 'max': self.max,
+                'pattern': pattern, 'pattern_freq': pattern_freq,
+            })
+        return summary
+
+
+SUMMARY_ROWS = ['count', 'nulls', 'unique', 'top', 'freq', 'freq_error', 'mean', 'std', 'min', '25%', '50%', '75%', 'max',
+                'pattern', 'pattern_freq']
+
+
+class TableProfile:
+    # bounds: {column: (lower, upper)} to count the values outside of.
+    # hash_rows: keep a hash of every row (8 bytes each) for duplicate_rows().
+    def __init__(self, bounds=None, hash_rows=False):
+        self.rows = 0
+        self.columns = {}
+        self.bounds = bounds or {}
+        self.row_hashes = [] if hash_rows else None
+
+    def _column(self, name):
+        if name not in self.columns:
+            self.columns[name] = ColumnProfile(self.bounds.get(name))
+        return self.columns[name]
+
+    def update(self, frame):
+        self.rows += len(frame)
+        for name, series in frame.items():
+            self._column(name).update(series)
+        if self.row_hashes is not None:
+            self.row_hashes.append(pd.util.hash_pandas_object(frame, index=False).to_numpy())
+        return self
+
+    def merge(self, other):
+        self.rows += other.rows
+        for name, column in other.columns.items():
+            self._column(name).merge(column)
+        if self.row_hashes is not None:
+            self.row_hashes.extend(other.row_hashes)
+        return self
+
+    def nulls(self):
+        # the same as frame.isnull().sum()
+        return pd.Series({name: column.nulls for name, column in self.columns.items()}, dtype='int64')
+
+    def out_of_range(self):
+        # values outside each bounded column's (lower, upper)
+        return pd.Series({name: self.columns[name].out_of_range if name in self.columns else 0 for name in self.bounds},
+                         dtype='int64')
+
+    def duplicate_rows(self):
+        # the same as frame.duplicated().sum(), up to 64-bit hash collisions
+        if self.row_hashes is None:
+            raise ValueError('duplicate_rows() needs a profile made with hash_rows=True')
+        hashes = np.concatenate(self.row_hashes) if self.row_hashes else np.empty(0, dtype=np.uint64)
+        return self.rows - len(np.unique(hashes))
+
+    def describe(self):
+        return pd.DataFrame({name: column.summary() for name, column in self.columns.items()}, index=SUMMARY_ROWS)
+
+    def patterns(self, k=10):
+        rows = [(name, pattern, count) for name, column in self.columns.items()
+                for pattern, count in column.patterns.top(k).items()]
+        return pd.DataFrame(rows, columns=['column', 'pattern', 'rows'])
+
+
+# @BEGIN Profile_Table @desc Profile a table in one pass: nulls, min/max, distinct counts, quantiles, frequent values and patterns.
+# @IN frame
+# @OUT profile_stats
+def profile_table(frame, chunksize=None, bounds=None, hash_rows=False):
+    profile = TableProfile(bounds, hash_rows)
+    if chunksize is None:
+        return profile.update(frame)
+    for start in range(0, len(frame), chunksize):
+        profile.update(frame.iloc[start:start + chunksize])
+    return profile
+# @END Profile_Table
+
+
+def profile_chunks(chunks, profile):
+    # Passes the chunks through, profiling each on the way.
+    for chunk in chunks:
+        profile.update(chunk)
+        yield chunk
+
+
+def profile_report(profiles):
+    # {table: TableProfile} -> one row per (table, column)
+    frames = [profile.describe().T.rename_axis('column').reset_index().assign(table=table)
+              for table, profile in profiles.items()]
+    report = pd.concat(frames, ignore_index=True)
+    report = report.astype({'count': 'int64', 'nulls': 'int64', 'unique': 'int64'})
+    return report[['table', 'column'] + SUMMARY_ROWS]
+
+
+def pattern_report(profiles, k=10):
+    frames = [profile.patterns(k).assign(table=table) for table, profile in profiles.items()]
+    report = pd.concat(frames, ignore_index=True)
+    return report[['table', 'column', 'pattern', 'rows']]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Profile the cleaned tables in one pass per table.')
+    parser.add_argument('--file-pth', default='.')
+    parser.add_argument('--suffix', default='clean', help='profile clean_data/<Table>_<suffix>.csv')
+    parser.add_argument('--output', default='profile_report.csv')
+    parser.add_argument('--patterns', default=None, help='also write the top patterns of every column to this CSV')
+    args = parser.parse_args()
+    profiles = {}
+    for table in schema.CSV_NAMES:
+        profiles[table] = profile_table(schema.read_clean_table(args.file_pth, table, args.suffix, compact=False))
+    profile_report(profiles).to_csv(args.output, index=False)
+    if args.patterns is not None:
+        pattern_report(profiles).to_csv(args.patterns, index=False)
+    for table, profile in profiles.items():
+        print(f'{table}: {profile.rows:,} rows, {len(profile.columns)} columns')
@@ -0,0 +1,264 @@
+import argparse
+import asyncio
+import collections
+import contextlib
+import csv
+import functools
+import os
+import queue
+import sqlite3
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+# Read-only query layer over restaurant_menus.db for the dashboards that run
+# variants of Use Case 1 (top N dishes per year, decade, venue or location).
+# Requests share a pool of read-only connections to the database in WAL mode,
+# so they read concurrently with each other and with a reload; sqlite3 keeps
+# each connection's prepared statements, and every variant is one fixed SQL
+# text with bound parameters, so a statement is compiled once per connection.
+# Rows are read in fetchmany() batches and can be consumed as they arrive.
+# While it is being read, a result holds a pooled connection and its read
+# transaction (which keeps WAL checkpoints from completing): an iterator that
+# is not read to the end has to be closed, e.g. with contextlib.closing, and
+# a request that finds no free connection within pool_timeout seconds fails
+# instead of waiting forever. Results read to the end are kept in an LRU
+# cache, which is dropped whenever PRAGMA data_version shows that another
+# connection committed, i.e. the database was reloaded.
+
+# Occurrences of every dish name per menu, grouped by a menu column; the same
+# filter and clustered names as ingest.DISH_YEAR_COUNTS_REFRESH.
+_MENU_COUNTS = '''
+    SELECT {column} AS group_key, COALESCE(dish_clusters.canonical_name, dish.name) AS dish_name, COUNT(dish.name) AS occurrences
+    FROM
+            menu_item
+            JOIN dish ON menu_item.dish_id = dish.id
+            JOIN menu_page ON menu_item.menu_page_id = menu_page.id
+            JOIN menu ON menu_page.menu_id = menu.id
+            LEFT JOIN dish_clusters ON dish_clusters.dish_id = dish.id
+    WHERE
+            menu.year BETWEEN ? AND ? AND
+            {column} IS NOT NULL AND
+            (dish.name NOT LIKE '"' AND dish.name NOT LIKE '" %')
+    GROUP BY group_key, dish_name
+'''
+
+# grouping -> (output column, occurrences per (group_key, dish_name) between two years)
+GROUPINGS = {
+    'year': ('Year', '''
+        SELECT year AS group_key, name AS dish_name, occurrences
+        FROM dish_year_counts
+        WHERE year BETWEEN ? AND ?
+    '''),
+    'decade': ('Decade', '''
+        SELECT year / 10 * 10 AS group_key, name AS dish_name, SUM(occurrences) AS occurrences
+        FROM dish_year_counts
+        WHERE year BETWEEN ? AND ?
+        GROUP BY group_key, dish_name
+    '''),
+    'venue': ('Venue', _MENU_COUNTS.format(column='menu.venue')),
+    'location': ('Location', _MENU_COUNTS.format(column='menu.location')),
+}
+
+# Use Case 1 for any grouping: the top ? dishes of every group
+_TOP_N = '''
+    SELECT group_key, dish_name, occurrences, Rank
+    FROM
+    (
+            SELECT
+                group_key,
+                dish_name,
+                occurrences,
+                ROW_NUMBER () OVER (
+                    PARTITION BY group_key
+                    ORDER BY occurrences DESC, dish_name
+                ) Rank
+            FROM ({counts}) counts
+    ) t
+    WHERE Rank <= ?
+'''
+
+TOP_N_QUERIES = {by: _TOP_N.format(counts=counts) for by, (_, counts) in GROUPINGS.items()}
+
+# years used when a request leaves either end of the range open
+YEAR_RANGE = (0, 9999)
+
+
+def enable_wal(db_pth):
+    # WAL is a property of the database file: set once, it lets readers run
+    # alongside a writer. Returns the journal mode now in effect.
+    conn = sqlite3.connect(db_pth)
+    try:
+        return conn.execute('PRAGMA journal_mode = WAL').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def connect_read_only(db_pth, cached_statements=64):
+    uri = f'file:{urllib.parse.quote(os.path.abspath(db_pth))}?mode=ro'
+    return sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=cached_statements)
+
+
+class ConnectionPool:
+    # A fixed set of read-only connections; connection() waits until one is
+    # free, for at most `timeout` seconds (None: as long as it takes).
+    def __init__(self, db_pth, size=4, timeout=None):
+        self.timeout = timeout
+        self._connections = [connect_read_only(db_pth) for _ in range(size)]
+        self._idle = queue.LifoQueue()
+        for conn in self._connections:
+            self._idle.put(conn)
+
+    @contextlib.contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f'no free connection within {self.timeout}s; '
+                               'are iterators that were not read to the end still open?') from None
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        for conn in self._connections:
+            conn.close()
+
+
+class ResultCache:
+    # Least recently used results, keyed by request
+    def __init__(self, size=128):
+        self.size = size
+        self._results = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._results:
+                return None
+            self._results.move_to_end(key)
+            return self._results[key]
+
+    def put(self, key, rows):
+        with self._lock:
+            self._results[key] = rows
+            self._results.move_to_end(key)
+            while len(self._results) > self.size:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def __len__(self):
+        return len(self._results)
+
+
+class QueryService:
+    def __init__(self, db_pth='restaurant_menus.db', pool_size=4, cache_size=128, wal=True, pool_timeout=30):
+        if wal:
+            enable_wal(db_pth)
+        self.pool = ConnectionPool(db_pth, pool_size, pool_timeout)
+        self.cache = ResultCache(cache_size)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size)
+        # data_version only changes for commits of other connections, so this
+        # one connection, which never writes, sees every reload
+        self._watch = connect_read_only(db_pth)
+        self._watch_lock = threading.Lock()
+        self._version = None
+
+    def data_version(self):
+        # The current data_version; the result cache is cleared when it changed.
+        with self._watch_lock:
+            version = self._watch.execute('PRAGMA data_version').fetchone()[0]
+            if version != self._version:
+                self.cache.clear()
+                self._version = version
+            return version
+
+    def invalidate(self):
+        self.cache.clear()
+
+    @staticmethod
+    def fields(by='year'):
+        return [GROUPINGS[by][0], 'DishName', 'Occurrences', 'Rank']
+
+    def iter_top_dishes(self, by='year', n=10, first_year=None, last_year=None, batch_size=1000):
+        # Yields the rows of the top n dishes of every group in batches, as
+        # they are read; a result read to the end is cached. The connection
+        # goes back to the pool when the generator finishes or is closed.
+        first_year = YEAR_RANGE[0] if first_year is None else first_year
+        last_year = YEAR_RANGE[1] if last_year is None else last_year
+        key = (by, n, first_year, last_year)
+        version = self.data_version()
+        rows = self.cache.get(key)
+        if rows is not None:
+            for start in range(0, len(rows), batch_size):
+                yield rows[start:start + batch_size]
+            return
+        rows = []
+        with self.pool.connection() as conn:
+            cursor = conn.execute(TOP_N_QUERIES[by], (first_year, last_year, n))
+            try:
+                while True:
+                    batch = cursor.fetchmany(batch_size)
+                    if not batch:
+                        break
+                    rows.extend(batch)
+                    yield batch
+            finally:
+                cursor.close()
+        # not cached when the database was reloaded while the rows were read
+        if self.data_version() == version:
+            self.cache.put(key, rows)
+
+    def top_dishes(self, by='year', n=10, first_year=None, last_year=None):
+        rows = []
+        for batch in self.iter_top_dishes(by, n, first_year, last_year):
+            rows.extend(batch)
+        return rows
+
+    def submit(self, by='year', n=10, first_year=None, last_year=None):
+        # concurrent.futures.Future of top_dishes(); sqlite3 releases the GIL
+        # while a query runs, so requests on different connections overlap
+        return self._executor.submit(self.top_dishes, by, n, first_year, last_year)
+
+    async def top_dishes_async(self, by='year', n=10, first_year=None, last_year=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(self.top_dishes, by, n, first_year, last_year))
+
+    def write_csv(self, filename, by='year', n=10, first_year=None, last_year=None):
+        # Streams the result to a CSV file; returns the number of rows written.
+        written = 0
+        with open(filename, 'w', newline='') as csvfile:
+            csvwriter = csv.writer(csvfile)
+            csvwriter.writerow(self.fields(by))
+            for batch in self.iter_top_dishes(by, n, first_year, last_year):
+                csvwriter.writerows(batch)
+                written += len(batch)
+        return written
+
+    def close(self):
+        self._executor.shutdown()
+        self.pool.close()
+        self._watch.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Top N dishes per year, decade, venue or location from restaurant_menus.db.')
+    parser.add_argument('db_pth', nargs='?', default='restaurant_menus.db')
+    parser.add_argument('--by', choices=sorted(GROUPINGS), default='year')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--years', nargs=2, type=int, default=(None, None), metavar=('FIRST', 'LAST'))
+    parser.add_argument('--output', default='top_dishes.csv')
+    args = parser.parse_args()
+    with QueryService(args.db_pth, pool_size=1) as service:
+        rows = service.write_csv(args.output, args.by, args.top, *args.years)
+    print(f'{rows:,} rows written to {args.output}')
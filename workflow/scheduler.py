@@ -0,0 +1,165 @@
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import cleaning
+import profiling
+import schema
+
+# Runs the per-table stages of workflow3 as independent branches on a process
+# pool. The DAG comes from the YesWorkflow annotations of the script itself:
+# every @IN/@OUT port of a stage belongs to one table (dish_clean,
+# MenuItem_clean_final.csv, ...), so each stage splits into one node per table
+# it touches and the four tables only meet again at Insert_Data.
+
+# port prefix -> table name in ingest/schema
+TABLES = {
+    'dish': 'dish',
+    'menu': 'menu',
+    'menupage': 'menu_page',
+    'menuitem': 'menu_item',
+}
+
+_ANNOTATION = re.compile(r'#\s*@(BEGIN|END|IN|OUT)\s+(\S+)')
+
+
+def parse_annotations(script_pth):
+    # Returns [{'name', 'parent', 'ins', 'outs'}] for every @BEGIN block, in file order.
+    blocks = []
+    stack = []
+    with open(script_pth) as f:
+        for line in f:
+            match = _ANNOTATION.search(line)
+            if not match:
+                continue
+            tag, value = match.groups()
+            if tag == 'BEGIN':
+                block = {'name': value, 'parent': stack[-1]['name'] if stack else None, 'ins': [], 'outs': []}
+                blocks.append(block)
+                stack.append(block)
+            elif tag == 'END':
+                stack.pop()
+            elif stack:
+                stack[-1]['ins' if tag == 'IN' else 'outs'].append(value)
+    return blocks
+
+
+def port_table(port):
+    prefix = port.split('_', 1)[0].lower()
+    return prefix if prefix in TABLES else None
+
+
+def build_table_dag(blocks, stages):
+    # Splits each of `stages` into (stage, table) nodes and links them through
+    # their table's ports. Returns {node: set of predecessor nodes}.
+    producers = {}
+    dag = {}
+    for block in blocks:
+        if block['name'] not in stages:
+            continue
+        for port in block['ins'] + block['outs']:
+            if port_table(port) is None:
+                raise ValueError(f"{block['name']}: port {port} does not belong to a table")
+        tables = {port_table(port) for port in block['ins'] + block['outs']}
+        for table in sorted(tables):
+            node = (block['name'], table)
+            dag[node] = {producers[port] for port in block['ins'] if port_table(port) == table and port in producers}
+        for port in block['outs']:
+            producers[port] = (block['name'], port_table(port))
+    for node, preds in dag.items():
+        if any(pred[1] != node[1] for pred in preds):
+            raise ValueError(f'{node[0]} mixes tables, so the tables are not independent')
+    return dag
+
+
+def table_branches(dag):
+    # {table: [stage, ...]} in dependency order.
+    branches = {}
+    done = set()
+    pending = list(dag)
+    while pending:
+        ready = [node for node in pending if dag[node] <= done]
+        if not ready:
+            raise ValueError('cycle in stage annotations')
+        for node in ready:
+            branches.setdefault(node[1], []).append(node[0])
+            done.add(node)
+            pending.remove(node)
+    return branches
+
+
+# Per-table versions of the workflow3 stages. Each takes the frame of one table
+# and calls the same function the workflow3 stage calls for that table.
+
+def _load_cleaned_csv_file(frame, table, params):
+    return schema.read_clean_table(params['file_pth'], TABLES[table], compact=params['compact_dtypes'])
+
+
+def _data_profiling(frame, table, params):
+    params['profile_stats'] = profiling.profile_table(frame)
+    return frame
+
+
+def _handle_missing_values(frame, table, params):
+    return cleaning.handle_missing_values(frame)
+
+
+def _remove_duplicates(frame, table, params):
+    return cleaning.remove_duplicates(frame)
+
+
+def _standardize_columns(frame, table, params):
+    return cleaning.standardize_columns(frame)
+
+
+def _clean_negative_values(frame, table, params):
+    return cleaning.clean_negative_values(frame, TABLES[table])
+
+
+def _clip_values(frame, table, params):
+    return cleaning.clip_values(frame, TABLES[table], params['clip_lower'], params['clip_upper'])
+
+
+def _save_cleaned_csv(frame, table, params):
+    frame.to_csv(f"{params['file_pth']}/clean_data/{schema.CSV_NAMES[TABLES[table]]}_clean_final.csv", index=False)
+    return frame
+
+
+TABLE_STAGES = {
+    'Load_Cleaned_CSV_Files': _load_cleaned_csv_file,
+    'Data_Profiling': _data_profiling,
+    'Handle_Missing_Values': _handle_missing_values,
+    'Remove_Duplicates': _remove_duplicates,
+    'Standardize_Columns': _standardize_columns,
+    'Clean_Negative_Values': _clean_negative_values,
+    'Clip_Values': _clip_values,
+    'Save_Cleaned_CSVs': _save_cleaned_csv,
+}
+
+
+def run_branch(table, stages, params):
+    params = dict(params)
+    frame = None
+    for stage in stages:
+        frame = TABLE_STAGES[stage](frame, table, params)
+    return frame, params.get('profile_stats')
+
+
+# @BEGIN Parallel_Table_Branches @desc Run the per-table branches of the annotated workflow concurrently.
+# @PARAM script_pth
+# @PARAM workers
+# @PARAM compact_dtypes
+# @OUT final_frames
+def run_table_branches(script_pth, file_pth='.', workers=None, clip_lower=1840, clip_upper=2008, compact_dtypes=False):
+    # Returns ({table: cleaned frame}, {table: profile stats}), keyed like ingest.TABLE_SCHEMAS.
+    dag = build_table_dag(parse_annotations(script_pth), TABLE_STAGES)
+    branches = table_branches(dag)
+    params = {'file_pth': file_pth, 'clip_lower': clip_lower, 'clip_upper': clip_upper, 'compact_dtypes': compact_dtypes}
+    # the biggest table first, so it never waits behind the small ones
+    order = sorted(branches, key=lambda table: table != 'menuitem')
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {table: pool.submit(run_branch, table, branches[table], params) for table in order}
+        results = {table: future.result() for table, future in futures.items()}
+    frames = {TABLES[table]: results[table][0] for table in TABLES if table in results}
+    profiles = {TABLES[table]: results[table][1] for table in TABLES if table in results}
+    return frames, profiles
+# @END Parallel_Table_Branches
@@ -0,0 +1,131 @@
+import argparse
+
+import pandas as pd
+
+import ingest
+
+# Compact pandas dtypes for the cleaned NYPL tables. The columns and their SQL
+# types come from the CREATE TABLE statements in analysis/queries.md (via
+# ingest.TABLE_SCHEMAS); on top of those, low-cardinality text becomes
+# categorical, IDs, counts and years become nullable Int32/Int16 instead of
+# float64-with-NaN, and prices become float32.
+
+# table -> CSV file stem under clean_data/
+CSV_NAMES = {
+    'dish': 'Dish',
+    'menu': 'Menu',
+    'menu_page': 'MenuPage',
+    'menu_item': 'MenuItem',
+}
+
+# SQL type -> pandas dtype for columns without an entry in COMPACT_DTYPES
+_SQL_DTYPES = {
+    'INTEGER': 'Int64',
+    'REAL': 'float64',
+    'TEXT': str,
+}
+
+COMPACT_DTYPES = {
+    'dish': {
+        'id': 'Int32',
+        'menus_appeared': 'Int32',
+        'times_appeared': 'Int32',
+        'first_appeared': 'Int16',
+        'last_appeared': 'Int16',
+        'lowest_price': 'float32',
+        'highest_price': 'float32',
+    },
+    'menu': {
+        'id': 'Int32',
+        'venue': 'category',
+        'language': 'category',
+        'location_type': 'category',
+        'currency': 'category',
+        'currency_symbol': 'category',
+        'status': 'category',
+        'page_count': 'Int16',
+        'dish_count': 'Int32',
+    },
+    'menu_page': {
+        'id': 'Int32',
+        'menu_id': 'Int32',
+        'page_number': 'Int16',
+        # pixel sizes, but declared REAL and not always whole numbers
+        'full_height': 'float32',
+        'full_width': 'float32',
+    },
+    'menu_item': {
+        'id': 'Int32',
+        'menu_page_id': 'Int32',
+        'price': 'float32',
+        'high_price': 'float32',
+        'dish_id': 'Int32',
+    },
+}
+
+
+def table_dtypes(table):
+    # {column: dtype} for every column declared in the table's schema
+    dtypes = {}
+    for name, sqltype in ingest.table_columns(table):
+        dtypes[name] = COMPACT_DTYPES[table].get(name, _SQL_DTYPES[sqltype])
+    return dtypes
+
+
+def read_table(path, table, usecols=None, compact=True):
+    # usecols: a list of columns to read, or 'schema' for just the columns the
+    # database keeps (e.g. drops Dish.description). Columns not in the schema
+    # keep pandas' inferred dtype.
+    if usecols == 'schema':
+        usecols = lambda column: column in dict(ingest.table_columns(table))
+    if not compact:
+        return pd.read_csv(path, usecols=usecols)
+    return pd.read_csv(path, usecols=usecols, dtype=table_dtypes(table))
+
+
+def read_clean_table(file_pth, table, suffix='clean', usecols=None, compact=True):
+    return read_table(f"{file_pth}/clean_data/{CSV_NAMES[table]}_{suffix}.csv", table, usecols, compact)
+
+
+# @BEGIN Memory_Report @desc Compare the in-memory size of each cleaned table under the default and the compact dtypes.
+# @IN Dish_clean.csv
+# @IN Menu_clean.csv
+# @IN MenuPage_clean.csv
+# @IN MenuItem_clean.csv
+# @OUT memory_report
+def memory_report(file_pth='.', suffix='clean', usecols=None):
+    rows = []
+    for table in CSV_NAMES:
+        default = read_clean_table(file_pth, table, suffix, compact=False).memory_usage(deep=True).sum()
+        compact = read_clean_table(file_pth, table, suffix, usecols).memory_usage(deep=True).sum()
+        rows.append({
+            'table': table,
+            'default_bytes': default,
+            'compact_bytes': compact,
+            'saved_pct': 100 * (1 - compact / default) if default else 0.0,
+        })
+    report = pd.DataFrame(rows)
+    total = report[['default_bytes', 'compact_bytes']].sum()
+    report.loc[len(report)] = {
+        'table': 'total',
+        'default_bytes': total['default_bytes'],
+        'compact_bytes': total['compact_bytes'],
+        'saved_pct': 100 * (1 - total['compact_bytes'] / total['default_bytes']) if total['default_bytes'] else 0.0,
+    }
+    return report
+# @END Memory_Report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Memory used by the cleaned tables with default vs compact dtypes.')
+    parser.add_argument('--file-pth', default='.')
+    parser.add_argument('--suffix', default='clean', help='read clean_data/<Table>_<suffix>.csv')
+    parser.add_argument('--schema-columns', action='store_true',
+                        help='only read the columns kept in the database')
+    args = parser.parse_args()
+    report = memory_report(args.file_pth, args.suffix, 'schema' if args.schema_columns else None)
+    print(report.to_string(index=False, formatters={
+        'default_bytes': '{:,.0f}'.format,
+        'compact_bytes': '{:,.0f}'.format,
+        'saved_pct': '{:.1f}%'.format,
+    }))
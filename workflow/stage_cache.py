@@ -0,0 +1,219 @@
+import functools
+import hashlib
+import os
+import pickle
+import types
+import weakref
+
+import numpy as np
+import pandas as pd
+
+# Content-addressed cache of stage outputs. A stage's key hashes its name, its
+# code, its parameters and a fingerprint of every input (file contents for
+# input files, row hashes for DataFrames), so a stage is only recomputed when
+# something it depends on changed. Entries are evicted least-recently-used
+# first once the cache directory grows past max_bytes.
+#
+# Entries are pickles, and unpickling can run arbitrary code: anyone who can
+# write to the cache directory can run code in the workflow. The directory is
+# created private to the user (mode 0700); never point it at a shared or
+# downloaded directory.
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+_SIMPLE_TYPES = (str, int, float, bool, type(None))
+
+
+def file_fingerprint(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def frame_fingerprint(frame):
+    digest = hashlib.sha256()
+    digest.update(repr(list(frame.columns)).encode())
+    digest.update(repr([str(dtype) for dtype in frame.dtypes]).encode())
+    try:
+        digest.update(pd.util.hash_pandas_object(frame, index=True).to_numpy().tobytes())
+    except TypeError:
+        # unhashable cells (e.g. describe() output mixing types): fall back to the pickle
+        digest.update(pickle.dumps(frame, protocol=pickle.HIGHEST_PROTOCOL))
+    return digest.hexdigest()
+
+
+def _code_fingerprint(code, digest):
+    digest.update(code.co_code)
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            # nested functions/lambdas: their repr contains a memory address
+            _code_fingerprint(const, digest)
+        else:
+            digest.update(repr(const).encode())
+    digest.update(repr(code.co_names).encode())
+
+
+def _code_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            names |= _code_names(const)
+    return names
+
+
+def function_fingerprint(func):
+    digest = hashlib.sha256()
+    _code_fingerprint(func.__code__, digest)
+    # the modules next to the stage's script that it calls into (cleaning.py,
+    # schema.py, ...), by the contents of their files
+    directory = os.path.dirname(os.path.abspath(func.__code__.co_filename))
+    for name in sorted(_code_names(func.__code__)):
+        value = func.__globals__.get(name)
+        path = getattr(value, '__file__', None)
+        if isinstance(value, types.ModuleType) and path and os.path.dirname(os.path.abspath(path)) == directory:
+            digest.update(file_fingerprint(path).encode())
+    for cell in func.__closure__ or ():
+        try:
+            value = cell.cell_contents
+        except ValueError:
+            continue
+        if isinstance(value, _SIMPLE_TYPES):
+            digest.update(repr(value).encode())
+    return digest.hexdigest()
+
+
+class StageCache:
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        # id(obj) -> (weak reference to obj, fingerprint) for every value a stage
+        # produced or loaded, so downstream keys don't have to re-hash those
+        # frames. The memo keeps nothing alive, and an entry is dropped when
+        # its value is collected, before the id can be reused.
+        self._known = {}
+        self.hits = []
+        self.misses = []
+
+    def fingerprint(self, value):
+        known = self._known.get(id(value))
+        if known is not None and known[0]() is value:
+            return known[1]
+        if isinstance(value, pd.DataFrame):
+            fingerprint = frame_fingerprint(value)
+        elif isinstance(value, pd.Series):
+            fingerprint = frame_fingerprint(value.to_frame())
+        elif isinstance(value, np.ndarray):
+            fingerprint = hashlib.sha256(value.tobytes() + repr(value.dtype).encode()).hexdigest()
+        elif isinstance(value, (tuple, list)):
+            fingerprint = hashlib.sha256(repr([self.fingerprint(v) for v in value]).encode()).hexdigest()
+        elif isinstance(value, dict):
+            fingerprint = hashlib.sha256(repr(sorted((k, self.fingerprint(v)) for k, v in value.items())).encode()).hexdigest()
+        elif isinstance(value, _SIMPLE_TYPES):
+            return repr(value)
+        else:
+            fingerprint = hashlib.sha256(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+        self._remember(value, fingerprint)
+        return fingerprint
+
+    def _remember(self, value, fingerprint):
+        try:
+            ref = weakref.ref(value, functools.partial(self._drop, id(value)))
+        except TypeError:
+            # str, tuple, dict, ...: cheap to fingerprint again, or made of values that are remembered
+            return
+        self._known[id(value)] = (ref, fingerprint)
+
+    def _drop(self, key, ref):
+        known = self._known.get(key)
+        if known is not None and known[0] is ref:
+            del self._known[key]
+
+    def key(self, name, func, args, kwargs, files=()):
+        digest = hashlib.sha256()
+        digest.update(name.encode())
+        digest.update(function_fingerprint(func).encode())
+        for arg in args:
+            digest.update(self.fingerprint(arg).encode())
+        for k in sorted(kwargs):
+            digest.update(k.encode())
+            digest.update(self.fingerprint(kwargs[k]).encode())
+        for path in files:
+            digest.update(file_fingerprint(path).encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def load(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return False, None
+        with open(path, 'rb') as f:
+            entry = pickle.load(f)
+        os.utime(path)  # mark as recently used
+        self._remember_result(entry['result'], entry['fingerprints'])
+        return True, entry['result']
+
+    def store(self, key, result):
+        fingerprints = self._result_fingerprints(result)
+        path = self._path(key)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump({'fingerprints': fingerprints, 'result': result}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        self.evict(keep=key)
+
+    def forget(self, value):
+        # for values a stage may have modified in place
+        known = self._known.get(id(value))
+        if known is not None and known[0]() is value:
+            del self._known[id(value)]
+
+    def _result_fingerprints(self, result):
+        if isinstance(result, tuple):
+            for value in result:
+                self.forget(value)
+            return [self.fingerprint(value) for value in result]
+        self.forget(result)
+        return self.fingerprint(result)
+
+    def _remember_result(self, result, fingerprints):
+        if isinstance(result, tuple):
+            for value, fingerprint in zip(result, fingerprints):
+                self._remember(value, fingerprint)
+        else:
+            self._remember(result, fingerprints)
+
+    def evict(self, keep=None):
+        # Least recently used entries first, but never keep: the entry just
+        # stored, which may share its mtime with older ones or alone exceed
+        # max_bytes; it goes once a later entry needs the room.
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.pkl'):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == f'{keep}.pkl':
+                continue
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+
+    def run(self, name, func, *args, files=(), **kwargs):
+        key = self.key(name, func, args, kwargs, files)
+        hit, result = self.load(key)
+        if hit:
+            self.hits.append(name)
+            return result
+        self.misses.append(name)
+        result = func(*args, **kwargs)
+        for arg in list(args) + list(kwargs.values()):
+            self.forget(arg)
+        self.store(key, result)
+        return result
@@ -0,0 +1,111 @@
+import os
+
+import pandas as pd
+
+# Runs the @BEGIN/@END stages of a workflow script in order and hands each
+# stage's DataFrame straight to the next one. Writing the intermediate tables is
+# optional: with a checkpoint directory every stage output is saved as an Arrow
+# IPC (Feather v2) or Parquet file, and a later run can resume from any stage by
+# memory-mapping the checkpoint of the stage before it.
+#
+# Hooks observe every stage that actually runs: hook.before_stage(name, args,
+# kwargs) is called right before it and hook.after_stage(name, result) right
+# after, e.g. to time stages for a benchmark; a stage that raises calls
+# hook.stage_failed(name, error) instead, before the error propagates.
+
+CHECKPOINT_FORMATS = {
+    'arrow': '.arrow',
+    'parquet': '.parquet',
+}
+
+
+def _pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise ImportError('checkpoints need pyarrow: pip install pyarrow') from e
+
+
+def write_checkpoint(frame, path, fmt='arrow'):
+    _pyarrow()
+    if fmt == 'arrow':
+        from pyarrow import feather
+        # uncompressed so the file can be memory-mapped without decoding
+        feather.write_feather(frame.reset_index(drop=True), path, compression='uncompressed')
+    elif fmt == 'parquet':
+        frame.to_parquet(path, index=False)
+    else:
+        raise ValueError(f'unknown checkpoint format: {fmt}')
+
+
+def read_checkpoint(path, fmt='arrow'):
+    _pyarrow()
+    if fmt == 'arrow':
+        from pyarrow import feather
+        table = feather.read_table(path, memory_map=True)
+    elif fmt == 'parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(path, memory_map=True)
+    else:
+        raise ValueError(f'unknown checkpoint format: {fmt}')
+    # one block per column, and each Arrow column released as soon as it is
+    # converted: numeric columns without nulls stay views of the mapped file,
+    # the others are copied one at a time instead of all at once
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+class StageRunner:
+    def __init__(self, stages, checkpoint_dir=None, checkpoint_format='arrow', resume_from=None, cache=None, hooks=()):
+        # stages: the stage names in execution order, as in the @BEGIN annotations.
+        # cache: an optional stage_cache.StageCache; cached stages whose inputs,
+        # parameters and code are unchanged are loaded instead of recomputed.
+        if checkpoint_format not in CHECKPOINT_FORMATS:
+            raise ValueError(f'unknown checkpoint format: {checkpoint_format}')
+        if resume_from is not None:
+            if resume_from not in stages:
+                raise ValueError(f'unknown stage: {resume_from}')
+            if checkpoint_dir is None:
+                raise ValueError('resuming needs a checkpoint directory')
+        self.stages = list(stages)
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_format = checkpoint_format
+        self.resume_from = resume_from
+        self.cache = cache
+        self.hooks = list(hooks)
+        if checkpoint_dir is not None:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def checkpoint_path(self, name):
+        return os.path.join(self.checkpoint_dir, name + CHECKPOINT_FORMATS[self.checkpoint_format])
+
+    def _skipped(self, name):
+        if self.resume_from is None:
+            return False
+        return self.stages.index(name) < self.stages.index(self.resume_from)
+
+    def run(self, name, func, *args, files=(), cacheable=True, **kwargs):
+        # files: input files the stage reads itself, hashed by content for the cache key.
+        # cacheable=False for stages whose point is a side effect (writing a
+        # database or report), which must run every time.
+        if self._skipped(name):
+            # Only the stage right before the resume point has to produce its
+            # output; anything earlier is never looked at again.
+            if self.stages.index(name) == self.stages.index(self.resume_from) - 1:
+                return read_checkpoint(self.checkpoint_path(name), self.checkpoint_format)
+            return None
+        for hook in self.hooks:
+            hook.before_stage(name, args, kwargs)
+        try:
+            if self.cache is not None and cacheable:
+                result = self.cache.run(name, func, *args, files=files, **kwargs)
+            else:
+                result = func(*args, **kwargs)
+        except BaseException as error:
+            for hook in reversed(self.hooks):
+                hook.stage_failed(name, error)
+            raise
+        for hook in reversed(self.hooks):
+            hook.after_stage(name, result)
+        if self.checkpoint_dir is not None and isinstance(result, pd.DataFrame):
+            write_checkpoint(result, self.checkpoint_path(name), self.checkpoint_format)
+        return result
@@ -0,0 +1,226 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import cleaning
+import schema
+from profiling import TableProfile, profile_chunks
+
+# Chunked counterpart of the Handle_Missing_Values .. Clip_Values stages in
+# workflow3.py. Every stage is a generator that applies the cleaning.py function
+# of the stage to one DataFrame chunk at a time, so peak memory is bounded by the
+# chunk size (plus 16 bytes per distinct row for de-duplication) instead of by
+# the size of the input table.
+
+TABLES = ['Dish', 'Menu', 'MenuPage', 'MenuItem']
+
+DEFAULT_CHUNKSIZE = 100000
+
+# CSV file stem -> table name in cleaning.py
+_TABLE_NAMES = {csv_name: table for table, csv_name in schema.CSV_NAMES.items()}
+
+
+# Reconcile the per-chunk dtypes into the dtype a full read_csv would infer.
+# This is a full parse of the file, so streaming reads every table twice; in
+# exchange every chunk is then read with the same dtypes.
+def infer_dtypes(path, chunksize=DEFAULT_CHUNKSIZE):
+    dtypes = {}
+    missing = set()
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        for column, dtype in chunk.dtypes.items():
+            if chunk[column].isna().all():
+                # an all-missing chunk is read as float64 whatever the column holds
+                missing.add(column)
+            else:
+                dtypes[column] = _promote(dtypes.get(column), dtype)
+    for column in missing:
+        dtype = dtypes.get(column)
+        if dtype is None or pd.api.types.is_integer_dtype(dtype):
+            dtypes[column] = np.dtype(np.float64)
+        elif pd.api.types.is_bool_dtype(dtype):
+            dtypes[column] = np.dtype(object)
+    return dtypes
+
+
+def _promote(current, dtype):
+    if current is None:
+        return dtype
+    if current == dtype:
+        return current
+    if pd.api.types.is_numeric_dtype(current) and pd.api.types.is_numeric_dtype(dtype) \
+            and not pd.api.types.is_bool_dtype(current) and not pd.api.types.is_bool_dtype(dtype):
+        return np.result_type(current, dtype)
+    return np.dtype(object)
+
+
+def read_chunks(path, chunksize=DEFAULT_CHUNKSIZE):
+    # Every column is forced to its dtype over the whole file, so that e.g. an
+    # int column with a NaN in a later chunk is float in every chunk, and a text
+    # column stays text in a chunk where it happens to be all missing.
+    dtypes = infer_dtypes(path, chunksize)
+    for chunk in pd.read_csv(path, chunksize=chunksize, dtype=dtypes):
+        yield chunk
+
+
+# @BEGIN Handle_Missing_Values @desc Forward-fill missing values, carrying the last valid row across chunk boundaries.
+def handle_missing_values(chunks):
+    carry = None
+    for chunk in chunks:
+        chunk = cleaning.handle_missing_values(chunk)
+        if carry is not None:
+            # after ffill only the leading NaNs of each column are left; those
+            # take the last valid value seen in the previous chunks.
+            chunk = chunk.fillna(carry)
+        if len(chunk):
+            carry = chunk.iloc[-1]
+        yield chunk
+# @END Handle_Missing_Values
+
+
+class RowHashSet:
+    # The distinct rows seen so far. Their 64-bit hashes are kept in memory, with
+    # the number of the row each belongs to, as sorted runs that are merged when
+    # a run grows as large as the one before it (so every row is merged
+    # O(log n) times); the rows themselves are spilled to spill_dir, one pickle
+    # per chunk. A row whose hash is already in the set is only dropped once it
+    # compares equal to the stored row, so a hash collision keeps both rows.
+    def __init__(self, spill_dir):
+        self.spill_dir = spill_dir
+        self._runs = []
+        self._starts = []
+        self._rows = 0
+
+    def __len__(self):
+        return self._rows
+
+    def _candidates(self, hashes):
+        # (position in hashes, stored row number) for every stored row with an equal hash
+        positions = []
+        rows = []
+        for run_hashes, run_rows in self._runs:
+            left = np.searchsorted(run_hashes, hashes, 'left')
+            counts = np.searchsorted(run_hashes, hashes, 'right') - left
+            if not counts.any():
+                continue
+            position = np.repeat(np.arange(len(hashes)), counts)
+            offset = np.arange(len(position)) - np.repeat(np.cumsum(counts) - counts, counts)
+            positions.append(position)
+            rows.append(run_rows[left[position] + offset])
+        if not positions:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(positions), np.concatenate(rows)
+
+    def _spill_path(self, index):
+        return os.path.join(self.spill_dir, f'{index}.pkl')
+
+    def _stored_rows(self, rows):
+        # the stored rows with these numbers, in the same order
+        spilled = np.searchsorted(self._starts, rows, 'right') - 1
+        parts = []
+        order = []
+        for index in np.unique(spilled):
+            mask = spilled == index
+            chunk = pd.read_pickle(self._spill_path(index))
+            parts.append(chunk.iloc[rows[mask] - self._starts[index]])
+            order.append(np.flatnonzero(mask))
+        stored = pd.concat(parts, ignore_index=True)
+        return stored.iloc[np.argsort(np.concatenate(order), kind='stable')].reset_index(drop=True)
+
+    def add_new(self, chunk):
+        # Returns the rows of chunk that are not in the set (the first of equal
+        # rows within chunk wins) and records them.
+        chunk = cleaning.remove_duplicates(chunk)
+        hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+        positions, rows = self._candidates(hashes)
+        if len(positions):
+            candidate = chunk.iloc[positions].reset_index(drop=True)
+            stored = self._stored_rows(rows)
+            # NaN equals NaN here, as in drop_duplicates
+            equal = ((candidate == stored) | (candidate.isna() & stored.isna())).all(axis=1).to_numpy()
+            seen = np.zeros(len(chunk), dtype=bool)
+            seen[positions[equal]] = True
+            chunk = chunk[~seen]
+            hashes = hashes[~seen]
+        if len(chunk):
+            self._add(chunk, hashes)
+        return chunk
+
+    def _add(self, chunk, hashes):
+        chunk.to_pickle(self._spill_path(len(self._starts)))
+        self._starts.append(self._rows)
+        order = np.argsort(hashes, kind='stable')
+        self._runs.append((hashes[order], self._rows + order.astype(np.int64)))
+        self._rows += len(chunk)
+        while len(self._runs) > 1 and len(self._runs[-1][0]) >= len(self._runs[-2][0]):
+            (hashes_a, rows_a), (hashes_b, rows_b) = self._runs[-2:]
+            merged_hashes = np.concatenate([hashes_a, hashes_b])
+            order = np.argsort(merged_hashes, kind='stable')
+            self._runs[-2:] = [(merged_hashes[order], np.concatenate([rows_a, rows_b])[order])]
+
+
+# @BEGIN Remove_Duplicates @desc Drop duplicate rows using a bounded-memory set of row hashes.
+def remove_duplicates(chunks):
+    with tempfile.TemporaryDirectory(prefix='remove_duplicates_') as spill_dir:
+        seen = RowHashSet(spill_dir)
+        for chunk in chunks:
+            yield seen.add_new(chunk)
+# @END Remove_Duplicates
+
+
+# @BEGIN Standardize_Columns @desc Standardize column names.
+def standardize_columns(chunks):
+    for chunk in chunks:
+        yield cleaning.standardize_columns(chunk)
+# @END Standardize_Columns
+
+
+# @BEGIN Clean_Negative_Values @desc Replace negative values in a numerical column with 0.
+def clean_negative_values(chunks, table):
+    for chunk in chunks:
+        yield cleaning.clean_negative_values(chunk, table)
+# @END Clean_Negative_Values
+
+
+# @BEGIN Clip_Values @desc Clip values in specific columns to a specified range.
+def clip_values(chunks, table, lower=1840, upper=2008):
+    for chunk in chunks:
+        yield cleaning.clip_values(chunk, table, lower, upper)
+# @END Clip_Values
+
+
+def write_chunks(chunks, path):
+    rows = 0
+    header = True
+    with open(path, 'w', newline='') as f:
+        for chunk in chunks:
+            chunk.to_csv(f, index=False, header=header)
+            header = False
+            rows += len(chunk)
+    return rows
+
+
+def clean_table(table, chunks, clip_lower=1840, clip_upper=2008):
+    # table: the CSV file stem, e.g. 'MenuItem'
+    table = _TABLE_NAMES[table]
+    chunks = handle_missing_values(chunks)
+    chunks = remove_duplicates(chunks)
+    chunks = standardize_columns(chunks)
+    if table in cleaning.NEGATIVE_COLUMNS:
+        chunks = clean_negative_values(chunks, table)
+    if table in cleaning.CLIP_COLUMNS:
+        chunks = clip_values(chunks, table, clip_lower, clip_upper)
+    return chunks
+
+
+def stream_clean_tables(file_pth='.', chunksize=DEFAULT_CHUNKSIZE, clip_lower=1840, clip_upper=2008):
+    # Returns ({table: rows written}, {table: profiling.TableProfile of the input}),
+    # the profile being built from the same chunks as they are read.
+    rows = {}
+    profiles = {}
+    for table in TABLES:
+        profiles[table] = TableProfile()
+        chunks = profile_chunks(read_chunks(f"{file_pth}/clean_data/{table}_clean.csv", chunksize), profiles[table])
+        rows[table] = write_chunks(clean_table(table, chunks, clip_lower, clip_upper), f"{file_pth}/clean_data/{table}_clean_final.csv")
+    return rows, profiles
@@ -0,0 +1,247 @@
+import argparse
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+# Synthetic Dish / Menu / MenuPage / MenuItem tables shaped like the NYPL
+# "What's on the menu?" export, for benchmarking the workflows at sizes the
+# checked-in sample (data/Menu_*.csv, ~17.5k rows) can't reach. Scale 1 is
+# about the size of the full export; the tables are generated and written in
+# blocks, so larger scales don't need the whole table in memory.
+#
+# Besides realistic distributions (Zipf-distributed dish popularity, menus
+# clustered around 1900, a few pages per menu and ~20 items per page, mostly
+# missing prices) the data carries the problems the cleaning stages target:
+# negative times_appeared and price, first/last_appeared outside 1840-2008,
+# whitespace and case noise in text, exact duplicate rows and menu dates like
+# 0190-... or 1091-....
+
+# Rows per table at scale 1, from the NYPL export.
+BASE_ROWS = {
+    'Dish': 423397,
+    'Menu': 17545,
+}
+PAGES_PER_MENU = 3.8
+ITEMS_PER_PAGE = 19.9
+
+BLOCK_MENUS = 20000
+
+# Share of rows carrying each dirty pattern.
+DIRTY_RATES = {
+    'duplicate': 0.005,
+    'negative': 0.003,
+    'out_of_range_year': 0.02,
+    'whitespace': 0.02,
+    'upper_case': 0.01,
+    'bad_date': 0.01,
+    'missing_dish_id': 0.0005,
+}
+
+_FOODS = ['consomme', 'soup', 'tea', 'coffee', 'roast beef', 'oysters', 'ice cream', 'celery', 'olives', 'radishes',
+          'lobster', 'chicken', 'lamb chops', 'potatoes', 'asparagus', 'apple pie', 'cheese', 'salmon', 'ham', 'eggs']
+_STYLES = ['', 'fried', 'boiled', 'broiled', 'stewed', 'cold', 'hot', 'fresh', 'roast', 'french', 'new york', 'baked']
+_SPONSORS = ['HOTEL EASTMAN', 'WALDORF ASTORIA', 'REPUBLICAN HOUSE', 'DELMONICO\'S', 'NORDDEUTSCHER LLOYD BREMEN']
+_EVENTS = ['BREAKFAST', 'LUNCH', 'DINNER', 'SUPPER', '[DINNER]', 'DAILY MENU']
+_VENUES = ['COMMERCIAL', 'SOC', 'PROF', 'GOV', 'MIL', 'EDUC']
+_PLACES = ['NEW YORK, NY', 'HOT SPRINGS, AR', 'MILWAUKEE, [WI];', 'ON BOARD', 'CHICAGO, IL']
+_STATUS = ['complete', 'under review']
+_CURRENCIES = [('Dollars', '$'), ('Francs', 'FF'), ('Marks', 'DM'), ('UK Pounds', '£')]
+
+
+def _noisy_text(values, rng):
+    # Leading/trailing/double spaces and upper-casing, as in the raw export.
+    values = values.copy()
+    n = len(values)
+    spaced = rng.random(n) < DIRTY_RATES['whitespace']
+    pads = rng.choice([' {} ', '{}  ', '  {}'], spaced.sum())
+    values[spaced] = [pad.format(value) for pad, value in zip(pads, values[spaced])]
+    upper = rng.random(n) < DIRTY_RATES['upper_case']
+    values[upper] = np.char.upper(values[upper].astype(str)).astype(object)
+    return values
+
+
+def _with_duplicates(frame, rng):
+    # Each copy goes right after its original, like a row exported twice; a
+    # shuffled copy would be forward-filled from a different neighbour by
+    # Handle_Missing_Values and no longer be a duplicate.
+    dups = frame[rng.random(len(frame)) < DIRTY_RATES['duplicate']]
+    if dups.empty:
+        return frame
+    return pd.concat([frame, dups]).sort_index(kind='stable').reset_index(drop=True)
+
+
+def _years(n, rng):
+    # Most menus in the collection are from 1890-1920.
+    years = np.where(rng.random(n) < 0.7, rng.normal(1905, 8, n), rng.uniform(1851, 2008, n))
+    return np.clip(years, 1851, 2008).astype(int)
+
+
+def dish_block(start, n, rng):
+    ids = np.arange(start, start + n)
+    names = (pd.Series(rng.choice(_STYLES, n)) + ' ' + pd.Series(rng.choice(_FOODS, n))).str.strip()
+    # keep names unique-ish the way the real dish list is
+    names = (names + np.where(ids % 7 == 0, '', ' ' + (ids % 997).astype(str))).to_numpy(dtype=object)
+    menus = rng.geometric(0.15, n)
+    times = menus + rng.poisson(1, n)
+    times[rng.random(n) < DIRTY_RATES['negative']] = -1
+    first = _years(n, rng)
+    last = np.minimum(first + rng.geometric(0.05, n), 2008)
+    bad = rng.random(n) < DIRTY_RATES['out_of_range_year']
+    first[bad] = rng.choice([0, 1, 2928], bad.sum())
+    bad = rng.random(n) < DIRTY_RATES['out_of_range_year']
+    last[bad] = rng.choice([0, 2928], bad.sum())
+    low = np.round(rng.lognormal(-1, 1, n), 2)
+    has_price = rng.random(n) < 0.7
+    return pd.DataFrame({
+        'id': ids,
+        'name': _noisy_text(names, rng),
+        'description': np.nan,
+        'menus_appeared': menus,
+        'times_appeared': times,
+        'first_appeared': first,
+        'last_appeared': last,
+        'lowest_price': np.where(has_price, low, np.nan),
+        'highest_price': np.where(has_price, np.round(low * rng.uniform(1, 3, n), 2), np.nan),
+    })
+
+
+def menu_block(start, n, rng):
+    ids = np.arange(start, start + n)
+    years = _years(n, rng)
+    dates = pd.Series(years.astype(str)) + '-' + pd.Series(rng.integers(1, 13, n)).astype(str).str.zfill(2) + '-' + \
+        pd.Series(rng.integers(1, 29, n)).astype(str).str.zfill(2)
+    bad = rng.random(n) < DIRTY_RATES['bad_date']
+    dates[bad] = np.where(rng.random(bad.sum()) < 0.5, '0' + dates[bad].str[1:], '10' + dates[bad].str[2:])
+    dates[rng.random(n) < 0.05] = np.nan
+    currency = rng.integers(0, len(_CURRENCIES) + 1, n)  # last one: no currency
+    sponsors = rng.choice(_SPONSORS, n).astype(object)
+    return pd.DataFrame({
+        'id': ids,
+        'name': np.where(rng.random(n) < 0.8, None, 'MENU'),
+        'sponsor': _noisy_text(sponsors, rng),
+        'event': rng.choice(_EVENTS, n),
+        'venue': rng.choice(_VENUES, n),
+        'place': rng.choice(_PLACES, n),
+        'physical_description': 'CARD; ' + pd.Series(rng.uniform(4, 12, n).round(1)).astype(str) + 'X9.0;',
+        'occasion': np.where(rng.random(n) < 0.8, None, 'EASTER;'),
+        'notes': None,
+        'call_number': pd.Series(years).astype(str) + '-' + pd.Series(ids).astype(str),
+        'keywords': None,
+        'language': np.where(rng.random(n) < 0.9, None, 'English'),
+        'date': dates,
+        'location': pd.Series(sponsors).str.title(),
+        'location_type': None,
+        'currency': [(_CURRENCIES + [(None, None)])[c][0] for c in currency],
+        'currency_symbol': [(_CURRENCIES + [(None, None)])[c][1] for c in currency],
+        'status': rng.choice(_STATUS, n, p=[0.95, 0.05]),
+        'page_count': np.zeros(n, dtype=int),
+        'dish_count': np.zeros(n, dtype=int),
+    })
+
+
+def menu_page_block(start, menu_ids, rng):
+    pages_per_menu = rng.geometric(1 / PAGES_PER_MENU, len(menu_ids))
+    menu_id = np.repeat(menu_ids, pages_per_menu)
+    n = len(menu_id)
+    ids = np.arange(start, start + n)
+    # page numbers restart at 1 for every menu
+    page_number = np.arange(n) - np.repeat(np.cumsum(pages_per_menu) - pages_per_menu, pages_per_menu) + 1
+    return pd.DataFrame({
+        'id': ids,
+        'menu_id': menu_id,
+        'page_number': page_number,
+        'image_id': rng.integers(1, 5 * 10 ** 6, n),
+        'full_height': rng.integers(600, 7000, n),
+        'full_width': rng.integers(600, 5000, n),
+        'uuid': [f'{i:08x}-0000-4000-8000-{i * 2654435761 % 16 ** 12:012x}' for i in ids],
+    }), pages_per_menu
+
+
+def menu_item_block(start, page_ids, n_dishes, rng):
+    items_per_page = rng.poisson(ITEMS_PER_PAGE, len(page_ids))
+    menu_page_id = np.repeat(page_ids, items_per_page)
+    n = len(menu_page_id)
+    price = np.round(rng.lognormal(-0.5, 1, n), 2)
+    price[rng.random(n) < 0.65] = np.nan
+    price[rng.random(n) < DIRTY_RATES['negative']] *= -1
+    dish_id = (rng.zipf(1.3, n) - 1) % n_dishes + 1
+    dish_id = np.where(rng.random(n) < DIRTY_RATES['missing_dish_id'], np.nan, dish_id)
+    created = pd.Timestamp('2011-03-28') + pd.to_timedelta(rng.integers(0, 5 * 365 * 86400, n), unit='s')
+    updated = created + pd.to_timedelta(rng.integers(0, 90 * 86400, n), unit='s')
+    return pd.DataFrame({
+        'id': np.arange(start, start + n),
+        'menu_page_id': menu_page_id,
+        'price': price,
+        'high_price': np.where(rng.random(n) < 0.05, np.round(price * 1.5, 2), np.nan),
+        'dish_id': pd.array(dish_id, dtype='Int64'),
+        'created_at': created.strftime('%Y-%m-%d %H:%M:%S UTC'),
+        'updated_at': updated.strftime('%Y-%m-%d %H:%M:%S UTC'),
+        'xpos': rng.random(n).round(6),
+        'ypos': rng.random(n).round(6),
+    }), items_per_page
+
+
+def _append(frame, path, first):
+    frame.to_csv(path, mode='w' if first else 'a', header=first, index=False)
+
+
+# @BEGIN Generate_Synthetic_Tables @desc Write NYPL-shaped Dish, Menu, MenuPage and MenuItem tables with dirty patterns.
+# @PARAM scale
+# @PARAM seed
+# @OUT Dish_dirty.csv
+# @OUT Menu_dirty.csv
+# @OUT MenuPage_dirty.csv
+# @OUT MenuItem_dirty.csv
+def generate(out_pth, scale=1.0, seed=0):
+    # Writes <out_pth>/<Table>_dirty.csv (the input of workflow1) and links them
+    # as <out_pth>/clean_data/<Table>_clean.csv (the input of workflow3).
+    # Returns {table: rows written}.
+    rng = np.random.default_rng(seed)
+    os.makedirs(f'{out_pth}/clean_data', exist_ok=True)
+    paths = {table: f'{out_pth}/{table}_dirty.csv' for table in ['Dish', 'Menu', 'MenuPage', 'MenuItem']}
+    rows = dict.fromkeys(paths, 0)
+
+    n_dishes = max(1, int(BASE_ROWS['Dish'] * scale))
+    for start in range(0, n_dishes, BLOCK_MENUS * 10):
+        block = _with_duplicates(dish_block(start + 1, min(BLOCK_MENUS * 10, n_dishes - start), rng), rng)
+        _append(block, paths['Dish'], start == 0)
+        rows['Dish'] += len(block)
+
+    n_menus = max(1, int(BASE_ROWS['Menu'] * scale))
+    page_start = item_start = 1
+    for start in range(0, n_menus, BLOCK_MENUS):
+        menus = menu_block(start + 1, min(BLOCK_MENUS, n_menus - start), rng)
+        pages, pages_per_menu = menu_page_block(page_start, menus['id'].to_numpy(), rng)
+        items, items_per_page = menu_item_block(item_start, pages['id'].to_numpy(), n_dishes, rng)
+        menus['page_count'] = pages_per_menu
+        menus['dish_count'] = np.add.reduceat(items_per_page, np.cumsum(pages_per_menu) - pages_per_menu)
+        page_start += len(pages)
+        item_start += len(items)
+        for table, block in [('Menu', menus), ('MenuPage', pages), ('MenuItem', items)]:
+            block = _with_duplicates(block, rng)
+            _append(block, paths[table], start == 0)
+            rows[table] += len(block)
+
+    for table, path in paths.items():
+        link = f'{out_pth}/clean_data/{table}_clean.csv'
+        if os.path.exists(link):
+            os.remove(link)
+        try:
+            os.link(path, link)
+        except OSError:
+            # no hard links on this filesystem
+            shutil.copyfile(path, link)
+    return rows
+# @END Generate_Synthetic_Tables
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic NYPL menu tables for benchmarking.')
+    parser.add_argument('out_pth')
+    parser.add_argument('--scale', type=float, default=1.0, help='1 is about the size of the full NYPL export')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    for table, n in generate(args.out_pth, args.scale, args.seed).items():
+        print(f'{table}: {n:,} rows')
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+# the workflow scripts import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synthetic_data  # noqa: E402
+
+
+@pytest.fixture
+def synthetic_pth(tmp_path):
+    # A few hundred NYPL-shaped rows per table under clean_data/, with the
+    # duplicates, negative values and out-of-range years the cleaning targets.
+    synthetic_data.generate(str(tmp_path), scale=0.002, seed=0)
+    return str(tmp_path)
+
+
+@pytest.fixture
+def typed_frames(synthetic_pth):
+    # the synthetic tables cleaned in memory, with the typed date columns the loads expect
+    import dates
+    import workflow3
+    from stage_runner import StageRunner
+    frames = workflow3.clean_tables(StageRunner([]), synthetic_pth)
+    return dates.normalize_dates(frames)[0]
@@ -0,0 +1,34 @@
+import benchmark
+
+
+def _results(**seconds):
+    # {(benchmark, stage): [seconds of each repeat]} -> a results dict
+    runs = {}
+    for key, repeats in seconds.items():
+        name, stage = key.split('__')
+        for i, value in enumerate(repeats):
+            runs.setdefault((name, i), []).append({'stage': stage, 'seconds': value})
+    return {'runs': [{'benchmark': name, 'stages': stages} for (name, _), stages in runs.items()]}
+
+
+def test_compare_flags_stages_slower_than_the_threshold():
+    baseline = _results(workflow3__Insert_Data=[1.0, 0.8], workflow3__Clip_Values=[0.01], workflow3__Query_Top_Dishes=[0.5])
+    results = _results(workflow3__Insert_Data=[1.5, 0.9], workflow3__Clip_Values=[0.04], workflow3__New_Stage=[9.0],
+                       workflow3__Query_Top_Dishes=[0.7])
+    # best of the repeats: Insert_Data 0.8 -> 0.9 is within 1.2x; Clip_Values is
+    # too short to judge and New_Stage has nothing to compare with
+    assert benchmark.compare(results, baseline) == [('workflow3', 'Query_Top_Dishes', 0.5, 0.7)]
+    assert benchmark.compare(results, baseline, threshold=1.5) == []
+
+
+def test_every_workflow_runs_on_synthetic_data(tmp_path, monkeypatch):
+    # the workflows write their databases into the working directory
+    monkeypatch.chdir(tmp_path)
+    results = benchmark.run_benchmarks(['workflow1', 'workflow3'], scale=0.002)
+    assert set(results['rows']) == {'Dish', 'Menu', 'MenuPage', 'MenuItem'}
+    for run in results['runs']:
+        assert run['error'] is None, run['error']
+        assert run['peak_rss_kb'] > 0
+    stages = {run['benchmark']: [stage['stage'] for stage in run['stages']] for run in results['runs']}
+    assert stages['workflow1'][-1] == 'Usecase1Query'
+    assert 'Insert_Data' in stages['workflow3'] and stages['workflow3'][-1] == 'Query_Top_Dishes'
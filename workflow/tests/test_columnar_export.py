@@ -0,0 +1,76 @@
+import os
+
+import pandas as pd
+
+import columnar_export
+
+
+def _export(typed_frames, export_pth):
+    frames = dict(typed_frames)
+    menu = frames['menu'].copy()
+    # an undated menu, whose pages and items have no year either
+    menu.loc[menu.index[0], 'year'] = pd.NA
+    frames['menu'] = menu
+    rows = columnar_export.export_parquet(frames, str(export_pth))
+    return frames, rows
+
+
+def _partition_dirs(files):
+    return {os.path.basename(os.path.dirname(path)) for path in files}
+
+
+def test_year_range_opens_only_its_partitions(typed_frames, tmp_path):
+    frames, rows = _export(typed_frames, tmp_path)
+    assert rows['fact_menu_item'] == rows['menu_item'] == len(frames['menu_item'])
+    year = int(frames['menu']['year'].dropna().mode()[0])
+    every = columnar_export.files_read(tmp_path, 'menu_item')
+    assert _partition_dirs(columnar_export.files_read(tmp_path, 'menu_item', years=(year, year))) == {f'year={year}'}
+    assert len(every) > len(columnar_export.files_read(tmp_path, 'menu_item', years=(year, None)))
+
+    pages = columnar_export.read_table(tmp_path, 'menu_page', years=(year, year))
+    expected = frames['menu_page'][frames['menu_page']['menu_id'].isin(frames['menu'].loc[frames['menu']['year'] == year, 'id'])]
+    assert sorted(pages['id']) == sorted(expected['id'])
+    assert pages['year'].dtype == 'Int64'
+    assert columnar_export._dataset(tmp_path, 'menu_page').schema.field('year').type == 'int16'
+
+
+def test_rows_without_a_year_read_back_as_null(typed_frames, tmp_path):
+    frames, _ = _export(typed_frames, tmp_path)
+    undated = frames['menu'].loc[frames['menu']['year'].isna(), 'id']
+    every = columnar_export.files_read(tmp_path, 'menu')
+    assert 'year=__HIVE_DEFAULT_PARTITION__' in _partition_dirs(every)
+    menus = columnar_export.read_table(tmp_path, 'menu', columns=['id', 'year'])
+    assert sorted(menus.loc[menus['year'].isna(), 'id']) == sorted(undated)
+    assert not columnar_export.read_table(tmp_path, 'menu', years=(None, 3000))['id'].isin(undated).any()
+
+
+def test_filters_are_applied_on_read(typed_frames, tmp_path):
+    frames, _ = _export(typed_frames, tmp_path)
+    items = columnar_export.read_table(tmp_path, 'menu_item', columns=['id', 'price'], filters=[('price', '>', 1.0)])
+    assert sorted(items['id']) == sorted(frames['menu_item'].loc[frames['menu_item']['price'] > 1.0, 'id'])
+    # a filter on the partition key prunes files like a year range does
+    year = int(frames['menu']['year'].dropna().min())
+    assert columnar_export.files_read(tmp_path, 'menu', filters=[('year', '=', year)]) == \
+        columnar_export.files_read(tmp_path, 'menu', years=(year, year))
+
+
+def test_fact_table_joins_page_menu_and_dish(typed_frames, tmp_path):
+    frames, _ = _export(typed_frames, tmp_path)
+    fact = columnar_export.read_table(tmp_path, 'fact_menu_item').set_index('menu_item_id')
+    items = frames['menu_item'].set_index('id')
+    assert sorted(fact.index) == sorted(items.index)
+    menu_id = items['menu_page_id'].map(frames['menu_page'].set_index('id')['menu_id'])
+    assert (fact['menu_id'] == menu_id.reindex(fact.index)).all()
+    dish_name = items['dish_id'].map(frames['dish'].set_index('id')['name']).reindex(fact.index)
+    assert fact['dish_name'].fillna('').tolist() == dish_name.fillna('').tolist()
+    year = menu_id.map(frames['menu'].set_index('id')['year']).reindex(fact.index)
+    assert fact['year'].astype('Int64').equals(year.astype('Int64').rename('year'))
+
+
+def test_rerun_replaces_the_old_partitions(typed_frames, tmp_path):
+    frames, _ = _export(typed_frames, tmp_path)
+    frames['menu'] = frames['menu'].assign(year=frames['menu']['year'] - 1000)
+    columnar_export.export_parquet(frames, str(tmp_path))
+    years = {name for name in os.listdir(tmp_path / 'menu') if name != 'year=__HIVE_DEFAULT_PARTITION__'}
+    assert years == {f'year={year}' for year in frames['menu']['year'].dropna().unique()}
+    assert len(columnar_export.read_table(tmp_path, 'menu')) == len(frames['menu'])
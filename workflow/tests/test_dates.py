@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+import dates
+
+
+def _menu(values):
+    return pd.DataFrame({'id': np.arange(1, len(values) + 1), 'date': values})
+
+
+def test_dates_are_parsed_to_epoch_and_year():
+    frame = _menu(['1900-01-02', ' 1900-01-02 ', '1900-01-02T00:00:00Z', None, ''])
+    typed, invalid = dates.normalize_dates({'menu': frame})
+    menu = typed['menu']
+    assert menu['date_epoch'].tolist()[:3] == [-2208902400] * 3
+    assert menu['year'].tolist()[:3] == [1900] * 3
+    assert menu['year'].isna().tolist() == [False, False, False, True, True]
+    assert invalid.empty
+
+
+def test_invalid_and_out_of_range_dates_are_listed():
+    frame = _menu(['1900-02-30', '0190-03-06', '2928-03-26', '2025-12-31', '2026-01-01'])
+    typed, invalid = dates.normalize_dates({'menu': frame})
+    assert typed['menu']['year'].tolist()[3] == 2025
+    assert typed['menu']['year'].isna().tolist() == [True, True, True, False, True]
+    assert list(zip(invalid['id'], invalid['reason'])) == [
+        (1, 'unparseable'), (2, 'out_of_range'), (3, 'out_of_range'), (5, 'out_of_range')]
+
+
+def test_max_year_is_fixed_unless_given():
+    # the default doesn't move with the calendar, so reruns agree
+    assert dates.MAX_YEAR == 2025
+    frame = _menu(['2026-01-01'])
+    typed, invalid = dates.normalize_dates({'menu': frame}, max_year=2030)
+    assert typed['menu']['year'].tolist() == [2026]
+    assert invalid.empty
@@ -0,0 +1,36 @@
+import pandas as pd
+
+from dish_clusters import cluster_dishes, fingerprint
+
+
+def _canonical(clusters):
+    return dict(zip(clusters['dish_id'], clusters['canonical_dish_id']))
+
+
+def test_fingerprint_folds_accents_and_keeps_other_scripts():
+    names = pd.Series(['Consommé ', 'consomme', 'Smørrebrød', 'Щи', 'Борщ', '寿司', '...', None])
+    assert fingerprint(names).tolist() == ['consomme', 'consomme', 'smorrebrod', 'щи', 'борщ', '寿司', '', '']
+
+
+def test_names_without_a_key_are_not_merged():
+    dish = pd.DataFrame({
+        'id': [1, 2, 3, 4, 5, 6, 7],
+        'name': ['Щи', '寿司', 'Борщ', '...', '--', None, 'щи'],
+        'times_appeared': [9, 1, 1, 1, 1, 1, 1],
+    })
+    clusters = cluster_dishes(dish)
+    assert _canonical(clusters) == {1: 1, 2: 2, 3: 3, 4: 4, 5: 5, 6: 6, 7: 1}
+    assert clusters.set_index('dish_id').loc[7, 'method'] == 'fingerprint'
+
+
+def test_near_duplicates_are_merged_onto_the_most_used_name():
+    dish = pd.DataFrame({
+        'id': [1, 2, 3, 4, 5],
+        'name': ['Consommé', 'consomme ', 'Consomme, Clear', 'Margaux 1870', 'Margaux 1878'],
+        'times_appeared': [1, 5, 1, 1, 1],
+    })
+    clusters = cluster_dishes(dish)
+    canonical = _canonical(clusters)
+    assert canonical[1] == canonical[2] == 2
+    assert canonical[4] != canonical[5]
+    assert clusters.set_index('dish_id').loc[1, 'canonical_name'] == 'consomme'
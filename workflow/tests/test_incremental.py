@@ -0,0 +1,116 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import dates
+import incremental
+import ingest
+from dish_clusters import cluster_dishes
+
+TABLES = ['dish', 'menu', 'menu_page', 'menu_item', 'dish_clusters', 'dish_year_counts', 'rejected_rows']
+
+
+def _dump(db_conn, table):
+    return db_conn.execute(f'SELECT * FROM {table} ORDER BY 1, 2').fetchall()
+
+
+def _assert_same(a, b, tables=TABLES):
+    for table in tables:
+        assert _dump(a, table) == _dump(b, table), table
+
+
+def _next_export(frames):
+    # the next export: some dishes renamed, items moved to other dishes, a menu
+    # redated, and new dishes and items; nothing is deleted
+    rng = np.random.default_rng(0)
+    frames = {table: frame.copy() for table, frame in frames.items()}
+    dish = frames['dish']
+    clusters = cluster_dishes(dish)
+    leaders = clusters.loc[clusters['method'] != 'self', 'canonical_dish_id'].unique()[:3]
+    renamed = dish['id'].isin(leaders)
+    dish.loc[renamed, 'name'] = dish.loc[renamed, 'name'] + ' Royale'
+    new_dishes = dish.tail(5).assign(id=dish['id'].max() + np.arange(1, 6), name=['Borscht', 'Борщ', '寿司', '...', 'Borscht'])
+    frames['dish'] = pd.concat([dish, new_dishes], ignore_index=True)
+    items = frames['menu_item']
+    moved = rng.choice(len(items), 50, replace=False)
+    items.iloc[moved, items.columns.get_loc('dish_id')] = rng.choice(frames['dish']['id'].to_numpy(), 50)
+    new_items = items.tail(20).assign(id=items['id'].max() + np.arange(1, 21), dish_id=new_dishes['id'].repeat(4).to_numpy())
+    frames['menu_item'] = pd.concat([items, new_items], ignore_index=True)
+    frames['menu'].loc[frames['menu'].index[:3], 'date'] = '1901-05-05'
+    return dates.normalize_dates(frames)[0], leaders
+
+
+def test_incremental_load_into_an_empty_database_equals_bulk_load(typed_frames):
+    bulk = sqlite3.connect(':memory:')
+    ingest.bulk_load(bulk, typed_frames)
+    loaded = sqlite3.connect(':memory:')
+    incremental.incremental_load(loaded, typed_frames)
+    _assert_same(bulk, loaded)
+
+
+def test_incremental_reload_equals_full_reload(typed_frames):
+    export, _ = _next_export(typed_frames)
+
+    full = sqlite3.connect(':memory:')
+    ingest.bulk_load(full, export)
+    ingest.load_dish_clusters(full, cluster_dishes(export['dish']))
+
+    reloaded = sqlite3.connect(':memory:')
+    ingest.bulk_load(reloaded, typed_frames)
+    ingest.load_dish_clusters(reloaded, cluster_dishes(typed_frames['dish']))
+    stats = incremental.incremental_load(reloaded, export)
+    assert stats['dish']['changed'] == 3
+    assert stats['dish']['new'] == 5
+    stats = incremental.update_dish_clusters(reloaded, cluster_dishes(export['dish']))
+    assert stats['changed'] > 0
+    _assert_same(full, reloaded)
+
+    # a second run of the same export changes nothing
+    stats = incremental.incremental_load(reloaded, export)
+    assert all(stats[table]['new'] == stats[table]['changed'] == 0 for table in ['dish', 'menu', 'menu_page', 'menu_item'])
+    assert incremental.update_dish_clusters(reloaded, cluster_dishes(export['dish']))['changed'] == 0
+    _assert_same(full, reloaded)
+
+
+def test_renamed_dish_drops_its_stale_clusters(typed_frames):
+    db_conn = sqlite3.connect(':memory:')
+    ingest.bulk_load(db_conn, typed_frames)
+    ingest.load_dish_clusters(db_conn, cluster_dishes(typed_frames['dish']))
+    export, leaders = _next_export(typed_frames)
+    members = db_conn.execute(f"SELECT COUNT(*) FROM dish_clusters WHERE canonical_dish_id IN ({', '.join(map(str, leaders))})").fetchone()[0]
+
+    stats = incremental.incremental_load(db_conn, export)
+    assert stats['dish_clusters']['dropped'] == members
+    stale = db_conn.execute(f"SELECT COUNT(*) FROM dish_clusters WHERE canonical_dish_id IN ({', '.join(map(str, leaders))})")
+    assert stale.fetchone()[0] == 0
+    counts = _dump(db_conn, 'dish_year_counts')
+    ingest.refresh_dish_year_counts(db_conn)
+    assert counts == _dump(db_conn, 'dish_year_counts')
+
+
+def test_repeated_id_is_rejected_as_by_bulk_load(typed_frames):
+    frames = dict(typed_frames)
+    items = frames['menu_item']
+    changed = items.iloc[[0]].assign(price=123.0)
+    frames['menu_item'] = pd.concat([items, changed], ignore_index=True)
+
+    bulk = sqlite3.connect(':memory:')
+    ingest.bulk_load(bulk, frames)
+    loaded = sqlite3.connect(':memory:')
+    stats = incremental.incremental_load(loaded, frames)
+    assert stats['menu_item']['rejected'] == 1
+    _assert_same(bulk, loaded)
+    assert loaded.execute('SELECT price FROM menu_item WHERE id = ?', (int(items['id'].iloc[0]),)).fetchone()[0] != 123.0
+
+
+def test_dish_update_fills_a_missing_year():
+    db_conn = sqlite3.connect(':memory:')
+    db_conn.execute('CREATE TABLE dish (id INTEGER PRIMARY KEY, times_appeared INTEGER, menus_appeared INTEGER, '
+                    'first_appeared INTEGER, last_appeared INTEGER)')
+    db_conn.executemany('INSERT INTO dish VALUES (?, ?, ?, ?, ?)', [(1, 1, 1, None, None), (2, 1, 1, 1900, 1910)])
+    db_conn.executemany(incremental._DISH_UPDATE, [
+        (1, 1, 1890, 1890, 1920, 1920, 1),
+        (1, 1, 1890, 1890, None, None, 2),
+    ])
+    assert db_conn.execute('SELECT * FROM dish ORDER BY id').fetchall() == [(1, 2, 2, 1890, 1920), (2, 2, 2, 1890, 1910)]
@@ -0,0 +1,142 @@
+import json
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import dates
+import ingest
+import integrity
+
+
+def _counts(db_conn, table):
+    return db_conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def test_bulk_load_sets_aside_rows_the_schema_refuses(typed_frames):
+    frames = dict(typed_frames)
+    items = frames['menu_item']
+    # the same id with different content, and a NULL in a NOT NULL column
+    changed = items.iloc[[0]].assign(created_at='2020-01-01 00:00:00 UTC')
+    missing = items.iloc[[1]].assign(id=items['id'].max() + 1, xpos=np.nan)
+    frames['menu_item'] = pd.concat([items, changed, missing], ignore_index=True)
+    db_conn = sqlite3.connect(':memory:')
+    stats = ingest.bulk_load(db_conn, frames)
+
+    assert stats['menu_item']['rows'] == len(items)
+    assert stats['menu_item']['rejected'] == 2
+    for table, frame in typed_frames.items():
+        assert _counts(db_conn, table) == len(frame)
+    # the first row with the id is the one loaded
+    first_id = int(items['id'].iloc[0])
+    stored = db_conn.execute('SELECT created_at FROM menu_item WHERE id = ?', (first_id,)).fetchone()[0]
+    assert stored == items['created_at'].iloc[0]
+    rejected = db_conn.execute('SELECT table_name, id, constraint_name, row FROM rejected_rows ORDER BY rowid').fetchall()
+    assert [(table, constraint) for table, _, constraint, _ in rejected] == [
+        ('menu_item', 'menu_item.id PRIMARY KEY'),
+        ('menu_item', 'menu_item.xpos NOT NULL'),
+    ]
+    assert rejected[0][1] == first_id
+    assert json.loads(rejected[1][3])['xpos'] is None
+
+
+def test_split_rejected_accepts_a_key_whose_first_row_was_refused():
+    frame = pd.DataFrame({
+        'id': [1, 1, 2],
+        'menu_id': [10, 11, 12],
+        'page_number': [1, 2, 3],
+        'image_id': [None, 'b', 'c'],
+        'full_height': [1.0, 2.0, 3.0],
+        'full_width': [1.0, 2.0, 3.0],
+        'uuid': ['u1', 'u2', 'u3'],
+    })
+    accepted, rejected = ingest.split_rejected({'menu_page': frame})
+    assert accepted['menu_page']['menu_id'].tolist() == [11, 12]
+    assert rejected['constraint_name'].tolist() == ['menu_page.image_id NOT NULL']
+
+
+def test_bulk_load_asks_for_the_typed_date_columns(typed_frames):
+    frames = dict(typed_frames)
+    frames['menu'] = frames['menu'].drop(columns=['date_epoch', 'year'])
+    db_conn = sqlite3.connect(':memory:')
+    with pytest.raises(ValueError, match=r'menu has no column date_epoch, year; run dates.normalize_dates\(\)'):
+        ingest.bulk_load(db_conn, frames)
+    # nothing was dropped or created
+    assert db_conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0
+
+
+def test_empty_strings_are_stored_as_sqlite_stores_them(typed_frames):
+    frames = dict(typed_frames)
+    # NOT NULL takes '', only a missing value is refused
+    frames['dish'] = frames['dish'].astype({'name': object})
+    frames['dish'].loc[frames['dish'].index[0], 'name'] = ''
+    assert not any(ids.size for name, ids in integrity.check_integrity({'dish': frames['dish']}).items()
+                   if name == 'dish.name NOT NULL')
+    accepted, rejected = ingest.split_rejected(frames)
+    assert len(accepted['dish']) == len(frames['dish'])
+    db_conn = sqlite3.connect(':memory:')
+    ingest.bulk_load(db_conn, frames)
+    assert db_conn.execute("SELECT COUNT(*) FROM dish WHERE name = ''").fetchone()[0] == 1
+
+
+def test_dish_year_checks_follow_the_clip_bounds(typed_frames):
+    frames = dict(typed_frames)
+    frames['dish'] = frames['dish'].assign(first_appeared=1830, last_appeared=1830)
+    db_conn = sqlite3.connect(':memory:')
+    stats = ingest.bulk_load(db_conn, frames, clip_lower=1800, clip_upper=1900)
+    assert stats['dish']['rejected'] == 0
+    with pytest.raises(sqlite3.IntegrityError, match='CHK_last_appeared'):
+        db_conn.execute('UPDATE dish SET last_appeared = 1901')
+    violations = integrity.check_integrity({'dish': frames['dish']})
+    assert len(violations['dish.CHK_first_appeared']) == len(frames['dish'])
+    assert not len(integrity.check_integrity({'dish': frames['dish']}, 1800, 1900)['dish.CHK_first_appeared'])
+
+
+# Query 5 as workflow3 ran it over the joined tables, before dish_year_counts
+QUERY_5 = '''
+    SELECT *
+    FROM
+    (
+            SELECT
+                CAST(substr(menu.date, 1, 4) as INTEGER) AS Year,
+                dish.name AS 'DishName',
+                COUNT(dish.name) AS Occurrences,
+                ROW_NUMBER () OVER (
+                    PARTITION BY CAST(substr(menu.date, 1, 4) as INTEGER)
+                    ORDER BY COUNT(dish.name) DESC, dish.name
+                ) Rank
+            FROM
+                    menu_item
+                    LEFT OUTER JOIN dish ON menu_item.dish_id = dish.id
+                    LEFT OUTER JOIN menu_page ON menu_item.menu_page_id = menu_page.id
+                    LEFT OUTER JOIN menu ON menu_page.menu_id = menu.id
+            WHERE
+                    menu_item.dish_id IS NOT NULL AND
+                    menu.date IS NOT NULL AND
+                    menu.date NOT LIKE '0%' AND
+                    menu.date NOT LIKE '10%' AND
+                    dish.id IS NOT NULL AND
+                    (dish.name NOT LIKE '"' AND dish.name NOT LIKE '" %')
+            GROUP BY Year, dish.name
+    )
+    WHERE Rank <= 10
+'''
+
+
+def test_top_dishes_from_dish_year_counts_rank_as_query_5(typed_frames):
+    frames = dict(typed_frames)
+    # the misread years Query 5 filters out with its '0%' / '10%' patterns
+    menu = frames['menu'].copy()
+    menu.loc[menu.index[:3], 'date'] = ['0190-03-06', '1091-05-01', None]
+    frames['menu'] = menu
+    frames = dates.normalize_dates(frames)[0]
+    assert frames['menu']['year'].iloc[:3].isna().all()
+    db_conn = sqlite3.connect(':memory:')
+    ingest.bulk_load(db_conn, frames)
+    expected = db_conn.execute(QUERY_5).fetchall()
+    assert len({year for year, _, _, _ in expected}) > 1
+    assert db_conn.execute(ingest.TOP_DISHES_QUERY).fetchall() == expected
+    # and again after a refresh of the counts
+    ingest.refresh_dish_year_counts(db_conn)
+    assert db_conn.execute(ingest.TOP_DISHES_QUERY).fetchall() == expected
@@ -0,0 +1,31 @@
+import sys
+import tracemalloc
+
+import pandas as pd
+import pytest
+
+from instrumentation import StageTracer
+from stage_runner import StageRunner
+
+
+def _fail(frame):
+    raise RuntimeError('bad stage')
+
+
+def test_failed_stage_is_recorded_and_stops_profiling():
+    tracer = StageTracer(profile=['Fail'], trace_memory=['Fail'])
+    runner = StageRunner(['Fail', 'Next'], hooks=[tracer])
+    with pytest.raises(RuntimeError):
+        runner.run('Fail', _fail, pd.DataFrame({'a': [1, 2]}), cacheable=False)
+    assert tracer._started == []
+    assert not tracemalloc.is_tracing()
+    # cProfile is off again, so another profiler can be enabled
+    assert sys.getprofile() is None
+    [record] = tracer.stages
+    assert record['stage'] == 'Fail'
+    assert record['rows_in'] == 2
+    assert record['error'] == "RuntimeError('bad stage')"
+
+    runner.run('Next', lambda frame: frame, pd.DataFrame({'a': [1]}), cacheable=False)
+    assert [record['stage'] for record in tracer.stages] == ['Fail', 'Next']
+    assert 'error' not in tracer.stages[1]
@@ -0,0 +1,13 @@
+import pandas as pd
+
+import integrity
+import schema
+
+
+def test_raw_and_typed_frames_match_their_table(synthetic_pth, typed_frames):
+    for table, name in schema.CSV_NAMES.items():
+        raw = pd.read_csv(f'{synthetic_pth}/clean_data/{name}_clean.csv')
+        assert integrity.match_table(raw) == table
+        assert integrity.match_table(typed_frames[table]) == table
+    assert integrity.match_table(pd.DataFrame({'id': [1], 'name': ['x']})) is None
+    assert integrity.source_columns('menu')[-2:] == ['page_count', 'dish_count']
@@ -0,0 +1,65 @@
+import re
+import sys
+import unicodedata
+
+import pandas as pd
+import pytest
+
+from openrefine_replay import UnsupportedOperationError, java_regex_to_python, replay_history
+
+
+def _transform(column, expression):
+    return {
+        'op': 'core/text-transform',
+        'engineConfig': {'facets': [], 'mode': 'row-based'},
+        'columnName': column,
+        'expression': expression,
+        'onError': 'keep-original',
+        'repeat': False,
+        'repeatCount': 10,
+    }
+
+
+HISTORY = [
+    _transform('name', 'value.trim()'),
+    _transform('name', "value.replace(/[\\p{Zs}\\s]+/,' ')"),
+    _transform('name', 'value.replace(/^(\\w+) (\\w+)$/, "$2, $1")'),
+    _transform('date', 'value.trim()'),
+    _transform('date', 'grel:toString(toDate(value),"yyyy-MM-dd")'),
+    _transform('created_at', 'value.toDate()'),
+    _transform('price', 'value.toNumber()'),
+]
+
+
+def test_replay_gives_openrefines_output():
+    frame = pd.DataFrame({
+        'name': ['  Consommé  Royale ', 'Tea', 'Green\tTea　with  Milk', ''],
+        'date': [' 1900-04-15', '0190-03-06', 'not a date', ''],
+        'created_at': ['2011-03-28 15:00:44 UTC', '2011-03-28', 'n/a', ''],
+        'price': ['12.50', '0.40', 'free', ''],
+    }, dtype=object)
+    replayed = replay_history(frame, HISTORY)
+    assert replayed.to_dict('list') == {
+        'name': ['Royale, Consommé', 'Tea', 'Green Tea with Milk', ''],
+        'date': ['1900-04-15', '0190-03-06', 'not a date', ''],
+        'created_at': ['2011-03-28T15:00:44Z', '2011-03-28T00:00:00Z', 'n/a', ''],
+        'price': ['12.5', '0.4', 'free', ''],
+    }
+    # the input frame is left as it was
+    assert frame['price'].tolist() == ['12.50', '0.40', 'free', '']
+
+
+def test_unicode_space_class_matches_every_space_separator():
+    spaces = ''.join(chr(code) for code in range(sys.maxunicode + 1) if unicodedata.category(chr(code)) == 'Zs')
+    for pattern in ['\\p{Zs}+', '[\\p{Zs}x]+']:
+        regex = re.compile(java_regex_to_python(pattern))
+        assert regex.fullmatch(spaces)
+        assert not regex.search('\t')
+    assert re.compile(java_regex_to_python('[\\p{Zs}x]+')).fullmatch('x\u3000x')
+
+
+def test_faceted_operations_are_refused():
+    operation = _transform('name', 'value.trim()')
+    operation['engineConfig']['facets'] = [{'type': 'list', 'columnName': 'name'}]
+    with pytest.raises(UnsupportedOperationError):
+        replay_history(pd.DataFrame({'name': ['a']}), [operation])
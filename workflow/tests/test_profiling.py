@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+import profiling
+
+
+def test_profile_matches_describe_for_a_small_table():
+    frame = pd.DataFrame({
+        'name': ['Consomme', 'Coffee', 'Coffee', None, 'Tea'],
+        'price': [0.5, 1.0, np.nan, 2.5, 0.25],
+    })
+    described = profiling.profile_table(frame, chunksize=2).describe()
+    assert described.loc['top', 'name'] == 'Coffee'
+    assert described.loc['freq', 'name'] == 2
+    assert described.loc['freq_error', 'name'] == 0
+    assert described.loc['nulls', 'name'] == 1
+    assert described.loc['count', 'price'] == 4
+    assert described.loc['mean', 'price'] == frame['price'].mean()
+    assert described.loc['max', 'price'] == 2.5
+
+
+def test_top_is_left_empty_when_the_summary_cannot_tell():
+    # every value appears 30 times, with far more distinct values than the summary keeps
+    values = pd.Series([f'dish {i}' for i in range(2000)] * 30)
+    profile = profiling.profile_table(values.to_frame('name'), chunksize=5000)
+    described = profile.describe()
+    assert pd.isna(described.loc['top', 'name'])
+    assert pd.isna(described.loc['freq', 'name'])
+    assert profile.columns['name'].top.error > 0
+
+    # a value seen more often than any other can be short by is still reported
+    frequent = pd.concat([values, pd.Series(['Coffee'] * 3000)], ignore_index=True).sample(frac=1, random_state=0)
+    described = profiling.profile_table(frequent.to_frame('name'), chunksize=5000).describe()
+    assert described.loc['top', 'name'] == 'Coffee'
+    assert described.loc['freq', 'name'] <= 3000 <= described.loc['freq', 'name'] + described.loc['freq_error', 'name']
+
+
+def test_patterns_cover_every_script():
+    values = pd.Series(['Hotel Astor', 'Борщ 12', '寿司', 'Café 1900-01-01', '...'])
+    assert profiling.patterns(values).tolist() == ['Aa Aa', 'Aa 99', 'a', 'Aa 9999-99-99', '...']
+
+
+def test_a_later_text_chunk_makes_the_column_non_numeric():
+    column = pd.Series([1900, 1901, 1901, None, 'c. 1900', 'c. 1900', 'c. 1900'], dtype=object)
+    frame = pd.DataFrame({'year': column})
+    chunks = profiling.profile_table(frame.iloc[:4].astype({'year': 'float64'})).update(frame.iloc[4:])
+    summary = chunks.columns['year'].summary()
+    assert chunks.columns['year'].numeric is False
+    assert summary['count'] == 6 and summary['nulls'] == 1
+    # the three numbers have no frequencies: each count may be short by them
+    assert chunks.columns['year'].top.error == 3
+    assert summary['top'] == 'c. 1900' and summary['freq'] == 3
+    assert summary['min'] == summary['max'] == 'c. 1900'
+    assert 'mean' not in summary
+
+    numbers = profiling.profile_table(frame.iloc[:4].astype({'year': 'float64'}))
+    text = profiling.profile_table(frame.iloc[4:])
+    for merged in [profiling.TableProfile().merge(numbers).merge(text),
+                   profiling.TableProfile().merge(text).merge(numbers)]:
+        column = merged.columns['year']
+        assert column.numeric is False
+        assert (column.count, column.nulls, column.top.error) == (6, 1, 3)
+        assert column.summary()['top'] == 'c. 1900'
+
+
+def test_duplicates_and_ranges_come_from_the_profile(synthetic_pth):
+    dish = pd.read_csv(f'{synthetic_pth}/Dish_dirty.csv')
+    bounds = {'first_appeared': (1840, 2008), 'last_appeared': (1840, 2008), 'times_appeared': (0, 10 ** 9)}
+    for chunksize in [None, 97]:
+        profile = profiling.profile_table(dish, chunksize=chunksize, bounds=bounds, hash_rows=True)
+        assert profile.duplicate_rows() == dish.duplicated().sum() > 0
+        for column, (lower, upper) in bounds.items():
+            assert profile.out_of_range()[column] == ((dish[column] < lower) | (dish[column] > upper)).sum() > 0
@@ -0,0 +1,93 @@
+import contextlib
+import gc
+import sqlite3
+
+import pytest
+
+import ingest
+import query_service
+from query_service import QueryService
+
+
+def _database(tmp_path, typed_frames):
+    db_pth = str(tmp_path / 'restaurant_menus.db')
+    db_conn = sqlite3.connect(db_pth)
+    ingest.bulk_load(db_conn, typed_frames)
+    db_conn.close()
+    return db_pth
+
+
+def test_top_dishes_match_the_use_case_query(tmp_path, typed_frames):
+    db_pth = _database(tmp_path, typed_frames)
+    db_conn = sqlite3.connect(db_pth)
+    expected = db_conn.execute(ingest.TOP_DISHES_QUERY).fetchall()
+    with QueryService(db_pth, pool_size=2) as service:
+        rows = service.top_dishes('year', 10)
+        assert [tuple(row) for row in rows] == [tuple(row) for row in expected]
+        assert len(service.cache) == 1
+        assert [row for batch in service.iter_top_dishes('year', 10, batch_size=7) for row in batch] == rows
+
+
+class _CountingCursor(sqlite3.Cursor):
+    fetched = 0
+
+    def fetchmany(self, size):
+        rows = super().fetchmany(size)
+        _CountingCursor.fetched += len(rows)
+        return rows
+
+
+class _CountingConnection(sqlite3.Connection):
+    def execute(self, sql, parameters=()):
+        return self.cursor(_CountingCursor).execute(sql, parameters)
+
+
+def test_partly_read_iterator_reads_only_its_batches(tmp_path, typed_frames, monkeypatch):
+    db_pth = _database(tmp_path, typed_frames)
+    monkeypatch.setattr(query_service, 'connect_read_only', lambda db_pth: sqlite3.connect(
+        f'file:{db_pth}?mode=ro', uri=True, check_same_thread=False, factory=_CountingConnection))
+    _CountingCursor.fetched = 0
+    with QueryService(db_pth, pool_size=1) as service:
+        total = len(service.top_dishes('year', 10))
+        assert total > 20 and _CountingCursor.fetched == total
+        service.invalidate()
+
+        _CountingCursor.fetched = 0
+        with contextlib.closing(service.iter_top_dishes('year', 10, batch_size=5)) as batches:
+            assert len(next(batches)) == 5
+            assert len(next(batches)) == 5
+            assert _CountingCursor.fetched == 10
+        # a result that wasn't read to the end isn't cached, and the connection is back
+        assert len(service.cache) == 0
+        assert len(service.top_dishes('year', 10)) == total
+
+
+def test_open_iterators_hold_the_pool_until_closed(tmp_path, typed_frames):
+    db_pth = _database(tmp_path, typed_frames)
+    with QueryService(db_pth, pool_size=2, cache_size=0, pool_timeout=0.5) as service:
+        # two readers stopped after their first batch, as many as there are connections
+        paused = [service.iter_top_dishes(by, 5, batch_size=1) for by in ('decade', 'venue')]
+        try:
+            for reader in paused:
+                assert next(reader)
+            with pytest.raises(TimeoutError):
+                service.submit('year', 5).result(timeout=10)
+            paused[0].close()
+            assert len(service.submit('year', 5).result(timeout=10)) > 0
+        finally:
+            for reader in paused:
+                reader.close()
+
+        # an abandoned iterator gives its connection back too
+        for by in ('decade', 'venue'):
+            assert next(service.iter_top_dishes(by, 5, batch_size=1))
+        gc.collect()
+        assert len(service.submit('year', 5).result(timeout=10)) > 0
+
+        # and with no reader left, a checkpoint can move the whole WAL into the database
+        writer = sqlite3.connect(db_pth)
+        writer.execute('CREATE TABLE touched (id INTEGER)')
+        writer.commit()
+        busy, _, _ = writer.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+        writer.close()
+        assert busy == 0
@@ -0,0 +1,27 @@
+import os
+import shutil
+
+import pytest
+
+import workflow3
+from scheduler import run_table_branches
+from stage_runner import StageRunner
+
+
+def test_parallel_branches_match_in_memory(synthetic_pth, tmp_path_factory):
+    parallel_pth = str(tmp_path_factory.mktemp('parallel'))
+    shutil.copytree(f'{synthetic_pth}/clean_data', f'{parallel_pth}/clean_data')
+    expected = workflow3.clean_tables(StageRunner([]), synthetic_pth)
+    frames, profiles = run_table_branches(workflow3.__file__, parallel_pth, workers=2)
+    assert set(frames) == set(expected) == set(profiles)
+    for table, frame in expected.items():
+        assert frames[table].equals(frame), table
+    for name in os.listdir(f'{synthetic_pth}/clean_data'):
+        if name.endswith('_clean_final.csv'):
+            with open(f'{synthetic_pth}/clean_data/{name}', 'rb') as a, open(f'{parallel_pth}/clean_data/{name}', 'rb') as b:
+                assert a.read() == b.read(), name
+
+
+def test_workers_and_chunksize_are_exclusive(synthetic_pth):
+    with pytest.raises(ValueError):
+        workflow3.data_cleaning_project(synthetic_pth, chunksize=100, workers=2)
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+import ingest
+import schema
+
+
+def test_compact_read_keeps_fractional_page_sizes(tmp_path):
+    path = tmp_path / 'MenuPage_clean.csv'
+    path.write_text('id,menu_id,page_number,image_id,full_height,full_width,uuid\n'
+                    '1,10,1,4000,2394.5,1823,uuid-1\n'
+                    '2,10,2,4001,,1330.25,uuid-2\n')
+    frame = schema.read_table(path, 'menu_page')
+    assert frame['full_height'].dtype == 'float32'
+    # widened back to the decimal values when bound for SQLite
+    assert ingest._typed_values(frame['full_height'], 'REAL') == [2394.5, None]
+    assert ingest._typed_values(frame['full_width'], 'REAL') == [1823.0, 1330.25]
+
+
+def test_compact_dtypes_cover_the_schema():
+    for table in schema.CSV_NAMES:
+        columns = dict(ingest.table_columns(table))
+        assert set(schema.COMPACT_DTYPES[table]) <= set(columns), table
+        assert all(column in schema.table_dtypes(table) for column in columns)
+
+
+def test_float32_widening_matches_the_shortest_repr():
+    rng = np.random.default_rng(0)
+    values = (rng.standard_normal(5000) * 10.0 ** rng.integers(-40, 39, 5000)).astype('float32')
+    values[:4] = [np.nan, 0, np.inf, 1e-45]
+    widened = ingest._widen_float32(pd.Series(values))
+    assert widened.tolist()[1:] == [float(str(value)) for value in values[1:]]
+    assert np.isnan(widened.iloc[0])
@@ -0,0 +1,45 @@
+import gc
+
+import pandas as pd
+
+from stage_cache import StageCache
+
+
+def test_memo_does_not_keep_frames_alive(tmp_path):
+    cache = StageCache(str(tmp_path))
+    frame = pd.DataFrame({'a': [1, 2, 3]})
+    cache.fingerprint(frame)
+    assert len(cache._known) == 1
+    del frame
+    gc.collect()
+    assert cache._known == {}
+
+
+def test_recycled_id_is_not_taken_for_a_known_frame(tmp_path):
+    cache = StageCache(str(tmp_path))
+    fingerprints = set()
+    for value in range(20):
+        # each frame is freed before the next is made, so ids get reused
+        fingerprints.add(cache.fingerprint(pd.DataFrame({'a': [value]})))
+    assert len(fingerprints) == 20
+
+
+def test_stage_reruns_when_input_changes(tmp_path):
+    cache = StageCache(str(tmp_path))
+    double = lambda frame: frame * 2  # noqa: E731
+    first = cache.run('Double', double, pd.DataFrame({'a': [1]}))
+    again = cache.run('Double', double, pd.DataFrame({'a': [1]}))
+    other = cache.run('Double', double, pd.DataFrame({'a': [2]}))
+    assert cache.hits == ['Double'] and cache.misses == ['Double', 'Double']
+    assert first.equals(again) and other['a'].tolist() == [4]
+
+
+def test_eviction_keeps_the_entry_just_stored(tmp_path):
+    cache = StageCache(str(tmp_path), max_bytes=1)
+    double = lambda frame: frame * 2  # noqa: E731
+    cache.run('Double', double, pd.DataFrame({'a': [1]}))
+    cache.run('Double', double, pd.DataFrame({'a': [2]}))
+    # over budget on its own, but the newest entry stays; the older one goes
+    assert len(list(tmp_path.glob('*.pkl'))) == 1
+    cache.run('Double', double, pd.DataFrame({'a': [2]}))
+    assert cache.hits == ['Double']
@@ -0,0 +1,72 @@
+import os
+
+import pandas as pd
+import pytest
+
+import stage_runner
+from stage_runner import StageRunner, read_checkpoint, write_checkpoint
+
+STAGES = ['Load', 'Clean', 'Dedupe', 'Save']
+
+
+def _frame():
+    return pd.DataFrame({
+        'id': pd.array([1, 2, None], dtype='Int64'),
+        'flag': pd.array([True, None, False], dtype='boolean'),
+        'price': pd.array([0.4, None, 12.5], dtype='Float64'),
+        'name': pd.array(['Tea', None, 'Борщ'], dtype='str'),
+        'venue': pd.Series(['COMMERCIAL', None, 'COMMERCIAL'], dtype='category'),
+        'year': pd.array([1900, 1901, 1902], dtype='int16'),
+    })
+
+
+@pytest.mark.parametrize('fmt', ['arrow', 'parquet'])
+def test_checkpoint_round_trip_keeps_nullable_and_string_dtypes(tmp_path, fmt):
+    frame = _frame()
+    path = str(tmp_path / f'frame.{fmt}')
+    write_checkpoint(frame, path, fmt)
+    loaded = read_checkpoint(path, fmt)
+    pd.testing.assert_frame_equal(loaded, frame)
+
+
+def _run(runner, calls):
+    def stage(name, frame):
+        calls.append(name)
+        return frame.assign(**{name.lower(): len(calls)})
+    frame = runner.run('Load', lambda: (calls.append('Load'), _frame())[1])
+    for name in STAGES[1:]:
+        frame = runner.run(name, stage, name, frame)
+    return frame
+
+
+def test_every_stage_output_is_checkpointed(tmp_path):
+    calls = []
+    runner = StageRunner(STAGES, checkpoint_dir=str(tmp_path))
+    result = _run(runner, calls)
+    assert sorted(os.listdir(tmp_path)) == sorted(f'{name}.arrow' for name in STAGES)
+    pd.testing.assert_frame_equal(read_checkpoint(runner.checkpoint_path('Save')), result)
+    assert calls == STAGES
+    # a stage that returns no DataFrame leaves no checkpoint
+    runner.run('Report', lambda: None)
+    assert not os.path.exists(runner.checkpoint_path('Report'))
+
+
+def test_resume_loads_only_the_stage_before_the_resume_point(tmp_path, monkeypatch):
+    first = _run(StageRunner(STAGES, checkpoint_dir=str(tmp_path)), [])
+    # earlier checkpoints are never read again
+    os.remove(tmp_path / 'Load.arrow')
+    read = []
+    monkeypatch.setattr(stage_runner, 'read_checkpoint', lambda path, fmt: read.append(os.path.basename(path))
+                        or read_checkpoint(path, fmt))
+    calls = []
+    resumed = _run(StageRunner(STAGES, checkpoint_dir=str(tmp_path), resume_from='Dedupe'), calls)
+    assert read == ['Clean.arrow']
+    assert calls == ['Dedupe', 'Save']
+    pd.testing.assert_frame_equal(resumed.drop(columns=['dedupe', 'save']), first.drop(columns=['dedupe', 'save']))
+
+
+def test_resume_needs_a_known_stage_and_checkpoints(tmp_path):
+    with pytest.raises(ValueError, match='unknown stage'):
+        StageRunner(STAGES, checkpoint_dir=str(tmp_path), resume_from='Nope')
+    with pytest.raises(ValueError, match='checkpoint directory'):
+        StageRunner(STAGES, resume_from='Clean')
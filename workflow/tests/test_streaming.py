@@ -0,0 +1,49 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import streaming
+import workflow3
+from stage_runner import StageRunner
+
+
+def test_stream_matches_in_memory(synthetic_pth, tmp_path_factory):
+    streamed_pth = str(tmp_path_factory.mktemp('streamed'))
+    shutil.copytree(f'{synthetic_pth}/clean_data', f'{streamed_pth}/clean_data')
+    workflow3.clean_tables(StageRunner([]), synthetic_pth)
+    # chunks of 50 rows: duplicates and missing values cross chunk boundaries
+    rows, profiles = streaming.stream_clean_tables(streamed_pth, chunksize=50)
+    for table in streaming.TABLES:
+        with open(f'{synthetic_pth}/clean_data/{table}_clean_final.csv', 'rb') as f:
+            expected = f.read()
+        with open(f'{streamed_pth}/clean_data/{table}_clean_final.csv', 'rb') as f:
+            assert f.read() == expected, table
+        assert rows[table] == expected.count(b'\n') - 1
+
+
+def test_read_chunks_forces_whole_file_dtypes(tmp_path):
+    path = tmp_path / 'table.csv'
+    path.write_text('id,name,count\n1,,1\n2,,2\n3,soup,\n4,tea,4\n')
+    expected = pd.read_csv(path).dtypes
+    for chunk in streaming.read_chunks(path, chunksize=2):
+        assert chunk.dtypes.equals(expected)
+
+
+def test_hash_collision_keeps_distinct_rows(tmp_path, monkeypatch):
+    # every row hashes alike, so only the row comparison tells them apart
+    monkeypatch.setattr(pd.util, 'hash_pandas_object',
+                        lambda frame, index=False: pd.Series(np.zeros(len(frame), dtype=np.uint64)))
+    frame = pd.DataFrame({'id': [1, 2, 1, 3, 2, 4], 'name': ['soup', None, 'soup', 'tea', None, 'tea']})
+    seen = streaming.RowHashSet(str(tmp_path))
+    kept = pd.concat([seen.add_new(frame.iloc[start:start + 2]) for start in range(0, len(frame), 2)])
+    pd.testing.assert_frame_equal(kept, frame.drop_duplicates())
+    assert len(seen) == 4
+
+
+def test_row_hash_set_across_many_chunks(tmp_path):
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame({'a': rng.integers(0, 50, 2000), 'b': rng.integers(0, 3, 2000).astype(str)})
+    seen = streaming.RowHashSet(str(tmp_path))
+    kept = pd.concat([seen.add_new(frame.iloc[start:start + 64]) for start in range(0, len(frame), 64)])
+    pd.testing.assert_frame_equal(kept, frame.drop_duplicates())
@@ -0,0 +1,46 @@
+import filecmp
+
+import pandas as pd
+
+import schema
+import synthetic_data
+
+
+def _read(pth, name):
+    return pd.read_csv(f'{pth}/{name}_dirty.csv')
+
+
+def test_tables_are_linked_and_carry_the_dirty_patterns(tmp_path):
+    # large enough for every dirty pattern to show up in every table
+    synthetic_pth = str(tmp_path)
+    synthetic_data.generate(synthetic_pth, scale=0.05, seed=0)
+    tables = {name: _read(synthetic_pth, name) for name in schema.CSV_NAMES.values()}
+    for name, frame in tables.items():
+        assert filecmp.cmp(f'{synthetic_pth}/{name}_dirty.csv', f'{synthetic_pth}/clean_data/{name}_clean.csv', shallow=False)
+    dish, menu, page, item = tables['Dish'], tables['Menu'], tables['MenuPage'], tables['MenuItem']
+    # every reference resolves, and the counts on a menu are those of its pages and items
+    assert page['menu_id'].isin(menu['id']).all()
+    assert item['menu_page_id'].isin(page['id']).all()
+    assert item['dish_id'].dropna().isin(dish['id']).all()
+    pages = page.drop_duplicates()
+    items = item.drop_duplicates().merge(pages[['id', 'menu_id']], left_on='menu_page_id', right_on='id')
+    menus = menu.drop_duplicates().set_index('id')
+    assert (pages.groupby('menu_id').size() == menus['page_count']).all()
+    assert (items.groupby('menu_id').size() == menus['dish_count']).all()
+
+    assert all(frame.duplicated().any() for frame in tables.values())
+    assert (dish['times_appeared'] < 0).any()
+    assert (~dish['first_appeared'].between(1840, 2008)).any()
+    assert (dish['name'] != dish['name'].str.strip()).any()
+    assert menu['date'].str.match(r'0|10').any()
+    assert item['dish_id'].isna().any()
+
+
+def test_same_seed_gives_the_same_files(tmp_path):
+    rows = synthetic_data.generate(str(tmp_path / 'a'), scale=0.001, seed=1)
+    synthetic_data.generate(str(tmp_path / 'b'), scale=0.001, seed=1)
+    synthetic_data.generate(str(tmp_path / 'c'), scale=0.001, seed=2)
+    for name, count in rows.items():
+        assert len(_read(tmp_path / 'a', name)) == count
+        assert filecmp.cmp(tmp_path / 'a' / f'{name}_dirty.csv', tmp_path / 'b' / f'{name}_dirty.csv', shallow=False)
+    assert not filecmp.cmp(tmp_path / 'a' / 'MenuItem_dirty.csv', tmp_path / 'c' / 'MenuItem_dirty.csv', shallow=False)
@@ -0,0 +1,10 @@
+import pytest
+
+import workflow1
+
+
+def test_history_picks_the_table():
+    assert workflow1.history_table('../openrefine/MenuPage_OpenRefineHistory.json') == 'MenuPage'
+    assert workflow1.history_table('my_history.json') is None
+    with pytest.raises(ValueError, match='recorded on Menu, not Dish'):
+        workflow1.data_cleaning_project('.', '../openrefine/Menu_OpenRefineHistory.json', table='Dish')
@@ -0,0 +1,28 @@
+import contextlib
+import io
+import sqlite3
+
+import pandas as pd
+
+import workflow3
+
+
+def test_duplicate_id_is_reported_and_set_aside(synthetic_pth, monkeypatch):
+    monkeypatch.chdir(synthetic_pth)
+    path = f'{synthetic_pth}/clean_data/MenuItem_clean.csv'
+    items = pd.read_csv(path)
+    # the same id as the first row, with different content
+    duplicate = items.iloc[[0]].assign(xpos=0.123456)
+    pd.concat([items, duplicate]).to_csv(path, index=False)
+    with contextlib.redirect_stdout(io.StringIO()):
+        workflow3.data_cleaning_project(synthetic_pth)
+
+    violations = pd.read_csv(f'{synthetic_pth}/ic_violations.csv')
+    assert (violations['constraint'] == 'menu_item.id PRIMARY KEY').sum() == 2
+    rejected = pd.read_csv(f'{synthetic_pth}/rejected_rows.csv')
+    assert rejected[['table_name', 'id', 'constraint_name']].values.tolist() == [
+        ['menu_item', items['id'].iloc[0], 'menu_item.id PRIMARY KEY']]
+    db_conn = sqlite3.connect(f'{synthetic_pth}/restaurant_menus.db')
+    assert db_conn.execute('SELECT COUNT(*) FROM rejected_rows').fetchone()[0] == 1
+    assert db_conn.execute('SELECT xpos FROM menu_item WHERE id = ?', (int(items['id'].iloc[0]),)).fetchone()[0] != 0.123456
+    db_conn.close()
@@ -1,85 +1,147 @@
 import pandas as pd
 import sqlite3
+import argparse
+import os
+
+import integrity
+import schema
+from instrumentation import StageTracer
+from openrefine_replay import replay_history_file
+from stage_cache import StageCache
+from stage_runner import StageRunner
 
 # @BEGIN DataCleaningProject_Workflow1
 # @PARAM file_pth
+# @PARAM history_pth
+# @PARAM table
+# @PARAM checkpoint_dir
+# @PARAM cache_dir
+# @PARAM hooks
 # @IN raw_data_file @URI file:{file_pth}/dirty_data
 # @OUT menu_item_historical_frequencies @URI file:{file_pth}/final_cleaned_data.csv
 
-def data_cleaning_project(file_pth='.'):
+# <Table>_dirty.csv -> the table's name in data.db, as in the schema
+TABLE_NAMES = {name: table for table, name in schema.CSV_NAMES.items()}
+
+
+def history_table(history_pth):
+    # The table an OpenRefine history was recorded on, from its file name
+    # (openrefine/<Table>_OpenRefineHistory.json), or None.
+    name = os.path.basename(history_pth).split('_OpenRefineHistory')[0]
+    return name if name in schema.CSV_NAMES.values() else None
+
+
+def data_cleaning_project(file_pth='.', history_pth=None, checkpoint_dir=None, checkpoint_format='arrow', resume_from=None, cache_dir=None, hooks=(), table=None):
+    
+    # table: which <table>_dirty.csv to clean (Dish, Menu, MenuPage or MenuItem);
+    # by default the table the history was recorded on, or Dish without one.
+    recorded = history_table(history_pth) if history_pth is not None else None
+    if table is None:
+        table = recorded or 'Dish'
+    if table not in schema.CSV_NAMES.values():
+        raise ValueError(f"unknown table {table!r}, expected one of {', '.join(schema.CSV_NAMES.values())}")
+    if recorded is not None and table != recorded:
+        raise ValueError(f'{history_pth} was recorded on {recorded}, not {table}')
+
+    # Stages hand their DataFrames to each other in memory; with checkpoint_dir
+    # every stage output is also saved there and a run can resume_from any stage.
+    # With cache_dir, stages whose inputs, parameters and code are unchanged are
+    # loaded from the cache instead of recomputed. hooks see every stage as it runs.
+    runner = StageRunner(
+        ['DataProfiling', 'DataLoading', 'DataCleaning_OpenRefine', 'DataCleaning_Pandas', 'ICViolationChecks', 'DB_DataIngestion',
+         'Usecase1Query'],
+        checkpoint_dir=checkpoint_dir, checkpoint_format=checkpoint_format, resume_from=resume_from,
+        cache=StageCache(cache_dir) if cache_dir is not None else None,
+        hooks=hooks,
+    )
     
     # @BEGIN DataProfiling @desc Understand the data, define use case, identify data quality issues, design database schema
     # @PARAM file_pth
-    # @IN raw_data_file @URI file:{file_pth}/Dish_dirty.csv
-    # @OUT profiled_data_file @URI file:{file_pth}/profiled_data
-    def data_profiling(file_pth):
-        raw_data = pd.read_csv(f'{file_pth}/Dish_dirty.csv')
+    # @PARAM history_pth
+    # @PARAM table
+    # @IN raw_data_file @URI file:{file_pth}/{table}_dirty.csv
+    # @OUT profiled_data
+    def data_profiling(file_pth, history_pth, table):
+        if history_pth is None:
+            raw_data = pd.read_csv(f'{file_pth}/{table}_dirty.csv')
+        else:
+            # OpenRefine imports every cell as text, so the replay does too
+            raw_data = pd.read_csv(f'{file_pth}/{table}_dirty.csv', dtype=str, keep_default_na=False)
         profiled_data = raw_data
-        profiled_data.to_csv(f'{file_pth}/profiled_data.csv', index=False)
         return profiled_data
     # @END DataProfiling
-    profiled_data = data_profiling(file_pth)
+    profiled_data = runner.run('DataProfiling', data_profiling, file_pth, history_pth, table, files=[f'{file_pth}/{table}_dirty.csv'])
     
     # @BEGIN DataLoading @desc Read raw data and prepare it for the data transform phase
-    # @PARAM file_pth
-    # @IN profiled_data_file @URI file:{file_pth}/profiled_data
-    # @OUT loaded_data_file @URI file:{file_pth}/loaded_data
-    def data_loading(file_pth):
-        profiled_data = pd.read_csv(f'{file_pth}/profiled_data.csv')
+    # @IN profiled_data
+    # @OUT loaded_data
+    def data_loading(profiled_data):
         loaded_data = profiled_data
-        loaded_data.to_csv(f'{file_pth}/loaded_data.csv', index=False)
         return loaded_data
     # @END DataLoading
-    loaded_data = data_loading(file_pth)
+    loaded_data = runner.run('DataLoading', data_loading, profiled_data)
     
     # @BEGIN DataCleaning_OpenRefine @desc Data profiling, text transform (trim, standardize name, Regex extraction, format), data cleaning 
-    # @PARAM file_pth
-    # @IN loaded_data_file @URI file:{file_pth}/loaded_data
-    # @OUT cleaned_data_file @URI file:{file_pth}/cleaned_data_openrefine
-    def data_transform(file_pth):
-        load_data = pd.read_csv(f'{file_pth}/loaded_data.csv')
-        transformed_data = load_data
-        transformed_data.to_csv(f'{file_pth}/cleaned_data.csv', index=False)
+    # @PARAM history_pth
+    # @IN loaded_data
+    # @IN openrefine_history @URI file:{history_pth}
+    # @OUT cleaned_data
+    def data_transform(loaded_data, history_pth):
+        if history_pth is None:
+            transformed_data = loaded_data
+        else:
+            transformed_data = replay_history_file(loaded_data, history_pth)
         return transformed_data
     # @END DataCleaning_OpenRefine
-    cleaned_data = data_transform(file_pth)
+    cleaned_data = runner.run('DataCleaning_OpenRefine', data_transform, loaded_data, history_pth,
+                              files=[history_pth] if history_pth is not None else [])
 
     # @BEGIN DataCleaning_Pandas @desc Additional data cleaning and data manipulation (filter, profile, remove duplicates, fill missing data)
-    # @PARAM file_pth
-    # @IN cleaned_data_file @URI file:{file_pth}/cleaned_data_openrefine
-    # @OUT cleaned_final_data_file @URI file:{file_pth}/cleaned_data_pandas
-    def data_cleaning(file_pth):
-        load_data = pd.read_csv(f'{file_pth}/cleaned_data.csv')
-        cleaned_data = load_data
-        cleaned_data.to_csv(f'{file_pth}/cleaned_final_data.csv', index=False)
-        return cleaned_data
+    # @IN cleaned_data
+    # @OUT cleaned_final_data
+    def data_cleaning(cleaned_data):
+        cleaned_final_data = cleaned_data
+        return cleaned_final_data
     # @END DataCleaning_Pandas
-    cleaned_final_data = data_cleaning(file_pth)
+    cleaned_final_data = runner.run('DataCleaning_Pandas', data_cleaning, cleaned_data)
     
     # @BEGIN ICViolationChecks @desc Verify referential integrity and check constrains
     # @PARAM file_pth
-    # @IN cleaned_final_data_file @URI file:{file_pth}/cleaned_data_pandas
-    # @OUT ic_checked_data_file @URI file:{file_pth}/ic_checked_data
-    def ic_violation_checks(file_pth):
-        cleaned_data = pd.read_csv(f'{file_pth}/cleaned_final_data.csv')
-        ic_checked_data = cleaned_data
-        ic_checked_data.to_csv(f'{file_pth}/ic_checked_data.csv', index=False)
+    # @IN cleaned_final_data
+    # @OUT ic_checked_data
+    # @OUT ic_violations @URI file:{file_pth}/ic_violations.csv
+    def ic_violation_checks(cleaned_final_data, file_pth):
+        # The constraints of whichever schema table the data is; foreign keys
+        # need the parent tables, so only this table's own constraints apply.
+        table = integrity.match_table(cleaned_final_data)
+        if table is None:
+            print('ICViolationChecks: columns match no table in the schema, nothing checked')
+        else:
+            ic_violations = integrity.check_integrity({table: cleaned_final_data})
+            integrity.violations_frame(ic_violations).to_csv(f'{file_pth}/ic_violations.csv', index=False)
+            for name, count in integrity.violation_counts(ic_violations).items():
+                print(f'{name}: {count} violations')
+        ic_checked_data = cleaned_final_data
         return ic_checked_data
     # @END ICViolationChecks
-    ic_checked_data = ic_violation_checks(file_pth)
+    ic_checked_data = runner.run('ICViolationChecks', ic_violation_checks, cleaned_final_data, file_pth, cacheable=False)
 
     
     # @BEGIN DB_DataIngestion @desc Create DB tables with cleaned ic_checked_data (Dish, Menu, Menu Page, Menu Item)
     # @PARAM file_pth
-    # @IN ic_checked_data_file @URI file:{file_pth}/ic_checked_data_file
-    # @OUT database_tables @URI file:{file_pth}/database_tables
-    def database_creation(file_pth):
-        database = pd.read_csv(f'{file_pth}/ic_checked_data.csv')
+    # @PARAM table
+    # @IN ic_checked_data
+    # @OUT database_tables @URI file:{file_pth}/data.db
+    def database_creation(ic_checked_data, file_pth, table):
+        # under its schema name (dish, menu, ...), replacing only that table, so
+        # one run per table builds up the database Usecase1Query joins
+        database = ic_checked_data
         conn = sqlite3.connect(f'{file_pth}/data.db')
-        database.to_sql('data', conn, if_exists='replace', index=False)
+        database.to_sql(TABLE_NAMES[table], conn, if_exists='replace', index=False)
+        conn.close()
         return database
     # @END DB_DataIngestion
-    db = database_creation(file_pth)
+    db = runner.run('DB_DataIngestion', database_creation, ic_checked_data, file_pth, table, cacheable=False)
     
     # @BEGIN Usecase1Query @desc Query the data to generate historical frequencies of menu items
     # @PARAM file_pth
@@ -87,6 +149,13 @@ def data_cleaning_project(file_pth='.'):
     # @OUT menu_item_historical_frequencies @URI file:{file_pth}/menu_item_historical_frequencies.csv
     def use_case_query(file_pth):
         conn = sqlite3.connect(f'{file_pth}/data.db')
+        stored = {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        missing = [name for name in TABLE_NAMES.values() if name not in stored]
+        if missing:
+            print(f"Usecase1Query: data.db has no {', '.join(missing)} table yet; run workflow1.py with --table for "
+                  f"each of {', '.join(TABLE_NAMES)}, nothing queried")
+            conn.close()
+            return None
         query = '''
             SELECT Year, DishName, Occurrences, Rank
             FROM (
@@ -112,11 +181,44 @@ def data_cleaning_project(file_pth='.'):
             WHERE Rank <= 10
         '''
         df = pd.read_sql_query(query, conn)
+        conn.close()
         df.to_csv(f'{file_pth}/menu_item_historical_frequencies.csv', index=False)
         return df
     # @END Usecase1Query
-    query = use_case_query(file_pth)
+    query = runner.run('Usecase1Query', use_case_query, file_pth, cacheable=False)
 
 # @END DataCleaningProject_Workflow1
 
-data_cleaning_project()
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='General data cleaning workflow for the NYPL menus dataset.')
+    parser.add_argument('--file-pth', default='.')
+    parser.add_argument('--history-pth', default=None,
+                        help='OpenRefine operation history (e.g. openrefine/Menu_OpenRefineHistory.json) to replay in DataCleaning_OpenRefine')
+    parser.add_argument('--table', choices=list(schema.CSV_NAMES.values()), default=None,
+                        help='clean <file-pth>/<table>_dirty.csv; defaults to the table --history-pth was recorded on, else Dish')
+    parser.add_argument('--checkpoint-dir', default=None,
+                        help='save every stage output here so later runs can resume')
+    parser.add_argument('--checkpoint-format', choices=['arrow', 'parquet'], default='arrow')
+    parser.add_argument('--resume-from', default=None,
+                        help='stage to restart from, e.g. DataCleaning_Pandas; earlier stages are loaded from --checkpoint-dir')
+    parser.add_argument('--cache-dir', default=None,
+                        help='reuse the outputs of stages whose inputs and parameters are unchanged '
+                             '(entries are pickles: only use a directory no one else can write)')
+    parser.add_argument('--trace', default=None,
+                        help='write per-stage time, memory, rows and I/O to this JSON file')
+    parser.add_argument('--profile', nargs='+', default=[], metavar='STAGE',
+                        help='run these stages under cProfile (needs --trace; .prof files go next to it)')
+    parser.add_argument('--tracemalloc', nargs='+', default=[], metavar='STAGE',
+                        help='trace the Python allocations of these stages (needs --trace)')
+    args = parser.parse_args()
+    tracer = None
+    if args.trace is not None:
+        tracer = StageTracer(args.profile, args.tracemalloc, profile_dir=os.path.dirname(os.path.abspath(args.trace)))
+    hooks = [tracer] if tracer is not None else []
+    try:
+        data_cleaning_project(args.file_pth, args.history_pth, args.checkpoint_dir, args.checkpoint_format, args.resume_from, args.cache_dir, hooks,
+                              args.table)
+    finally:
+        # also when a stage failed, to see how far the run got
+        if tracer is not None:
+            tracer.write(args.trace, __file__)
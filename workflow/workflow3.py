@@ -1,23 +1,54 @@
-import numpy as np
 import pandas as pd
 import sqlite3
 import csv
+import argparse
+import os
+
+import cleaning
+import columnar_export
+import dates
+import incremental
+import ingest
+import integrity
+import profiling
+import schema
+from dish_clusters import cluster_dishes
+from instrumentation import StageTracer
+from stage_cache import StageCache
+from scheduler import run_table_branches
+from stage_runner import StageRunner
+from streaming import stream_clean_tables
 
 # @BEGIN DataCleaningProject_Workflow3
 # @PARAM file_pth
+# @PARAM chunksize
+# @PARAM clip_lower
+# @PARAM clip_upper
+# @PARAM cache_dir
+# @PARAM workers
+# @PARAM compact_dtypes
+# @PARAM cluster_threshold
+# @PARAM export_pth
+# @PARAM incremental_load
+# @PARAM hooks
 # @IN Dish_clean.csv
 # @IN Menu_clean.csv
 # @IN MenuPage_clean.csv
 # @IN MenuItem_clean.csv
 # @OUT menu_item_historical_frequencies.csv
+# @OUT dish_clusters.csv
+# @OUT invalid_dates.csv
 # @OUT Dish_clean_final.csv
 # @OUT Menu_clean_final.csv
 # @OUT MenuPage_clean_final.csv
 # @OUT MenuItem_clean_final.csv
 
-def data_cleaning_project(file_pth='.'):
+# The cleaning stages on whole tables in memory; data_cleaning_project runs them
+# unless the tables are streamed (chunksize) or cleaned in parallel (workers).
+def clean_tables(runner, file_pth='.', clip_lower=1840, clip_upper=2008, compact_dtypes=False):
     
     # @BEGIN Load_Cleaned_CSV_Files @desc Load the cleaned CSV files into pandas DataFrames.
+    # @PARAM compact_dtypes
     # @IN Dish_clean.csv
     # @IN Menu_clean.csv
     # @IN MenuPage_clean.csv
@@ -26,13 +57,16 @@ def data_cleaning_project(file_pth='.'):
     # @OUT menu_clean
     # @OUT menupage_clean
     # @OUT menuitem_clean
-    def load_cleaned_csv_files(file_pth):
-        dish_clean = pd.read_csv(f"{file_pth}/clean_data/Dish_clean.csv")
-        menu_clean = pd.read_csv(f"{file_pth}/clean_data/Menu_clean.csv")
-        menupage_clean = pd.read_csv(f"{file_pth}/clean_data/MenuPage_clean.csv")
-        menuitem_clean = pd.read_csv(f"{file_pth}/clean_data/MenuItem_clean.csv")
+    def load_cleaned_csv_files(file_pth, compact_dtypes):
+        # compact_dtypes: read with the declared schema in schema.py (categoricals, Int16/Int32, float32)
+        dish_clean = schema.read_clean_table(file_pth, 'dish', compact=compact_dtypes)
+        menu_clean = schema.read_clean_table(file_pth, 'menu', compact=compact_dtypes)
+        menupage_clean = schema.read_clean_table(file_pth, 'menu_page', compact=compact_dtypes)
+        menuitem_clean = schema.read_clean_table(file_pth, 'menu_item', compact=compact_dtypes)
         return dish_clean, menu_clean, menupage_clean, menuitem_clean
-    dish_clean, menu_clean, menupage_clean, menuitem_clean = load_cleaned_csv_files(file_pth)
+    dish_clean, menu_clean, menupage_clean, menuitem_clean = runner.run(
+        'Load_Cleaned_CSV_Files', load_cleaned_csv_files, file_pth, compact_dtypes,
+        files=[f"{file_pth}/clean_data/{table}_clean.csv" for table in ['Dish', 'Menu', 'MenuPage', 'MenuItem']])
     # @END Load_Cleaned_CSV_Files
     
     # @BEGIN Data_Profiling @desc Profile the data to understand its structure and content.
@@ -45,12 +79,13 @@ def data_cleaning_project(file_pth='.'):
     # @OUT menupage_profile_stats
     # @OUT menuitem_profile_stats
     def data_profiling(dish_clean, menu_clean, menupage_clean, menuitem_clean):
-        dish_profile_stats = dish_clean.describe(include='all')
-        menu_profile_stats = menu_clean.describe(include='all')
-        menupage_profile_stats = menupage_clean.describe(include='all')
-        menuitem_profile_stats = menuitem_clean.describe(include='all')
+        # one pass per table; .describe() of a profile gives the describe(include='all') rows
+        dish_profile_stats = profiling.profile_table(dish_clean)
+        menu_profile_stats = profiling.profile_table(menu_clean)
+        menupage_profile_stats = profiling.profile_table(menupage_clean)
+        menuitem_profile_stats = profiling.profile_table(menuitem_clean)
         return dish_profile_stats, menu_profile_stats, menupage_profile_stats, menuitem_profile_stats
-    dish_profile_stats, menu_profile_stats, menupage_profile_stats, menuitem_profile_stats = data_profiling(dish_clean, menu_clean, menupage_clean, menuitem_clean)
+    dish_profile_stats, menu_profile_stats, menupage_profile_stats, menuitem_profile_stats = runner.run('Data_Profiling', data_profiling, dish_clean, menu_clean, menupage_clean, menuitem_clean)
     # @END Data_Profiling
     
     # @BEGIN Handle_Missing_Values @desc Handle missing values in the datasets.
@@ -63,12 +98,12 @@ def data_cleaning_project(file_pth='.'):
     # @OUT menupage_no_missing
     # @OUT menuitem_no_missing
     def handle_missing_values(dish_clean, menu_clean, menupage_clean, menuitem_clean):
-        dish_no_missing = dish_clean.fillna(method='ffill')
-        menu_no_missing = menu_clean.fillna(method='ffill')
-        menupage_no_missing = menupage_clean.fillna(method='ffill')
-        menuitem_no_missing = menuitem_clean.fillna(method='ffill')
+        dish_no_missing = cleaning.handle_missing_values(dish_clean)
+        menu_no_missing = cleaning.handle_missing_values(menu_clean)
+        menupage_no_missing = cleaning.handle_missing_values(menupage_clean)
+        menuitem_no_missing = cleaning.handle_missing_values(menuitem_clean)
         return dish_no_missing, menu_no_missing, menupage_no_missing, menuitem_no_missing
-    dish_no_missing, menu_no_missing, menupage_no_missing, menuitem_no_missing = handle_missing_values(dish_clean, menu_clean, menupage_clean, menuitem_clean)
+    dish_no_missing, menu_no_missing, menupage_no_missing, menuitem_no_missing = runner.run('Handle_Missing_Values', handle_missing_values, dish_clean, menu_clean, menupage_clean, menuitem_clean)
     # @END Handle_Missing_Values
     
     # @BEGIN Remove_Duplicates @desc Remove duplicate rows from the datasets.
@@ -81,12 +116,12 @@ def data_cleaning_project(file_pth='.'):
     # @OUT menupage_no_duplicates
     # @OUT menuitem_no_duplicates
     def remove_duplicates(dish_no_missing, menu_no_missing, menupage_no_missing, menuitem_no_missing):
-        dish_no_duplicates = dish_no_missing.drop_duplicates()
-        menu_no_duplicates = menu_no_missing.drop_duplicates()
-        menupage_no_duplicates = menupage_no_missing.drop_duplicates()
-        menuitem_no_duplicates = menuitem_no_missing.drop_duplicates()
+        dish_no_duplicates = cleaning.remove_duplicates(dish_no_missing)
+        menu_no_duplicates = cleaning.remove_duplicates(menu_no_missing)
+        menupage_no_duplicates = cleaning.remove_duplicates(menupage_no_missing)
+        menuitem_no_duplicates = cleaning.remove_duplicates(menuitem_no_missing)
         return dish_no_duplicates, menu_no_duplicates, menupage_no_duplicates, menuitem_no_duplicates
-    dish_no_duplicates, menu_no_duplicates, menupage_no_duplicates, menuitem_no_duplicates = remove_duplicates(dish_no_missing, menu_no_missing, menupage_no_missing, menuitem_no_missing)
+    dish_no_duplicates, menu_no_duplicates, menupage_no_duplicates, menuitem_no_duplicates = runner.run('Remove_Duplicates', remove_duplicates, dish_no_missing, menu_no_missing, menupage_no_missing, menuitem_no_missing)
     # @END Remove_Duplicates
     
     # @BEGIN Standardize_Columns @desc Standardize column names and data types.
@@ -99,12 +134,12 @@ def data_cleaning_project(file_pth='.'):
     # @OUT menupage_standardized
     # @OUT menuitem_standardized
     def standardize_columns(dish_no_duplicates, menu_no_duplicates, menupage_no_duplicates, menuitem_no_duplicates):
-        dish_standardized = dish_no_duplicates.rename(columns=lambda x: x.strip().lower().replace(' ', '_'))
-        menu_standardized = menu_no_duplicates.rename(columns=lambda x: x.strip().lower().replace(' ', '_'))
-        menupage_standardized = menupage_no_duplicates.rename(columns=lambda x: x.strip().lower().replace(' ', '_'))
-        menuitem_standardized = menuitem_no_duplicates.rename(columns=lambda x: x.strip().lower().replace(' ', '_'))
+        dish_standardized = cleaning.standardize_columns(dish_no_duplicates)
+        menu_standardized = cleaning.standardize_columns(menu_no_duplicates)
+        menupage_standardized = cleaning.standardize_columns(menupage_no_duplicates)
+        menuitem_standardized = cleaning.standardize_columns(menuitem_no_duplicates)
         return dish_standardized, menu_standardized, menupage_standardized, menuitem_standardized
-    dish_standardized, menu_standardized, menupage_standardized, menuitem_standardized = standardize_columns(dish_no_duplicates, menu_no_duplicates, menupage_no_duplicates, menuitem_no_duplicates)
+    dish_standardized, menu_standardized, menupage_standardized, menuitem_standardized = runner.run('Standardize_Columns', standardize_columns, dish_no_duplicates, menu_no_duplicates, menupage_no_duplicates, menuitem_no_duplicates)
     # @END Standardize_Columns
     
     # @BEGIN Clean_Negative_Values @desc Replace negative values in numerical columns with 0.
@@ -113,23 +148,21 @@ def data_cleaning_project(file_pth='.'):
     # @OUT dish_cleaned_negatives
     # @OUT menuitem_cleaned_negatives
     def clean_negative_values(dish_standardized, menuitem_standardized):
-        dish_standardized['times_appeared'] = dish_standardized['times_appeared'].where(dish_standardized['times_appeared'] >= 0, 0)
-        menuitem_standardized['price'] = menuitem_standardized['price'].where(menuitem_standardized['price'] >= 0, 0)
-        dish_cleaned_negatives = dish_standardized
-        menuitem_cleaned_negatives = menuitem_standardized
+        dish_cleaned_negatives = cleaning.clean_negative_values(dish_standardized, 'dish')
+        menuitem_cleaned_negatives = cleaning.clean_negative_values(menuitem_standardized, 'menu_item')
         return dish_cleaned_negatives, menuitem_cleaned_negatives
-    dish_cleaned_negatives, menuitem_cleaned_negatives = clean_negative_values(dish_standardized, menuitem_standardized)
+    dish_cleaned_negatives, menuitem_cleaned_negatives = runner.run('Clean_Negative_Values', clean_negative_values, dish_standardized, menuitem_standardized)
     # @END Clean_Negative_Values
     
     # @BEGIN Clip_Values @desc Clip values in specific columns to a specified range.
+    # @PARAM clip_lower
+    # @PARAM clip_upper
     # @IN dish_cleaned_negatives
     # @OUT dish_clipped
-    def clip_values(dish_cleaned_negatives):
-        dish_cleaned_negatives['first_appeared'] = dish_cleaned_negatives['first_appeared'].clip(lower=1840, upper=2008)
-        dish_cleaned_negatives['last_appeared'] = dish_cleaned_negatives['last_appeared'].clip(lower=1840, upper=2008)
-        dish_clipped = dish_cleaned_negatives
+    def clip_values(dish_cleaned_negatives, clip_lower, clip_upper):
+        dish_clipped = cleaning.clip_values(dish_cleaned_negatives, 'dish', clip_lower, clip_upper)
         return dish_clipped
-    dish_clipped = clip_values(dish_cleaned_negatives)
+    dish_clipped = runner.run('Clip_Values', clip_values, dish_cleaned_negatives, clip_lower, clip_upper)
     # @END Clip_Values
     
     # @BEGIN Save_Cleaned_CSVs @desc Save the cleaned DataFrames to new CSV files.
@@ -146,8 +179,72 @@ def data_cleaning_project(file_pth='.'):
         menu_standardized.to_csv(f"{file_pth}/clean_data/Menu_clean_final.csv", index=False)
         menupage_standardized.to_csv(f"{file_pth}/clean_data/MenuPage_clean_final.csv", index=False)
         menuitem_cleaned_negatives.to_csv(f"{file_pth}/clean_data/MenuItem_clean_final.csv", index=False)
-    save_cleaned_csvs(dish_clipped, menu_standardized, menupage_standardized, menuitem_cleaned_negatives, file_pth)
+    runner.run('Save_Cleaned_CSVs', save_cleaned_csvs, dish_clipped, menu_standardized, menupage_standardized,
+               menuitem_cleaned_negatives, file_pth, cacheable=False)
     # @END Save_Cleaned_CSVs
+    return {
+        'dish': dish_clipped,
+        'menu': menu_standardized,
+        'menu_page': menupage_standardized,
+        'menu_item': menuitem_cleaned_negatives,
+    }
+
+
+def data_cleaning_project(file_pth='.', chunksize=None, clip_lower=1840, clip_upper=2008, cache_dir=None, workers=None, compact_dtypes=False, cluster_threshold=None, export_pth=None, incremental_load=False, max_year=dates.MAX_YEAR, hooks=()):
+    
+    if workers is not None and chunksize is not None:
+        # the parallel branches clean whole tables, so a chunk size would be ignored
+        raise ValueError('workers and chunksize are exclusive: clean in parallel or stream, not both')
+    
+    # With cache_dir, the in-memory cleaning stages are keyed on their inputs,
+    # parameters and code, and only re-run when one of those changed. hooks are
+    # passed to the StageRunner and see every stage as it runs.
+    runner = StageRunner(
+        ['Parallel_Clean_Tables', 'Load_Cleaned_CSV_Files', 'Data_Profiling', 'Handle_Missing_Values', 'Remove_Duplicates',
+         'Standardize_Columns', 'Clean_Negative_Values', 'Clip_Values', 'Save_Cleaned_CSVs', 'Stream_Clean_Tables',
+         'Connect_Database', 'Create_Tables', 'Normalize_Dates', 'Check_Integrity', 'Insert_Data', 'Potential_Issues_Analysis', 'Cluster_Dish_Names', 'Export_Parquet',
+         'Query_Top_Dishes'],
+        cache=StageCache(cache_dir) if cache_dir is not None else None,
+        hooks=hooks,
+    )
+    
+    if workers is not None:
+        # @BEGIN Parallel_Clean_Tables @desc Run Load_Cleaned_CSV_Files .. Save_Cleaned_CSVs for the four tables in parallel processes.
+        # @PARAM workers
+        # @PARAM clip_lower
+        # @PARAM clip_upper
+        # @IN Dish_clean.csv
+        # @IN Menu_clean.csv
+        # @IN MenuPage_clean.csv
+        # @IN MenuItem_clean.csv
+        # @OUT Dish_clean_final.csv
+        # @OUT Menu_clean_final.csv
+        # @OUT MenuPage_clean_final.csv
+        # @OUT MenuItem_clean_final.csv
+        # The per-table branches are read off the stage annotations of this file.
+        final_frames, profile_stats = runner.run('Parallel_Clean_Tables', run_table_branches, __file__, file_pth, workers,
+                                                 clip_lower, clip_upper, compact_dtypes, cacheable=False)
+        # @END Parallel_Clean_Tables
+    elif chunksize is not None:
+        # @BEGIN Stream_Clean_Tables @desc Run Handle_Missing_Values .. Clip_Values chunk by chunk and save the cleaned CSVs.
+        # @PARAM chunksize
+        # @PARAM clip_lower
+        # @PARAM clip_upper
+        # @IN Dish_clean.csv
+        # @IN Menu_clean.csv
+        # @IN MenuPage_clean.csv
+        # @IN MenuItem_clean.csv
+        # @OUT Dish_clean_final.csv
+        # @OUT Menu_clean_final.csv
+        # @OUT MenuPage_clean_final.csv
+        # @OUT MenuItem_clean_final.csv
+        # the input chunks are profiled on the way, as Data_Profiling does for whole tables
+        _, profile_stats = runner.run('Stream_Clean_Tables', stream_clean_tables, file_pth, chunksize, clip_lower, clip_upper,
+                                      cacheable=False)
+        # @END Stream_Clean_Tables
+        final_frames = None
+    else:
+        final_frames = clean_tables(runner, file_pth, clip_lower, clip_upper, compact_dtypes)
     
     # @BEGIN Connect_Database @desc Connect to the SQLite database.
     # @OUT db_conn
@@ -156,152 +253,257 @@ def data_cleaning_project(file_pth='.'):
         db_conn = sqlite3.connect('restaurant_menus.db')
         db_cursor = db_conn.cursor()
         return db_conn, db_cursor
-    db_conn, db_cursor = connect_database()
+    db_conn, db_cursor = runner.run('Connect_Database', connect_database, cacheable=False)
     # @END Connect_Database
     
     # @BEGIN Create_Tables @desc Create tables in the SQLite database for the cleaned data.
+    # @PARAM clip_lower
+    # @PARAM clip_upper
     # @IN db_cursor
     # @IN db_conn
     # @OUT tables_created
-    def create_tables(db_cursor, db_conn):
-        db_cursor.execute('''
-            CREATE TABLE IF NOT EXISTS dish (
-                id INTEGER PRIMARY KEY,
-                name TEXT NOT NULL,
-                menus_appeared INTEGER NOT NULL,
-                times_appeared INTEGER NOT NULL,
-                first_appeared INTEGER NOT NULL,
-                last_appeared INTEGER NOT NULL,
-                lowest_price REAL,
-                highest_price REAL
-            )
-        ''')
-        db_cursor.execute('''
-            CREATE TABLE IF NOT EXISTS menu (
-                id INTEGER PRIMARY KEY,
-                name TEXT NOT NULL,
-                date TEXT NOT NULL
-            )
-        ''')
-        db_cursor.execute('''
-            CREATE TABLE IF NOT EXISTS menu_page (
-                id INTEGER PRIMARY KEY,
-                menu_id INTEGER NOT NULL,
-                number INTEGER NOT NULL,
-                FOREIGN KEY (menu_id) REFERENCES menu (id)
-            )
-        ''')
-        db_cursor.execute('''
-            CREATE TABLE IF NOT EXISTS menu_item (
-                id INTEGER PRIMARY KEY,
-                menu_page_id INTEGER NOT NULL,
-                dish_id INTEGER,
-                price REAL,
-                FOREIGN KEY (menu_page_id) REFERENCES menu_page (id),
-                FOREIGN KEY (dish_id) REFERENCES dish (id)
-            )
-        ''')
-        db_conn.commit()
-    create_tables(db_cursor, db_conn)
+    def create_tables(db_cursor, db_conn, clip_lower, clip_upper):
+        # Queries 1.1 - 4.1 in analysis/queries.md, with the dish year CHECKs at the clip bounds
+        ingest.create_tables(db_conn, clip_lower=clip_lower, clip_upper=clip_upper)
+    runner.run('Create_Tables', create_tables, db_cursor, db_conn, clip_lower, clip_upper, cacheable=False)
     # @END Create_Tables
     
-    # @BEGIN Insert_Data @desc Insert data from the cleaned CSV files into the respective tables in the SQLite database.
-    # @IN db_cursor
-    # @IN db_conn
+    # @BEGIN Normalize_Dates @desc Parse menu.date and menu_item.created_at/updated_at once into typed epoch and year columns.
     # @IN Dish_clean_final.csv 
     # @IN Menu_clean_final.csv 
     # @IN MenuPage_clean_final.csv 
     # @IN MenuItem_clean_final.csv
-    # @OUT data_inserted
-    def insert_data(db_cursor, db_conn, file_pth):
-        dish_clean_final = pd.read_csv(f"{file_pth}/clean_data/Dish_clean_final.csv")
-        menu_clean_final = pd.read_csv(f"{file_pth}/clean_data/Menu_clean_final.csv")
-        menupage_clean_final = pd.read_csv(f"{file_pth}/clean_data/MenuPage_clean_final.csv")
-        menuitem_clean_final = pd.read_csv(f"{file_pth}/clean_data/MenuItem_clean_final.csv")
+    # @PARAM max_year
+    # @OUT typed_frames
+    # @OUT invalid_dates @URI file:{file_pth}/invalid_dates.csv
+    def normalize_dates(final_frames, file_pth, compact_dtypes, max_year):
+        if final_frames is None:
+            # streaming mode never holds the whole tables, so read back what it wrote
+            final_frames = {
+                'dish': schema.read_clean_table(file_pth, 'dish', 'clean_final', compact=compact_dtypes),
+                'menu': schema.read_clean_table(file_pth, 'menu', 'clean_final', compact=compact_dtypes),
+                'menu_page': schema.read_clean_table(file_pth, 'menu_page', 'clean_final', compact=compact_dtypes),
+                'menu_item': schema.read_clean_table(file_pth, 'menu_item', 'clean_final', compact=compact_dtypes),
+            }
+        typed_frames, invalid_dates = dates.normalize_dates(final_frames, max_year=max_year)
+        invalid_dates.to_csv(f"{file_pth}/invalid_dates.csv", index=False)
+        return typed_frames, invalid_dates
+    typed_frames, invalid_dates = runner.run('Normalize_Dates', normalize_dates, final_frames, file_pth, compact_dtypes,
+                                             max_year, cacheable=False)
+    # @END Normalize_Dates
     
-        dish_clean_final.to_sql('dish', db_conn, if_exists='replace', index=False)
-        menu_clean_final.to_sql('menu', db_conn, if_exists='replace', index=False)
-        menupage_clean_final.to_sql('menu_page', db_conn, if_exists='replace', index=False)
-        menuitem_clean_final.to_sql('menu_item', db_conn, if_exists='replace', index=False)
-    insert_data(db_cursor, db_conn, file_pth)
+    # @BEGIN Check_Integrity @desc Check every constraint of the schema on the rows about to be loaded, and set aside the rows an INSERT would refuse.
+    # @PARAM clip_lower
+    # @PARAM clip_upper
+    # @IN typed_frames
+    # @OUT ic_violations @URI file:{file_pth}/ic_violations.csv
+    # @OUT accepted_frames
+    # @OUT rejected_rows @URI file:{file_pth}/rejected_rows.csv
+    def check_integrity(typed_frames, clip_lower, clip_upper, file_pth):
+        # every FK, primary key, NOT NULL and CHECK constraint, as arrays of violating ids;
+        # run before the load, so the rows the load refuses are among them
+        ic_violations = integrity.check_integrity(typed_frames, clip_lower, clip_upper)
+        integrity.violations_frame(ic_violations).to_csv(f"{file_pth}/ic_violations.csv", index=False)
+        accepted_frames, rejected_rows = ingest.split_rejected(typed_frames, clip_lower, clip_upper)
+        rejected_rows.to_csv(f"{file_pth}/rejected_rows.csv", index=False)
+        return ic_violations, accepted_frames, rejected_rows
+    ic_violations, accepted_frames, rejected_rows = runner.run('Check_Integrity', check_integrity, typed_frames, clip_lower,
+                                                               clip_upper, file_pth, cacheable=False)
+    # @END Check_Integrity
+    
+    # @BEGIN Insert_Data @desc Bulk load the cleaned DataFrames into the respective tables in the SQLite database.
+    # @PARAM incremental_load
+    # @PARAM clip_lower
+    # @PARAM clip_upper
+    # @IN db_cursor
+    # @IN db_conn
+    # @IN accepted_frames
+    # @IN rejected_rows
+    # @IN invalid_dates
+    # @OUT data_inserted
+    # @OUT dish_year_counts
+    def insert_data(db_cursor, db_conn, accepted_frames, rejected_rows, invalid_dates, incremental_load, clip_lower, clip_upper):
+        if incremental_load:
+            # only the new and changed rows are written; the derived counts are adjusted for them
+            load_stats = incremental.incremental_load(db_conn, accepted_frames, clip_lower, clip_upper, rejected=rejected_rows)
+            print(incremental.format_incremental_stats(load_stats))
+        else:
+            load_stats = ingest.bulk_load(db_conn, accepted_frames, rejected=rejected_rows, clip_lower=clip_lower, clip_upper=clip_upper)
+            print(ingest.format_load_stats(load_stats))
+        invalid_stats = ingest.load_invalid_dates(db_conn, invalid_dates)
+        print(f"invalid_dates: {invalid_stats['rows']:,} rows in {invalid_stats['seconds']:.2f}s")
+        # the rows now in the database
+        return accepted_frames['dish'], accepted_frames['menu'], accepted_frames['menu_page'], accepted_frames['menu_item']
+    dish_clean_final, menu_clean_final, menupage_clean_final, menuitem_clean_final = runner.run(
+        'Insert_Data', insert_data, db_cursor, db_conn, accepted_frames, rejected_rows, invalid_dates, incremental_load,
+        clip_lower, clip_upper, cacheable=False)
     # @END Insert_Data
     
     # @BEGIN Potential_Issues_Analysis @desc Analyze and record potential issues in text in the cleaned data.
     # @IN tables_created
     # @IN data_inserted
+    # @IN ic_violations
+    # @PARAM clip_lower
+    # @PARAM clip_upper
     # @OUT issues_diagnose @URI file:{file_pth}/issues_diagnose_text
-    def potential_issues_analysis(dish_clean_final, menu_clean_final, menupage_clean_final, menuitem_clean_final, file_pth):
+    # @OUT profile_report @URI file:{file_pth}/profile_report.csv
+    # @OUT pattern_report @URI file:{file_pth}/pattern_report.csv
+    def potential_issues_analysis(dish_clean_final, menu_clean_final, menupage_clean_final, menuitem_clean_final, ic_violations,
+                                  clip_lower, clip_upper, file_pth):
+        # one profiling pass per table gives the missing values, duplicate rows,
+        # out-of-range years and the value/pattern reports
+        year_bounds = {'first_appeared': (clip_lower, clip_upper), 'last_appeared': (clip_lower, clip_upper)}
+        profiles = {
+            'dish': profiling.profile_table(dish_clean_final, bounds=year_bounds, hash_rows=True),
+            'menu': profiling.profile_table(menu_clean_final, hash_rows=True),
+            'menu_page': profiling.profile_table(menupage_clean_final, hash_rows=True),
+            'menu_item': profiling.profile_table(menuitem_clean_final, hash_rows=True),
+        }
+        dish_out_of_range = profiles['dish'].out_of_range()
+        profiling.profile_report(profiles).to_csv(f"{file_pth}/profile_report.csv", index=False)
+        profiling.pattern_report(profiles).to_csv(f"{file_pth}/pattern_report.csv", index=False)
+        # from Check_Integrity, i.e. counted on the rows before the load
+        ic_counts = integrity.table_violation_counts(ic_violations)
         potential_issues = {
             'missing_values': {
-                'dish': dish_clean_final.isnull().sum().to_dict(),
-                'menu': menu_clean_final.isnull().sum().to_dict(),
-                'menupage': menupage_clean_final.isnull().sum().to_dict(),
-                'menuitem': menuitem_clean_final.isnull().sum().to_dict(),
+                'dish': profiles['dish'].nulls().to_dict(),
+                'menu': profiles['menu'].nulls().to_dict(),
+                'menupage': profiles['menu_page'].nulls().to_dict(),
+                'menuitem': profiles['menu_item'].nulls().to_dict(),
             },
             'duplicates': {
-                'dish': dish_clean_final.duplicated().sum(),
-                'menu': menu_clean_final.duplicated().sum(),
-                'menupage': menupage_clean_final.duplicated().sum(),
-                'menuitem': menuitem_clean_final.duplicated().sum(),
+                'dish': profiles['dish'].duplicate_rows(),
+                'menu': profiles['menu'].duplicate_rows(),
+                'menupage': profiles['menu_page'].duplicate_rows(),
+                'menuitem': profiles['menu_item'].duplicate_rows(),
             },
             'range_issues': {
                 'dish': {
-                    'first_appeared_out_of_range': dish_clean_final[(dish_clean_final['first_appeared'] < 1840) | (dish_clean_final['first_appeared'] > 2008)].shape[0],
-                    'last_appeared_out_of_range': dish_clean_final[(dish_clean_final['last_appeared'] < 1840) | (dish_clean_final['last_appeared'] > 2008)].shape[0],
+                    'first_appeared_out_of_range': int(dish_out_of_range['first_appeared']),
+                    'last_appeared_out_of_range': int(dish_out_of_range['last_appeared']),
                 }
-            }
+            },
+            'ic_violations': {
+                'dish': ic_counts['dish'],
+                'menu': ic_counts['menu'],
+                'menupage': ic_counts['menu_page'],
+                'menuitem': ic_counts['menu_item'],
+            },
         }
         issues_report = pd.DataFrame(potential_issues)
         issues_report.to_csv(f"{file_pth}/issues_report.csv", index=False)
-    potential_issues_analysis(dish_clean_final, menu_clean_final, menupage_clean_final, menuitem_clean_final, file_pth)
+    runner.run('Potential_Issues_Analysis', potential_issues_analysis, dish_clean_final, menu_clean_final,
+               menupage_clean_final, menuitem_clean_final, ic_violations, clip_lower, clip_upper, file_pth, cacheable=False)
     # @END Potential_Issues_Analysis
     
+    dish_clusters = None
+    if cluster_threshold is not None:
+        # @BEGIN Cluster_Dish_Names @desc Map near-duplicate dish names to a canonical dish so the top 10 counts them together.
+        # @PARAM cluster_threshold
+        # @PARAM incremental_load
+        # @IN data_inserted
+        # @IN db_conn
+        # @OUT dish_clusters @URI file:{file_pth}/dish_clusters.csv
+        # @OUT dish_year_counts
+        def cluster_dish_names(dish_clean_final, db_conn, cluster_threshold, incremental_load, file_pth):
+            # fingerprint keys, then MinHash/LSH over the distinct keys (dish_clusters.py)
+            clusters = cluster_dishes(dish_clean_final, cluster_threshold)
+            clusters.to_csv(f"{file_pth}/dish_clusters.csv", index=False)
+            canonical = clusters['canonical_dish_id'].nunique()
+            if incremental_load:
+                # only the counts of the dishes whose canonical name changed are moved
+                stats = incremental.update_dish_clusters(db_conn, clusters)
+                print(f"dish_clusters: {stats['rows']:,} dishes -> {canonical:,} canonical, {stats['changed']:,} changed "
+                      f"in {stats['seconds']:.2f}s, {stats['keys']:,} dish_year_counts adjusted")
+            else:
+                stats = ingest.load_dish_clusters(db_conn, clusters)
+                print(f"dish_clusters: {stats['rows']:,} dishes -> {canonical:,} canonical "
+                      f"in {stats['seconds']:.2f}s, dish_year_counts refreshed in {stats['refresh_seconds']:.2f}s")
+            return clusters
+        dish_clusters = runner.run('Cluster_Dish_Names', cluster_dish_names, dish_clean_final, db_conn, cluster_threshold,
+                                   incremental_load, file_pth, cacheable=False)
+        # @END Cluster_Dish_Names
+    
+    if export_pth is not None:
+        # @BEGIN Export_Parquet @desc Write the cleaned tables and a menu item fact table as Parquet partitioned by year.
+        # @PARAM export_pth
+        # @IN data_inserted
+        # @IN dish_clusters
+        # @OUT parquet_export @URI file:{export_pth}/{table}/year={year}/*.parquet
+        def export_parquet(dish_clean_final, menu_clean_final, menupage_clean_final, menuitem_clean_final, dish_clusters, export_pth):
+            rows = columnar_export.export_parquet({
+                'dish': dish_clean_final,
+                'menu': menu_clean_final,
+                'menu_page': menupage_clean_final,
+                'menu_item': menuitem_clean_final,
+            }, export_pth, dish_clusters)
+            print(f"parquet export: {', '.join(f'{name} {count:,} rows' for name, count in rows.items())}")
+        runner.run('Export_Parquet', export_parquet, dish_clean_final, menu_clean_final, menupage_clean_final,
+                   menuitem_clean_final, dish_clusters, export_pth, cacheable=False)
+        # @END Export_Parquet
+    
     # @BEGIN Query_Top_Dishes @desc Perform a complex SQL query to find the top 10 menu items per year and save the result to a CSV file.
     # @IN issues_diagnose
     # @IN db_cursor @desc Database cursor object.
+    # @IN dish_year_counts
     # @OUT menu_item_historical_frequencies.csv
     def query_top_dishes(db_cursor, file_pth):
         filename = f"{file_pth}/menu_item_historical_frequencies.csv"
-        query = '''
-            SELECT *
-            FROM
-            (
-                    SELECT
-                        CAST(substr(menu.date, 1, 4) as INTEGER) AS Year,
-                        dish.name AS 'DishName',
-                        COUNT(dish.name) AS Occurrences,
-                        ROW_NUMBER () OVER (
-                            PARTITION BY CAST(substr(menu.date, 1, 4) as INTEGER)
-                            ORDER BY COUNT(dish.name) DESC, dish.name
-                        ) Rank
-                    FROM
-                            menu_item
-                            LEFT OUTER JOIN dish ON menu_item.dish_id = dish.id
-                            LEFT OUTER JOIN menu_page ON menu_item.menu_page_id = menu_page.id
-                            LEFT OUTER JOIN menu ON menu_page.menu_id = menu.id
-                    WHERE 
-                            menu_item.dish_id IS NOT NULL AND
-                            menu.date IS NOT NULL AND
-                            menu.date NOT LIKE '0%' AND
-                            menu.date NOT LIKE '10%' AND
-                            dish.id IS NOT NULL AND
-                            (dish.name NOT LIKE '"' AND dish.name NOT LIKE '" %')
-                    GROUP BY Year, dish.name
-            ) t
-            WHERE Rank <= 10
-        '''
+        # dish_year_counts is refreshed by Insert_Data (and Cluster_Dish_Names), so this is a lookup over per-year counts
+        query = ingest.TOP_DISHES_QUERY
         db_cursor.execute(query)
         fields = ['Year', 'DishName', 'Occurrences', 'Rank']
-        rows = db_cursor.fetchall()
     
         with open(filename, 'w') as csvfile:
             csvwriter = csv.writer(csvfile)
             csvwriter.writerow(fields)
-            for row in rows:
-                csvwriter.writerow(list(row))
-    query_top_dishes(db_cursor, file_pth)
+            # rows are written as the cursor yields them, never all held at once
+            csvwriter.writerows(db_cursor)
+    runner.run('Query_Top_Dishes', query_top_dishes, db_cursor, file_pth, cacheable=False)
     # @END Query_Top_Dishes
 
 # @END DataCleaningProject_Workflow3
 
-data_cleaning_project()
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pandas data cleaning workflow for the NYPL menus dataset.')
+    parser.add_argument('--file-pth', default='.')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='stream the cleaning stages over chunks of this many rows instead of loading whole tables')
+    parser.add_argument('--clip-lower', type=int, default=1840)
+    parser.add_argument('--clip-upper', type=int, default=2008)
+    parser.add_argument('--cache-dir', default=None,
+                        help='reuse the outputs of cleaning stages whose inputs and parameters are unchanged '
+                             '(entries are pickles: only use a directory no one else can write)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='clean the four tables in parallel on this many worker processes')
+    parser.add_argument('--compact-dtypes', action='store_true',
+                        help='load the tables with the memory-compact schema from schema.py')
+    parser.add_argument('--cluster-dishes', type=float, default=None, metavar='THRESHOLD',
+                        help='merge near-duplicate dish names (3-gram Jaccard >= THRESHOLD, e.g. 0.6) before the top 10 query')
+    parser.add_argument('--export-parquet', default=None, metavar='DIR',
+                        help='also write the cleaned tables and a menu item fact table as year-partitioned Parquet')
+    parser.add_argument('--incremental', action='store_true',
+                        help='upsert only the new and changed rows into an existing restaurant_menus.db instead of reloading it '
+                             '(the whole archive is still cleaned and hashed)')
+    parser.add_argument('--max-year', type=int, default=dates.MAX_YEAR,
+                        help='last year accepted for menu and menu item dates; later ones are listed in invalid_dates.csv')
+    parser.add_argument('--trace', default=None,
+                        help='write per-stage time, memory, rows and I/O to this JSON file')
+    parser.add_argument('--profile', nargs='+', default=[], metavar='STAGE',
+                        help='run these stages under cProfile (needs --trace; .prof files go next to it)')
+    parser.add_argument('--tracemalloc', nargs='+', default=[], metavar='STAGE',
+                        help='trace the Python allocations of these stages (needs --trace)')
+    args = parser.parse_args()
+    if args.workers is not None and args.chunksize is not None:
+        parser.error('--workers and --chunksize are exclusive: clean in parallel or stream, not both')
+    tracer = None
+    if args.trace is not None:
+        tracer = StageTracer(args.profile, args.tracemalloc, profile_dir=os.path.dirname(os.path.abspath(args.trace)))
+    hooks = [tracer] if tracer is not None else []
+    try:
+        data_cleaning_project(args.file_pth, args.chunksize, args.clip_lower, args.clip_upper, args.cache_dir, args.workers,
+                              args.compact_dtypes, args.cluster_dishes, args.export_parquet, args.incremental, args.max_year, hooks)
+    finally:
+        # also when a stage failed, to see how far the run got
+        if tracer is not None:
+            tracer.write(args.trace, __file__)